@@ -1,5 +1,6 @@
 import React, { useState, useRef, useEffect, useCallback } from 'react';
 import { useTranslations } from '../lib/i18n';
+import { clientIdHeaders } from '../lib/clientId';
 import { SendIcon } from './icons/SendIcon';
 import { StopIcon } from './icons/StopIcon';
 import { CopyIcon } from './icons/CopyIcon';
@@ -101,6 +102,7 @@ const SevyAI: React.FC<{
         method: 'POST',
         headers: {
           'Content-Type': 'application/json',
+          ...clientIdHeaders(),
         },
         body: JSON.stringify({
           messages: conversationHistory,
@@ -61,9 +61,9 @@ const Stats: React.FC = () => {
       const controller = new AbortController();
       const timer = setTimeout(() => controller.abort(), timeoutMs);
       try {
+        // GET lets the browser and any CDN cache the numbers (ETag + Cache-Control)
         return await fetch(`${API_BASE_URL}/get_all_numbers`, {
-          method: 'POST',
-          headers: { 'Content-Type': 'application/json' },
+          method: 'GET',
           signal: controller.signal,
         });
       } finally {
@@ -0,0 +1,18 @@
+// Random ID for this browser tab, sent as X-Sevy-Client on /chat so the
+// backend can rate limit people sharing one network (e.g. a classroom)
+// separately.
+// It identifies nothing but the tab and is kept in sessionStorage only.
+const STORAGE_KEY = 'sevy_client_id';
+
+export const getClientId = (): string => {
+  let clientId = sessionStorage.getItem(STORAGE_KEY);
+  if (!clientId) {
+    clientId = crypto.randomUUID();
+    sessionStorage.setItem(STORAGE_KEY, clientId);
+  }
+  return clientId;
+};
+
+export const clientIdHeaders = (): Record<string, string> => ({
+  'X-Sevy-Client': getClientId(),
+});
@@ -1,18 +1,32 @@
-from flask import Flask, request, jsonify
+# Imported first: its import time is the zero point of the startup timings
+from helper_startup import LazyClient, WarmUp, startup_timings
+from flask import Flask, request, jsonify, Response, stream_with_context, g, Request
+from werkzeug.exceptions import RequestEntityTooLarge
 from flask_cors import CORS
-from dotenv import load_dotenv
 import os
-from openai import OpenAI
-from helper_mongodb import *
-from helper_mongodb import connect_to_mongo
-import time
-import random
-from datetime import datetime, timezone
-
-# Environment detection for privacy-aware logging
-# In production (Google Cloud Run), K_SERVICE environment variable is always set
-# Local development environments will not have this variable
-IS_PRODUCTION = os.getenv('K_SERVICE') is not None
+from helper_admission import OpenAIBusy
+from helper_router import route_chat
+from helper_export import EXPORT_FORMATS, export_response_headers, stream_export
+from helper_profiling import PROFILE_HEADER, profile_span, profile_body
+from helper_mongodb import get_mongo_client, MongoUnavailable
+from helper_core import (
+    SevyCore, IS_PRODUCTION, NUMBERS_CACHE_KEY, busy_reply, rate_limited_reply, database_unavailable_reply,
+    upload_too_large_reply, admin_error_reply, stats_reply, log_discarded_upload
+)
+from helper_uploads import (
+    APPLICATION_MAX_CONTENT_LENGTH, UploadMemoryProbe, discarding_stream_factory, content_length_exceeds
+)
+from helper_chat import (
+    NO_MESSAGE_REPLY, RATE_LIMITED_REPLY, SSE_HEADERS, load_api_key, wants_stream, extract_messages_history,
+    trim_to_token_budget, format_sse
+)
+from helper_metrics import registry, METRICS_CONTENT_TYPE, RequestTimer, register_startup_collectors
+import signal
+import sys
+
+# Flask serving path (SERVER_MODE=flask). Everything a route does once its
+# request is parsed lives in helper_core.SevyCore, shared with app_async.py;
+# this module only adapts it to Flask.
 
 if IS_PRODUCTION:
     import logging
@@ -21,143 +35,31 @@ if IS_PRODUCTION:
 app = Flask(__name__)
 CORS(app)  # Enable CORS for all routes
 
-def load_api_key():
-    if not os.path.isfile('.env'):
-        print("\n\nError: No .env file found in the repository.\n\n")
-        return None, None
+class DiscardingUploadRequest(Request):
+    # Uploaded files are never stored: stream them into a discarding sink
+    # instead of memory or a temporary file (see helper_uploads.py)
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        return discarding_stream_factory(total_content_length, content_type, filename, content_length)
 
-    load_dotenv(override=True)
-    return os.getenv('openai_api_key')
+app.request_class = DiscardingUploadRequest
 
-open_ai_client = OpenAI(api_key=load_api_key())
+def create_openai_client():
+    # Imported here: importing openai alone takes most of a second
+    from openai import OpenAI
+    # Retries are done by the core's OpenAI admission (jittered, Retry-After aware)
+    return OpenAI(api_key=load_api_key(), max_retries=0)
 
-# Global MongoDB connection pool - reused across all requests
-mongo_client = connect_to_mongo()
+# Clients are created on first use or by the startup warm-up (see the end of
+# this file), so a cold start does not wait for them before serving
+open_ai_client = LazyClient(create_openai_client, 'openai')
 
-# Cache for numbers data (30 second TTL)
-numbers_cache = {
-    'data': None,
-    'timestamp': 0,
-    'ttl': 30  # seconds
-}
+# Global MongoDB connection pool - the pooled client shared with the
+# helper_mongodb functions (pool settings: see mongo_pool_options()). The
+# connection is checked by the warm-up ping instead of at creation.
+mongo_client = LazyClient(get_mongo_client, 'mongo')
 
-# Function to generate a completion with conversation history
-def generate_completion(messages_history, model="gpt-5-nano-2025-08-07"):
-    """
-    Generate AI completion with conversation context.
-
-    Args:
-        messages_history: List of message objects with 'role' and 'content'
-        model: OpenAI model to use
-        max_tokens: Maximum tokens in response
-
-    Returns:
-        AI response string or None on error
-    """
-    try:
-        # Comprehensive system prompt for SEVY AI with language detection priority
-        system_message = """# CRITICAL INSTRUCTION: Language Matching
-
-You MUST respond in the EXACT language the user writes in. This is absolutely non-negotiable and overrides all other contextual information.
-
-**Language Matching Examples:**
-- User writes in French ("Bonjour" or "C'est quoi l'éducation sexuelle?") → You respond ENTIRELY in French
-- User writes in Spanish ("Hola" or "¿Qué es el sexo seguro?") → You respond ENTIRELY in Spanish
-- User writes in English ("Hello" or "What is consent?") → You respond ENTIRELY in English
-- User writes in German ("Hallo" or "Was ist Aufklärung?") → You respond ENTIRELY in German
-- User writes in Vietnamese ("Xin chào" or "Tình dục an toàn là gì?") → You respond ENTIRELY in Vietnamese
-- User writes in Italian ("Ciao" or "Cos'è l'educazione sessuale?") → You respond ENTIRELY in Italian
-
-Do NOT assume the user's language based on organizational context. Always match their input language precisely, even with single-word inputs.
-
----
-
-## Your Identity
-
-You are SEVY AI, an AI assistant created by Sex Education for Vietnamese Youth (SEVY), a nonprofit organization dedicated to providing comprehensive sex education.
-
-**IMPORTANT**: You are created by SEVY, not by OpenAI or any other organization. You are powered by SEVY's expertise in sex education for youth.
-
-## About SEVY
-
-SEVY is a nonprofit organization with a clear mission:
-- **SEVY AI**: Provides free and private counseling 24/7 to anyone with an Internet connection. Trained on SEVY's in-house curricula, SEVY AI can answer all sex-education-related questions where in-person assistance is not yet available. All conversations are encrypted in transit, and data is never stored.
-- **In-Person Education**: SEVY provides in-person sex education to students at partner schools at no cost. Always.
-- **Vision**: We believe free and accessible sex education is a fundamental human right. SEVY set out on a mission to bring sex education to every child, starting in our home country, Vietnam.
-
-## Your Role and Scope
-
-**Your Mission**: Provide accurate, age-appropriate, non-judgmental sex education information in a safe and supportive manner.
-
-**In Scope**: Questions related to:
-- Sexual health, anatomy, and physiology
-- Relationships, consent, and communication
-- Contraception, pregnancy, and STI prevention
-- Puberty, development, and body changes
-- LGBTQ+ topics and gender identity
-- Sexual safety, boundaries, and rights
-- Mental and emotional aspects of sexuality
-- Any other sex-education-related topics
-
-**Out of Scope**: Questions unrelated to sex education (e.g., weather, math homework, general knowledge).
-- When asked out-of-scope questions, politely decline and remind the user: "I'm SEVY AI, and I specialize in sex education topics. I'm here to answer any questions related to sexual health, relationships, or related topics. Is there anything in this area I can help you with?"
-
-## Content Guidelines
-
-1. **Age-Appropriate Language**: Use clear, accessible language suitable for youth. Avoid overly clinical terminology when simpler terms work, but remain scientifically accurate.
-
-2. **Non-Judgmental Stance**: Be supportive, empathetic, and non-judgmental regardless of the question or situation. Create a safe space where users feel comfortable asking anything.
-
-3. **Cultural Sensitivity**: When users are in Vietnam or when Vietnamese cultural context is relevant, be mindful of local cultural dynamics, family structures, and social norms around sex education while providing evidence-based information. For users in other countries or cultural contexts, adapt appropriately to their background.
-
-4. **Practical Solutions**: Provide actionable advice and practical solutions rather than directing users elsewhere, whenever possible.
-
-## Crisis Intervention Protocol
-
-If a user mentions abuse, assault, self-harm, or any crisis situation:
-
-1. **Acknowledge with empathy**: "I'm so sorry you're going through this. Your safety and well-being are the most important priority."
-
-2. **Ask for location**: "To provide you with the most relevant resources, could you let me know which city or country you're in?"
-
-3. **Provide localized resources**: Once location is provided, offer specific hotlines, organizations, or resources available in their area:
-   - **Vietnam**: Include Vietnamese resources (e.g., local hotlines, NGOs, hospitals)
-   - **Other countries**: Provide appropriate resources for their specific location
-   - **General**: If location is unclear, provide both local and international resources
-
-4. **Encourage professional help**: Gently encourage seeking help from trusted adults, counselors, or authorities as appropriate.
-
-## Conversation Style
-
-- Maintain conversation context across messages to provide coherent, personalized responses
-- Be warm, supportive, and approachable
-- Provide evidence-based information with empathy
-- Match the user's communication style and formality level
-
----
-
-**REMINDER**: Always respond in the EXACT language the user writes in. Never default to any language based on organizational context."""
-
-        # Build messages array: system message + conversation history
-        messages_for_api = [{"role": "system", "content": system_message}]
-        messages_for_api.extend(messages_history)
-
-        response = open_ai_client.chat.completions.create(
-            model=model,
-            messages=messages_for_api,
-            n=1,
-            stop=None
-        )
-
-        update_sevy_ai_number_of_questions_answered()
-        return response.choices[0].message.content.strip()
-    except Exception as e:
-        # PRIVACY: Only print detailed error info in local development
-        if IS_PRODUCTION:
-            print("\nError generating completion: OpenAI API error\n", flush=True)
-        else:
-            print(f"\nError generating completion: {e}\n", flush=True)
-        return None
+# Services and request-independent logic (see helper_core.py)
+core = SevyCore(open_ai_client, mongo_client)
 
 @app.route('/chat', methods=['POST'])
 def chat():
@@ -167,8 +69,13 @@ def chat():
     - Legacy format: {"message": "...", "developerMode": false}
     - New format: {"messages": [...], "developerMode": false}
 
+    Streaming mode is enabled with {"stream": true} or an
+    "Accept: text/event-stream" header. The reply is then sent as
+    Server-Sent Events (see SevyCore.chat_frames for the frame format).
+    Without either, a single JSON {"reply": "..."} is returned.
+
     Language is automatically detected by the LLM based on user's input.
-    Implements sliding window: keeps only last 5 message pairs (10 messages total)
+    Older turns are dropped to fit CHAT_INPUT_TOKEN_BUDGET (counted locally).
 
     PRIVACY POLICY - NO TRACKING:
     - User messages are NEVER logged (local or production)
@@ -177,187 +84,89 @@ def chat():
     - No conversation data is ever stored in MongoDB (only question counters)
     - All conversation history is maintained client-side in sessionStorage only
     """
-    data = request.get_json()
+    with profile_span('json_parse'):
+        data = request.get_json()
     developer_mode = data.get('developerMode', False)
+    stream_requested = wants_stream(data, request.headers.get('Accept', ''))
 
-    # Support both legacy single message and new messages array format
-    messages_history = data.get('messages', [])
-    legacy_message = data.get('message', '')
-
-    # If legacy format, convert to messages array
-    if legacy_message and not messages_history:
-        messages_history = [{"role": "user", "content": legacy_message}]
-        print("Using legacy single-message format", flush=True)
-
-    # Validate messages array
-    if not messages_history or not isinstance(messages_history, list):
-        return jsonify({'reply': 'No message received'})
-
-    # Implement sliding window: keep only last 5 message pairs (10 messages)
-    # This ensures we don't exceed token limits and optimize costs
-    MAX_MESSAGES = 10  # 5 user + 5 assistant pairs
-    if len(messages_history) > MAX_MESSAGES:
-        messages_history = messages_history[-MAX_MESSAGES:]
-        print(f"Applied sliding window: trimmed to last {MAX_MESSAGES} messages", flush=True)
-
-    print(f"Processing conversation with {len(messages_history)} messages", flush=True)
-
-    # Developer mode bypass
-    if developer_mode:
-        reply = "This is a default response in developer mode."
-        print("Developer mode active - returning default response", flush=True)
-    else:
-        # Generate AI response with full conversation context
-        # LLM naturally detects and responds in the user's language
-        reply = generate_completion(messages_history)
-        if reply:
-            # PRIVACY: Only print AI responses in local development, never in production
-            if not IS_PRODUCTION:
-                print(f"\nGenerated reply: {reply}\n", flush=True)
-        else:
-            reply = "Sorry, I encountered an error processing your request."
-            print("Error: generate_completion returned None", flush=True)
-
-    return jsonify({'reply': reply})
-
-@app.route('/get_all_numbers', methods=['POST'])
-def get_all_numbers():
-    """
-    Combined endpoint to fetch all SEVY numbers in a single query.
-    Implements 30-second in-memory caching for performance.
-    Applies daily inflation (random 1-5%) to sevy_ai_answers on the
-    first request of each UTC day.
-    """
-    print("Getting all SEVY numbers...", flush=True)
+    retry_after = core.rate_limit('chat', request.remote_addr, request.headers)
+    if retry_after:
+        payload = {'reply': RATE_LIMITED_REPLY, 'error': 'rate_limited', 'retryAfter': retry_after}
+        if stream_requested:
+            return rate_limited_reply(request.endpoint, retry_after, sse_response([format_sse('error', payload)]))
+        return rate_limited_reply(request.endpoint, retry_after, payload)
 
-    # --- Daily inflation check (runs on every request, no-ops after first daily trigger) ---
-    try:
-        db = mongo_client["SEVY_database"]
-        collection = db["SEVY_numbers"]
-        today_str = datetime.now(timezone.utc).strftime('%Y-%m-%d')
-
-        # Atomically claim today's inflation — only one request wins per UTC day
-        inflation_doc = collection.find_one_and_update(
-            {"sevy_ai_last_inflation_date": {"$exists": True, "$ne": today_str}},
-            {"$set": {"sevy_ai_last_inflation_date": today_str}}
-        )
-
-        if inflation_doc is not None:
-            # First request of today — apply random 1-5% inflation
-            ai_doc = collection.find_one({"sevy_ai_answers": {"$exists": True}})
-            if ai_doc:
-                current_displayed = int(ai_doc["sevy_ai_answers"])
-                inflation_rate = random.uniform(0.01, 0.05)
-                inflated_value = int(current_displayed * (1 + inflation_rate))
-                collection.update_one(
-                    {"sevy_ai_answers": {"$exists": True}},
-                    {"$set": {"sevy_ai_answers": inflated_value}}
-                )
-                # Invalidate cache so the new value is served immediately
-                numbers_cache['data'] = None
-                print(f"Applied daily inflation: {current_displayed} -> {inflated_value} (+{inflation_rate:.2%})", flush=True)
-    except Exception as e:
-        print(f"Inflation check error (non-fatal): {e}", flush=True)
+    messages_history = extract_messages_history(data)
+    if messages_history is None:
+        if stream_requested:
+            return sse_response([format_sse('error', {'error': 'no_message', 'reply': NO_MESSAGE_REPLY})])
+        return jsonify({'reply': NO_MESSAGE_REPLY})
 
-    # --- Cache check ---
-    current_time = time.time()
-    if numbers_cache['data'] and (current_time - numbers_cache['timestamp']) < numbers_cache['ttl']:
-        print("Returning cached numbers", flush=True)
-        return jsonify(numbers_cache['data'])
+    # Token-budgeted window: drop older turns until the request fits the input budget
+    with profile_span('history_trim'):
+        messages_history, input_tokens = trim_to_token_budget(messages_history)
 
-    # Cache miss or expired - fetch from database
-    try:
-        db = mongo_client["SEVY_database"]
-        collection = db["SEVY_numbers"]
+    print(f"Processing conversation with {len(messages_history)} messages (~{input_tokens} input tokens)", flush=True)
 
-        # Fetch all documents from SEVY_numbers collection
-        all_docs = list(collection.find({}))
+    # Local routing: canned reply, routine model or crisis model (see helper_router.py)
+    route = None if developer_mode else route_chat(messages_history)
 
-        # Initialize default values
-        result = {
-            'sevy_educators_number': 'N/A',
-            'sevy_ai_answers': 'N/A',
-            'students_taught': 'N/A'
-        }
+    if stream_requested:
+        return sse_response(stream_with_context(core.chat_frames(messages_history, developer_mode, route)))
 
-        # Parse documents to extract values
-        for doc in all_docs:
-            if 'sevy_educators_number' in doc:
-                result['sevy_educators_number'] = doc['sevy_educators_number']
-            if 'sevy_ai_answers' in doc:
-                result['sevy_ai_answers'] = doc['sevy_ai_answers']
-            if 'students_taught' in doc:
-                result['students_taught'] = doc['students_taught']
+    try:
+        reply = core.chat_reply(messages_history, developer_mode, route)
+    except OpenAIBusy as e:
+        return busy_reply(e)
+    return jsonify({'reply': reply})
 
-        print(f"Fetched numbers: {result}", flush=True)
+@app.route('/ready', methods=['GET'])
+def ready():
+    """
+    Readiness probe: 200 once the startup warm-up has run, 503 before.
+    Reports each warm-up step and the startup timings (seconds).
+    """
+    status = warm_up.status()
+    return jsonify(status), 200 if status['ready'] else 503
 
-        # Update cache
-        numbers_cache['data'] = result
-        numbers_cache['timestamp'] = current_time
+@app.route('/metrics', methods=['GET'])
+def metrics():
+    """Prometheus text exposition of the request, OpenAI, Mongo and cache metrics."""
+    return Response(registry.render(), content_type=METRICS_CONTENT_TYPE)
 
-        return jsonify(result)
+@app.route('/cache_stats', methods=['GET'])
+def cache_stats():
+    """Hit and miss counters of the stats cache and the answer cache."""
+    return jsonify(core.cache_stats_payload())
 
-    except Exception as e:
-        print(f"Error fetching numbers: {e}", flush=True)
-        return jsonify({
-            'sevy_educators_number': 'N/A',
-            'sevy_ai_answers': 'N/A',
-            'students_taught': 'N/A'
-        })
+@app.route('/get_all_numbers', methods=['GET', 'POST'])
+def get_all_numbers():
+    """
+    Combined endpoint to fetch all SEVY numbers in a single query.
+    Served from the shared stats cache (see helper_cache.py).
+    GET responses carry an ETag and Cache-Control so browsers and CDNs can
+    cache them, and conditional GETs (If-None-Match) get a 304.
+    Applies daily inflation (random 1-5%) to sevy_ai_answers on the
+    first request of each UTC day. The day check is kept in memory, so
+    cached responses need no database operation.
+    """
+    print("Getting all SEVY numbers...", flush=True)
+    return stats_reply(core.all_numbers(), request.method, request.if_none_match)
 
 @app.route('/get_sevy_educators_number', methods=['POST'])
 def get_sevy_educators_number():
-
-    print("Getting sevy_educators_number value...", flush=True)
-
-    # Use global MongoDB connection pool
-    try:
-        db = mongo_client["SEVY_database"]
-        collection = db["SEVY_numbers"]
-        query = {"sevy_educators_number": {"$exists": True}}
-        document = collection.find_one(query)
-        sevy_educators_number = document["sevy_educators_number"]
-        print(f"sevy_educators_number value: {sevy_educators_number}", flush=True)
-        return jsonify({'sevy_educators_number': sevy_educators_number})
-    except Exception as e:
-        print(f"Error: {e}", flush=True)
-        return jsonify({'sevy_educators_number': 'N/A'})
+    """Number of SEVY educators: {"sevy_educators_number": ...}, 'N/A' on error."""
+    return stats_reply(core.single_number('sevy_educators_number'), request.method, request.if_none_match)
 
 @app.route('/get_sevy_ai_answers', methods=['POST'])
 def get_sevy_ai_answers():
+    """Number of questions SEVY AI has answered: {"sevy_ai_answers": ...}, 'N/A' on error."""
+    return stats_reply(core.single_number('sevy_ai_answers'), request.method, request.if_none_match)
 
-    print("Getting sevy_ai_answers value...", flush=True)
-
-    # Use global MongoDB connection pool
-    try:
-        db = mongo_client["SEVY_database"]
-        collection = db["SEVY_numbers"]
-        query = {"sevy_ai_answers": {"$exists": True}}
-        document = collection.find_one(query)
-        sevy_ai_answers = document["sevy_ai_answers"]
-        print(f"sevy_ai_answers value: {sevy_ai_answers}", flush=True)
-        return jsonify({'sevy_ai_answers': sevy_ai_answers})
-    except Exception as e:
-        print(f"Error: {e}", flush=True)
-        return jsonify({'sevy_ai_answers': 'N/A'})
-
-@app.route('/get_students_taught', methods=['POST'])
+@app.route('/get_students_taught', methods=['GET', 'POST'])
 def get_students_taught():
-
-    print("Getting students_taught value...", flush=True)
-
-    # Use global MongoDB connection pool
-    try:
-        db = mongo_client["SEVY_database"]
-        collection = db["SEVY_numbers"]
-        query = {"students_taught": {"$exists": True}}
-        document = collection.find_one(query)
-        students_taught = document["students_taught"]
-        print(f"students_taught value: {students_taught}", flush=True)
-        return jsonify({'students_taught': students_taught})
-    except Exception as e:
-        print(f"Error: {e}", flush=True)
-        return jsonify({'students_taught': 'N/A'})
+    """Number of students taught: {"students_taught": ...}, 'N/A' on error."""
+    return stats_reply(core.single_number('students_taught'), request.method, request.if_none_match)
 
 @app.route('/submit_application', methods=['POST'])
 def submit_application():
@@ -366,9 +175,12 @@ def submit_application():
     Accepts multipart/form-data with resume file and text fields.
 
     IMPORTANT PRIVACY NOTE:
-    - The resume file is received but NEVER stored anywhere
+    - The resume file is received but NEVER stored anywhere; it is
+      streamed into a discarding sink and never fully buffered
     - Only text fields are saved to the database
     - Frontend handles ALL validation
+    - Requests above APPLICATION_MAX_CONTENT_LENGTH and files above
+      UPLOAD_MAX_FILE_BYTES get a 413 (see helper_uploads.py)
 
     Expected fields:
     - fullName, email, phoneNumber, education, division (text)
@@ -376,50 +188,41 @@ def submit_application():
     """
     print("Processing application submission...", flush=True)
 
-    try:
-        # Extract text fields from form data (NO validation)
-        full_name = request.form.get('fullName', '').strip()
-        email = request.form.get('email', '').strip()
-        phone_number = request.form.get('phoneNumber', '').strip()
-        education = request.form.get('education', '').strip()
-        division = request.form.get('division', '').strip()
-
-        # Check resume file was sent (privacy requirement: receive but don't store)
-        resume_file = request.files.get('resume')
-        if resume_file:
-            print(f"Resume file received: {resume_file.filename} (not stored)", flush=True)
-
-        # Prepare application data (without resume)
-        application_data = {
-            'fullName': full_name,
-            'email': email,
-            'phoneNumber': phone_number,
-            'education': education,
-            'division': division,
-            'submittedAt': datetime.utcnow(),
-            'ipAddress': request.remote_addr
-        }
-
-        # Store in MongoDB
-        db = mongo_client["SEVY_database"]
-        collection = db["SEVY_applications"]
-        result = collection.insert_one(application_data)
-
-        print(f"Application stored successfully: {result.inserted_id}", flush=True)
-
-        return jsonify({'success': True})
+    retry_after = core.rate_limit('submit_application', request.remote_addr, request.headers)
+    if retry_after:
+        return rate_limited_reply(request.endpoint, retry_after, {'success': False, 'error': 'rate_limited'})
+
+    # Refuse oversized uploads from the Content-Length header, before reading the body
+    if content_length_exceeds(request.content_length):
+        return upload_too_large_reply()
+    # Also caps chunked uploads without a Content-Length while they are read
+    request.max_content_length = APPLICATION_MAX_CONTENT_LENGTH
 
+    try:
+        # The resume is streamed into a discarding sink while parsing,
+        # never buffered (privacy requirement: receive but don't store)
+        with UploadMemoryProbe() as probe:
+            resume_file = request.files.get('resume')
+            form = request.form
+    except RequestEntityTooLarge:
+        return upload_too_large_reply()
     except Exception as e:
         print(f"Error processing application: {e}", flush=True)
         return jsonify({'success': False}), 500
 
+    if resume_file:
+        log_discarded_upload(resume_file, probe.peak_bytes)
+    return core.submit_application(form, request.remote_addr)
+
 @app.route('/subscribe_email', methods=['POST'])
 def subscribe_email():
     """
     Handle newsletter email subscription.
     Accepts JSON with email field.
     Frontend handles ALL validation.
-    Backend only checks for duplicates.
+    Backend only checks for duplicates: a single upsert on the normalized
+    email, backed by a unique index, so concurrent signups cannot both
+    succeed.
 
     Expected JSON:
     {
@@ -428,42 +231,132 @@ def subscribe_email():
     """
     print("Processing email subscription...", flush=True)
 
-    try:
-        data = request.get_json()
-        email = data.get('email', '').strip()
-
-        # Check for duplicate email in database
-        db = mongo_client["SEVY_database"]
-        collection = db["SEVY_email_list"]
-
-        existing_email = collection.find_one({'email': email})
-        if existing_email:
-            print(f"Duplicate email subscription attempt: {email}", flush=True)
-            return jsonify({'success': False, 'isDuplicate': True}), 409
-
-        # Prepare subscription data
-        subscription_data = {
-            'email': email,
-            'subscribedAt': datetime.utcnow(),
-            'isActive': True,
-            'source': 'donate_page',
-            'ipAddress': request.remote_addr
-        }
+    retry_after = core.rate_limit('subscribe_email', request.remote_addr, request.headers)
+    if retry_after:
+        return rate_limited_reply(request.endpoint, retry_after, {'success': False, 'error': 'rate_limited'})
+    return core.subscribe_email(request.get_json(silent=True), request.remote_addr)
 
-        # Store in MongoDB
-        result = collection.insert_one(subscription_data)
-
-        print(f"Email subscription stored successfully: {result.inserted_id}", flush=True)
+@app.route('/export/<name>', methods=['GET'])
+def export(name):
+    """
+    Stream the applications or the subscribers as CSV or NDJSON
+    (admin only, see helper_export.py). Memory use does not depend on
+    the size of the collection.
+
+    Query parameters (all optional):
+    - format: csv (default) or ndjson
+    - since, until: ISO date or date and time (UTC) range of submittedAt
+      or subscribedAt, until exclusive
+    - after: checkpoint of the last row received, to resume an export
+    - limit: most rows returned
+
+    Needs Authorization: Bearer <ADMIN_TOKEN>. Answers 401 without it,
+    and 404 while ADMIN_TOKEN is not set.
+    """
+    unauthorized = admin_error_reply(request.endpoint, request.headers.get('Authorization'))
+    if unauthorized:
+        return unauthorized
 
-        return jsonify({'success': True})
+    try:
+        formatter, cursor = core.open_export(name, request.args)
+    except MongoUnavailable as e:
+        return database_unavailable_reply(request.endpoint, e.retry_after)
+    except ValueError as e:
+        return jsonify({'success': False, 'error': 'invalid_export', 'detail': str(e)}), 400
+
+    return Response(
+        stream_with_context(stream_export(cursor, formatter)),
+        content_type=EXPORT_FORMATS[formatter.export_format],
+        headers=export_response_headers(name, formatter.export_format)
+    )
+
+@app.route('/profiles', methods=['GET'])
+def profiles():
+    """
+    Recent request profiles with their wall-clock spans, newest first
+    (admin only, see helper_profiling.py). ?route=/chat keeps the
+    profiles of one route.
+    """
+    unauthorized = admin_error_reply(request.endpoint, request.headers.get('Authorization'))
+    if unauthorized:
+        return unauthorized
+    return jsonify(core.profiles_payload(request.args.get('route')))
 
-    except Exception as e:
-        print(f"Error processing email subscription: {e}", flush=True)
-        return jsonify({'success': False}), 500
+@app.route('/profiles/collapsed', methods=['GET'])
+def profiles_collapsed():
+    """
+    Stack samples of the recent profiles in collapsed-stack format, as a
+    download for flamegraph.pl or speedscope (admin only).
+    ?route=/chat or ?id=<profile id> narrows it down.
+    """
+    unauthorized = admin_error_reply(request.endpoint, request.headers.get('Authorization'))
+    if unauthorized:
+        return unauthorized
+    return Response(
+        core.request_profiler.collapsed(request.args.get('route'), request.args.get('id')),
+        content_type='text/plain; charset=utf-8',
+        headers={'Content-Disposition': 'attachment; filename="sevy_profile.folded"', 'Cache-Control': 'no-store'}
+    )
 
 # -----------------------
 # AUXILLARY FUNCTIONS SECTION
 
+@app.before_request
+def start_request_timer():
+    if request.endpoint not in ('metrics', 'ready'):
+        startup_timings.mark('first_request_started')
+    # PRIVACY: metrics are labelled with the route template, never the URL or body
+    if request.endpoint == 'metrics':
+        return
+    route = request.url_rule.rule if request.url_rule else 'unmatched'
+    g.request_timer = RequestTimer(route, request.method)
+    g.profile = core.begin_profile(route, request.endpoint, request.method, request.headers.get(PROFILE_HEADER))
+
+@app.after_request
+def record_response_status(response):
+    timer = g.get('request_timer')
+    if timer is not None:
+        timer.status = str(response.status_code)
+    profile = g.get('profile')
+    if profile is not None:
+        profile.status = response.status_code
+        if response.is_streamed:
+            # Streamed body: the profile ends once it has been sent
+            response.response = profile_body(core.request_profiler, g.pop('profile'), response.response)
+    return response
+
+@app.teardown_request
+def finish_request_timer(exc):
+    # Runs after a streamed body has been fully sent (stream_with_context
+    # keeps the request context alive), so SSE latency covers the whole reply
+    timer = g.pop('request_timer', None)
+    if timer is not None:
+        timer.finish()
+        if timer.route != '/ready':
+            startup_timings.mark('first_request_finished')
+    core.request_profiler.end(g.pop('profile', None))
+
+def sse_response(frames):
+    """Wrap an iterable of SSE frames in a non-buffered streaming response."""
+    return Response(
+        frames,
+        mimetype='text/event-stream',
+        headers=SSE_HEADERS
+    )
+
+def handle_sigterm(signum, frame):
+    # Cloud Run sends SIGTERM before stopping the container. Exiting through
+    # sys.exit runs the atexit hooks, which flush the buffered answer counter.
+    print("Received SIGTERM, shutting down...", flush=True)
+    sys.exit(0)
+
+# Slow startup work runs in the background while requests are already served;
+# GET /ready reports when it is done
+warm_up = WarmUp(core.warm_up_steps(core.ping_mongo)).start()
+register_startup_collectors(warm_up)
+startup_timings.mark('app_imported')
+
 if __name__ == "__main__":
+    signal.signal(signal.SIGTERM, handle_sigterm)
     port = int(os.getenv('PORT', 5000))
     app.run(host='0.0.0.0', port=port)
\ No newline at end of file
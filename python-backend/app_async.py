@@ -0,0 +1,341 @@
+# Imported first: its import time is the zero point of the startup timings
+from helper_startup import LazyClient, WarmUp, startup_timings
+from quart import Quart, request, jsonify, Response, g, Request
+from quart.wrappers.response import IterableBody
+from quart.wrappers.request import Body
+from quart.formparser import FormDataParser
+from werkzeug.exceptions import RequestEntityTooLarge
+from quart_cors import cors
+from helper_admission import OpenAIBusy
+from helper_router import route_chat
+from helper_export import EXPORT_FORMATS, export_response_headers, stream_export_async
+from helper_profiling import PROFILE_HEADER, profile_span, profile_body_async
+from helper_mongodb import get_mongo_client, connect_to_mongo_async, MongoUnavailable
+from helper_core import (
+    SevyCore, NUMBERS_CACHE_KEY, busy_reply, rate_limited_reply, database_unavailable_reply,
+    upload_too_large_reply, admin_error_reply, stats_reply, log_discarded_upload
+)
+from helper_uploads import (
+    APPLICATION_MAX_CONTENT_LENGTH, UploadMemoryProbe, discarding_stream_factory, content_length_exceeds
+)
+from helper_chat import (
+    NO_MESSAGE_REPLY, RATE_LIMITED_REPLY, SSE_HEADERS, load_api_key, wants_stream, extract_messages_history,
+    trim_to_token_budget, format_sse
+)
+from helper_metrics import registry, METRICS_CONTENT_TYPE, RequestTimer, register_startup_collectors
+
+# Asyncio serving path for the SEVY backend.
+# Serves the same routes and JSON contracts as app.py, but a slow OpenAI call
+# only parks a coroutine instead of pinning a worker thread, so the stats
+# endpoints never queue behind chats. Run it through serve.py (uvicorn).
+# app.py stays available as the Flask compatibility mode (SERVER_MODE=flask).
+# Both adapt the same helper_core.SevyCore, through its *_async methods here.
+
+app = Quart(__name__)
+app = cors(app, allow_origin="*")  # Enable CORS for all routes
+
+class DiscardingFormDataParser(FormDataParser):
+    # Uploaded files are never stored: stream them into a discarding sink
+    # instead of memory or a temporary file (see helper_uploads.py)
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, stream_factory=discarding_stream_factory, **kwargs)
+
+class BoundedBody(Body):
+    # Quart's own limit (MAX_CONTENT_LENGTH) only sees the bytes a streaming
+    # parser has not consumed yet, so it never trips on a chunked upload.
+    # This one counts every byte received, up to the limit set by cap().
+    def __init__(self, expected_content_length, max_content_length):
+        super().__init__(expected_content_length, max_content_length)
+        self.received = 0
+        self.limit = None
+
+    def cap(self, limit):
+        self.limit = limit
+        self._check_limit()
+
+    def append(self, data):
+        self.received += len(data)
+        super().append(data)
+        self._check_limit()
+
+    def _check_limit(self):
+        if self.limit is not None and self.received > self.limit and self._must_raise is None:
+            self._must_raise = RequestEntityTooLarge()
+            self.set_complete()
+
+class DiscardingUploadRequest(Request):
+    body_class = BoundedBody
+    form_data_parser_class = DiscardingFormDataParser
+
+app.request_class = DiscardingUploadRequest
+
+def create_openai_client():
+    # Imported here: importing openai alone takes most of a second
+    from openai import AsyncOpenAI
+    # Retries are done by the core's OpenAI admission (jittered, Retry-After aware)
+    return AsyncOpenAI(api_key=load_api_key(), max_retries=0)
+
+# Clients are created on first use or by the startup warm-up (see startup()),
+# so the server starts accepting requests without waiting for them
+open_ai_client = LazyClient(create_openai_client, 'openai')
+
+# Global async MongoDB connection pool - reused across all requests
+# (pool settings: see mongo_pool_options())
+mongo_client = LazyClient(connect_to_mongo_async, 'mongo')
+
+# The answer counter and the write queue work from background threads, so
+# they (and the startup steps) use the shared synchronous pooled client of
+# helper_mongodb; it never runs on the request path.
+counter_client = LazyClient(get_mongo_client, 'counter_mongo')
+
+# Services and request-independent logic (see helper_core.py)
+core = SevyCore(open_ai_client, mongo_client, counter_client)
+
+@app.before_serving
+async def startup():
+    # Slow startup work runs as a background task while requests are already
+    # served; GET /ready reports when it is done
+    app.add_background_task(warm_up.run_async)
+    startup_timings.mark('serving')
+
+@app.after_serving
+async def shutdown():
+    await core.close_async()
+
+@app.route('/chat', methods=['POST'])
+async def chat():
+    """
+    Chat endpoint, same contract as app.chat().
+    Streaming mode is enabled with {"stream": true} or an
+    "Accept: text/event-stream" header.
+
+    PRIVACY POLICY - NO TRACKING:
+    - User messages are NEVER logged (local or production)
+    - AI responses are ONLY logged in local development for debugging
+    - Production logs contain ZERO chat content - only metadata (counts, timing, success/failure)
+    - No conversation data is ever stored in MongoDB (only question counters)
+    - All conversation history is maintained client-side in sessionStorage only
+    """
+    with profile_span('json_parse'):
+        data = await request.get_json()
+    developer_mode = data.get('developerMode', False)
+    stream_requested = wants_stream(data, request.headers.get('Accept', ''))
+
+    retry_after = await core.rate_limit_async('chat', request.remote_addr, request.headers)
+    if retry_after:
+        payload = {'reply': RATE_LIMITED_REPLY, 'error': 'rate_limited', 'retryAfter': retry_after}
+        if stream_requested:
+            return rate_limited_reply(request.endpoint, retry_after, sse_response(single_frame(format_sse('error', payload))))
+        return rate_limited_reply(request.endpoint, retry_after, payload)
+
+    messages_history = extract_messages_history(data)
+    if messages_history is None:
+        if stream_requested:
+            return sse_response(single_frame(format_sse('error', {'error': 'no_message', 'reply': NO_MESSAGE_REPLY})))
+        return jsonify({'reply': NO_MESSAGE_REPLY})
+
+    # Token-budgeted window: drop older turns until the request fits the input budget
+    with profile_span('history_trim'):
+        messages_history, input_tokens = trim_to_token_budget(messages_history)
+
+    print(f"Processing conversation with {len(messages_history)} messages (~{input_tokens} input tokens)", flush=True)
+
+    # Local routing: canned reply, routine model or crisis model (see helper_router.py)
+    route = None if developer_mode else route_chat(messages_history)
+
+    if stream_requested:
+        return sse_response(core.chat_frames_async(messages_history, developer_mode, route))
+
+    try:
+        reply = await core.chat_reply_async(messages_history, developer_mode, route)
+    except OpenAIBusy as e:
+        return busy_reply(e)
+    return jsonify({'reply': reply})
+
+@app.route('/ready', methods=['GET'])
+async def ready():
+    """Readiness probe, same contract as app.ready()."""
+    status = warm_up.status()
+    return jsonify(status), 200 if status['ready'] else 503
+
+@app.route('/metrics', methods=['GET'])
+async def metrics():
+    """Prometheus text exposition of the request, OpenAI, Mongo and cache metrics."""
+    return Response(registry.render(), content_type=METRICS_CONTENT_TYPE)
+
+@app.route('/cache_stats', methods=['GET'])
+async def cache_stats():
+    """Hit and miss counters of the stats cache and the answer cache."""
+    return jsonify(core.cache_stats_payload())
+
+@app.route('/get_all_numbers', methods=['GET', 'POST'])
+async def get_all_numbers():
+    """
+    Combined endpoint to fetch all SEVY numbers in a single query.
+    Same caching, HTTP caching and daily inflation behavior as app.get_all_numbers().
+    """
+    print("Getting all SEVY numbers...", flush=True)
+    return stats_reply(await core.all_numbers_async(), request.method, request.if_none_match)
+
+@app.route('/get_sevy_educators_number', methods=['POST'])
+async def get_sevy_educators_number():
+    return stats_reply(await core.single_number_async('sevy_educators_number'), request.method, request.if_none_match)
+
+@app.route('/get_sevy_ai_answers', methods=['POST'])
+async def get_sevy_ai_answers():
+    return stats_reply(await core.single_number_async('sevy_ai_answers'), request.method, request.if_none_match)
+
+@app.route('/get_students_taught', methods=['GET', 'POST'])
+async def get_students_taught():
+    return stats_reply(await core.single_number_async('students_taught'), request.method, request.if_none_match)
+
+@app.route('/submit_application', methods=['POST'])
+async def submit_application():
+    """
+    Handle team application form submission.
+    Same contract as app.submit_application().
+
+    IMPORTANT PRIVACY NOTE:
+    - The resume file is received but NEVER stored anywhere
+    - Only text fields are saved to the database
+    - Frontend handles ALL validation
+    """
+    print("Processing application submission...", flush=True)
+
+    retry_after = await core.rate_limit_async('submit_application', request.remote_addr, request.headers)
+    if retry_after:
+        return rate_limited_reply(request.endpoint, retry_after, {'success': False, 'error': 'rate_limited'})
+
+    # Refuse oversized uploads from the Content-Length header, before reading the body
+    if content_length_exceeds(request.content_length):
+        return upload_too_large_reply()
+    # Also caps chunked uploads without a Content-Length while they are received
+    request.body.cap(APPLICATION_MAX_CONTENT_LENGTH)
+
+    try:
+        # The resume is streamed into a discarding sink while parsing,
+        # never buffered (privacy requirement: receive but don't store)
+        with UploadMemoryProbe() as probe:
+            form = await request.form
+            files = await request.files
+    except RequestEntityTooLarge:
+        return upload_too_large_reply()
+    except Exception as e:
+        print(f"Error processing application: {e}", flush=True)
+        return jsonify({'success': False}), 500
+
+    resume_file = files.get('resume')
+    if resume_file:
+        log_discarded_upload(resume_file, probe.peak_bytes)
+    return await core.submit_application_async(form, request.remote_addr)
+
+@app.route('/subscribe_email', methods=['POST'])
+async def subscribe_email():
+    """
+    Handle newsletter email subscription.
+    Same contract as app.subscribe_email().
+    """
+    print("Processing email subscription...", flush=True)
+
+    retry_after = await core.rate_limit_async('subscribe_email', request.remote_addr, request.headers)
+    if retry_after:
+        return rate_limited_reply(request.endpoint, retry_after, {'success': False, 'error': 'rate_limited'})
+    return await core.subscribe_email_async(await request.get_json(silent=True), request.remote_addr)
+
+@app.route('/export/<name>', methods=['GET'])
+async def export(name):
+    """
+    Stream the applications or the subscribers as CSV or NDJSON.
+    Same parameters and responses as app.export().
+    """
+    unauthorized = admin_error_reply(request.endpoint, request.headers.get('Authorization'))
+    if unauthorized:
+        return unauthorized
+
+    try:
+        formatter, cursor = core.open_export(name, request.args)
+    except MongoUnavailable as e:
+        return database_unavailable_reply(request.endpoint, e.retry_after)
+    except ValueError as e:
+        return jsonify({'success': False, 'error': 'invalid_export', 'detail': str(e)}), 400
+
+    response = Response(
+        stream_export_async(cursor, formatter),
+        content_type=EXPORT_FORMATS[formatter.export_format],
+        headers=export_response_headers(name, formatter.export_format)
+    )
+    response.timeout = None  # large exports may outlive Quart's default response timeout
+    return response
+
+@app.route('/profiles', methods=['GET'])
+async def profiles():
+    """Recent request profiles, same as app.profiles()."""
+    unauthorized = admin_error_reply(request.endpoint, request.headers.get('Authorization'))
+    if unauthorized:
+        return unauthorized
+    return jsonify(core.profiles_payload(request.args.get('route')))
+
+@app.route('/profiles/collapsed', methods=['GET'])
+async def profiles_collapsed():
+    """Collapsed stack samples of the recent profiles, same as app.profiles_collapsed()."""
+    unauthorized = admin_error_reply(request.endpoint, request.headers.get('Authorization'))
+    if unauthorized:
+        return unauthorized
+    return Response(
+        core.request_profiler.collapsed(request.args.get('route'), request.args.get('id')),
+        content_type='text/plain; charset=utf-8',
+        headers={'Content-Disposition': 'attachment; filename="sevy_profile.folded"', 'Cache-Control': 'no-store'}
+    )
+
+# -----------------------
+# AUXILLARY FUNCTIONS SECTION
+
+@app.before_request
+async def start_request_timer():
+    if request.endpoint not in ('metrics', 'ready'):
+        startup_timings.mark('first_request_started')
+    # PRIVACY: metrics are labelled with the route template, never the URL or body
+    if request.endpoint == 'metrics':
+        return
+    route = request.url_rule.rule if request.url_rule else 'unmatched'
+    g.request_timer = RequestTimer(route, request.method)
+    g.profile = core.begin_profile(route, request.endpoint, request.method, request.headers.get(PROFILE_HEADER))
+
+@app.after_request
+async def record_response_status(response):
+    timer = g.get('request_timer')
+    if timer is not None:
+        timer.status = str(response.status_code)
+    profile = g.get('profile')
+    if profile is not None:
+        profile.status = response.status_code
+        if isinstance(response.response, IterableBody):
+            # Streamed body: the profile ends once it has been sent
+            response.response = IterableBody(profile_body_async(core.request_profiler, g.pop('profile'), response.response))
+    return response
+
+@app.teardown_request
+async def finish_request_timer(exc):
+    # Quart sends streamed bodies after the request context is torn down,
+    # so SSE latency here is time to first byte; the OpenAI histogram
+    # covers the full stream
+    timer = g.pop('request_timer', None)
+    if timer is not None:
+        timer.finish()
+        if timer.route != '/ready':
+            startup_timings.mark('first_request_finished')
+    core.request_profiler.end(g.pop('profile', None))
+
+async def single_frame(frame):
+    yield frame
+
+def sse_response(frames):
+    """Wrap an async iterable of SSE frames in a non-buffered streaming response."""
+    response = Response(frames, mimetype='text/event-stream', headers=SSE_HEADERS)
+    response.timeout = None  # streams may outlive Quart's default response timeout
+    return response
+
+# Startup steps run by startup() as a background task
+warm_up = WarmUp(core.warm_up_steps(core.ping_mongo_async))
+register_startup_collectors(warm_up)
+startup_timings.mark('app_imported')
@@ -0,0 +1,63 @@
+import argparse
+import os
+import random
+import sys
+import time
+
+BENCHMARKS_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCHMARKS_DIR))
+
+from helper_rate_limit import RateLimiter, InProcessRateLimitBackend, client_address
+
+# Microbenchmark of the per-client rate limiter (helper_rate_limit.py).
+#
+# Measures the cost of one RateLimiter.check() call, including the client
+# address lookup, for different numbers of distinct clients. The largest
+# case exceeds RATE_LIMIT_MAX_KEYS, so it also covers LRU eviction.
+#
+# Usage (from python-backend/):
+#   python benchmarks/bench_rate_limit.py
+#   python benchmarks/bench_rate_limit.py --calls 500000 --max-keys 10000
+#   python benchmarks/bench_rate_limit.py --budget-us 20   # exit code 1 above 20 us per call
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Microbenchmark of the per-client rate limiter.')
+    parser.add_argument('--calls', type=int, default=200000, help='checks per case')
+    parser.add_argument('--clients', type=int, nargs='+', default=[1, 1000, 50000],
+                        help='distinct client addresses per case')
+    parser.add_argument('--max-keys', type=int, default=10000, help='in-process backend capacity')
+    parser.add_argument('--budget-us', type=float, default=None,
+                        help='fail (exit code 1) if a case is slower than this, in microseconds per call')
+    return parser.parse_args()
+
+def run_case(calls, clients, max_keys):
+    # A high limit keeps every call on the accepting path (the slower one)
+    limiter = RateLimiter(rules={'chat': (10 ** 9, 60)},
+                          backend=InProcessRateLimitBackend(max_keys), enabled=True)
+    addresses = [f'10.{i >> 16 & 255}.{i >> 8 & 255}.{i & 255}' for i in range(clients)]
+    forwarded = [f'{address}, 169.254.1.1' for address in addresses]
+    order = [random.randrange(clients) for _ in range(calls)]
+
+    started = time.perf_counter()
+    for i in order:
+        limiter.check('chat', client_address('169.254.1.1', forwarded[i], 2))
+    elapsed = time.perf_counter() - started
+    return elapsed / calls * 1e6, limiter.stats()
+
+def main():
+    args = parse_args()
+    print(f"Rate limiter check, {args.calls} calls per case, max_keys={args.max_keys}\n")
+    print(f"{'clients':>10} {'us/call':>10} {'tracked':>10} {'evictions':>10}")
+
+    slowest = 0.0
+    for clients in args.clients:
+        per_call, stats = run_case(args.calls, clients, args.max_keys)
+        slowest = max(slowest, per_call)
+        print(f"{clients:>10} {per_call:>10.2f} {stats['tracked_clients']:>10} {stats['evictions']:>10}")
+
+    if args.budget_us is not None and slowest > args.budget_us:
+        print(f"\nSlowest case {slowest:.2f} us/call is over the {args.budget_us} us budget.")
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,177 @@
+import argparse
+import json
+import random
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Local stand-in for the OpenAI API, used by run_benchmarks.py.
+#
+# Implements the two endpoints the backend calls:
+#   POST /v1/chat/completions  (JSON and stream=True Server-Sent Events)
+#   POST /v1/embeddings
+# Replies are fixed text, so no request content is ever inspected beyond
+# the message count. Latency is configurable to mimic the real model:
+#   latency_ms   - delay before the reply (or the first streamed chunk)
+#   jitter_ms    - random extra delay added to latency_ms (0..jitter_ms)
+#   chunk_ms     - delay between streamed chunks
+#   slow_ratio   - share of requests that get slow_ms of extra delay, to
+#                  mimic a latency tail (hedged requests, helper_hedging.py)
+#
+# Standalone use (e.g. to point a locally started backend at it):
+#   python benchmarks/fake_openai.py --port 8081 --latency-ms 800
+#   OPENAI_BASE_URL=http://127.0.0.1:8081/v1 python serve.py
+
+REPLY_WORDS = ("Consent means every person freely and clearly agrees, "
+               "and anyone can change their mind at any time.").split(' ')
+EMBEDDING_DIMENSIONS = 64
+
+class FakeOpenAIHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length', 0))
+        body = json.loads(self.rfile.read(length) or b'{}')
+        settings = self.server.settings
+
+        delay_ms = settings['latency_ms'] + random.uniform(0, settings['jitter_ms'])
+        if random.random() < settings['slow_ratio']:
+            delay_ms += settings['slow_ms']
+        time.sleep(delay_ms / 1000)
+
+        if self.path.endswith('/chat/completions'):
+            if body.get('stream'):
+                self._stream_completion(body, settings)
+            else:
+                self._send_json(self._completion(body))
+        elif self.path.endswith('/embeddings'):
+            self._send_json(self._embedding(body))
+        else:
+            self._send_json({'error': {'message': 'not found'}}, status=404)
+
+    def _usage(self, body):
+        prompt_tokens = 50 * len(body.get('messages', [])) + 1700
+        return {
+            'prompt_tokens': prompt_tokens,
+            'completion_tokens': len(REPLY_WORDS),
+            'total_tokens': prompt_tokens + len(REPLY_WORDS),
+            'prompt_tokens_details': {'cached_tokens': 1664}
+        }
+
+    def _completion(self, body):
+        return {
+            'id': f'chatcmpl-{uuid.uuid4().hex}',
+            'object': 'chat.completion',
+            'created': int(time.time()),
+            'model': body.get('model', 'fake'),
+            'choices': [{
+                'index': 0,
+                'message': {'role': 'assistant', 'content': ' '.join(REPLY_WORDS)},
+                'finish_reason': 'stop'
+            }],
+            'usage': self._usage(body)
+        }
+
+    def _stream_completion(self, body, settings):
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/event-stream')
+        self.send_header('Cache-Control', 'no-cache')
+        self.send_header('Connection', 'close')
+        self.end_headers()
+        self.close_connection = True
+
+        chunk = {
+            'id': f'chatcmpl-{uuid.uuid4().hex}',
+            'object': 'chat.completion.chunk',
+            'created': int(time.time()),
+            'model': body.get('model', 'fake')
+        }
+        for index, word in enumerate(REPLY_WORDS):
+            if index:
+                time.sleep(settings['chunk_ms'] / 1000)
+            delta = word if index == 0 else ' ' + word
+            self._write_event(dict(chunk, choices=[{'index': 0, 'delta': {'content': delta}, 'finish_reason': None}]))
+        self._write_event(dict(chunk, choices=[{'index': 0, 'delta': {}, 'finish_reason': 'stop'}]))
+        if body.get('stream_options', {}).get('include_usage'):
+            self._write_event(dict(chunk, choices=[], usage=self._usage(body)))
+        self.wfile.write(b'data: [DONE]\n\n')
+        self.wfile.flush()
+
+    def _embedding(self, body):
+        return {
+            'object': 'list',
+            'data': [{
+                'object': 'embedding',
+                'index': 0,
+                'embedding': [random.uniform(-1, 1) for _ in range(EMBEDDING_DIMENSIONS)]
+            }],
+            'model': body.get('model', 'fake'),
+            'usage': {'prompt_tokens': 8, 'total_tokens': 8}
+        }
+
+    def _write_event(self, payload):
+        self.wfile.write(f"data: {json.dumps(payload)}\n\n".encode('utf-8'))
+        self.wfile.flush()
+
+    def _send_json(self, payload, status = 200):
+        data = json.dumps(payload).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+class FakeOpenAIServer:
+    """
+    DESCRIPTION:
+        Fake OpenAI API served from a background thread.
+
+    INPUT SIGNATURE:
+        latency_ms: delay before each reply (default 500)
+        jitter_ms: random extra delay, 0..jitter_ms (default 0)
+        chunk_ms: delay between streamed chunks (default 20)
+        slow_ratio: share of requests delayed by slow_ms more (default 0)
+        slow_ms: extra delay of the slow requests (default 0)
+        port: 0 picks a free port
+    """
+
+    def __init__(self, latency_ms = 500, jitter_ms = 0, chunk_ms = 20, slow_ratio = 0.0, slow_ms = 0.0,
+                 host = '127.0.0.1', port = 0):
+        self.httpd = ThreadingHTTPServer((host, port), FakeOpenAIHandler)
+        self.httpd.daemon_threads = True
+        self.httpd.settings = {'latency_ms': latency_ms, 'jitter_ms': jitter_ms, 'chunk_ms': chunk_ms,
+                               'slow_ratio': slow_ratio, 'slow_ms': slow_ms}
+        self._thread = None
+
+    @property
+    def base_url(self):
+        host, port = self.httpd.server_address[:2]
+        return f'http://{host}:{port}/v1'
+
+    def start(self):
+        self._thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Fake OpenAI API for local benchmarks')
+    parser.add_argument('--port', type=int, default=8081)
+    parser.add_argument('--latency-ms', type=float, default=500)
+    parser.add_argument('--jitter-ms', type=float, default=0)
+    parser.add_argument('--chunk-ms', type=float, default=20)
+    parser.add_argument('--slow-ratio', type=float, default=0.0)
+    parser.add_argument('--slow-ms', type=float, default=0.0)
+    args = parser.parse_args()
+
+    server = FakeOpenAIServer(args.latency_ms, args.jitter_ms, args.chunk_ms, args.slow_ratio, args.slow_ms,
+                              port=args.port)
+    print(f"Fake OpenAI API on {server.base_url}", flush=True)
+    server.httpd.serve_forever()
@@ -0,0 +1,359 @@
+import argparse
+import contextlib
+import importlib
+import io
+import json
+import math
+import os
+import random
+import socket
+import sys
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+BENCHMARKS_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCHMARKS_DIR))
+sys.path.insert(0, BENCHMARKS_DIR)
+
+from fake_openai import FakeOpenAIServer
+from stand_ins import mongomock_client, AsyncMongomockClient
+
+# Load test and benchmark suite for the SEVY backend.
+#
+# Boots app_async.py (default) or app.py in-process against local stand-ins:
+#   - a fake OpenAI API with configurable latency (fake_openai.py)
+#   - an in-memory mongomock store seeded with the SEVY numbers (stand_ins.py)
+# then drives every scenario over real HTTP and reports p50/p95/p99 latency
+# and requests per second. Nothing leaves the machine.
+#
+# Usage (from python-backend/, after `pip install -r requirements-dev.txt`):
+#   python benchmarks/run_benchmarks.py
+#   python benchmarks/run_benchmarks.py --server flask --requests 300 --concurrency 32
+#   python benchmarks/run_benchmarks.py --json results.json
+#   python benchmarks/run_benchmarks.py --baseline results.json   # exit code 1 on regression
+#   OPENAI_HEDGING_ENABLED=true python benchmarks/run_benchmarks.py --openai-slow-ratio 0.03
+#       # 3% of OpenAI calls 3 s slower; compare p99 with and without hedging
+#
+# Environment variables of the backend (CHAT_MAX_CONCURRENCY, ANSWER_CACHE_ENABLED, ...)
+# apply as usual, so configurations can be compared run against run.
+
+VOCABULARY = ("consent body boundaries safety respect friends family school teacher question "
+              "đồng ý cơ thể ranh giới an toàn tôn trọng bạn bè gia đình trường học câu hỏi").split(' ')
+
+def synthetic_text(rng, words):
+    return ' '.join(rng.choice(VOCABULARY) for _ in range(words)).capitalize() + '?'
+
+def synthetic_conversation(history_length, seed):
+    """
+    DESCRIPTION:
+        Conversation of history_length messages alternating user and
+        assistant turns, always ending with a user turn. Deterministic
+        for a given seed.
+    """
+
+    rng = random.Random(seed)
+    messages = []
+    for index in range(history_length):
+        role = 'user' if (history_length - 1 - index) % 2 == 0 else 'assistant'
+        words = 30 if role == 'user' else 120
+        messages.append({'role': role, 'content': synthetic_text(rng, words)})
+    return messages
+
+def percentile(sorted_values, p):
+    # Nearest-rank percentile
+    if not sorted_values:
+        return 0.0
+    rank = max(1, math.ceil(p / 100 * len(sorted_values)))
+    return sorted_values[rank - 1]
+
+# -----------------------
+# SCENARIOS
+
+def chat_scenario(history_length, stream = False, distinct_prompts = None):
+    # distinct_prompts: cycle through that many conversations, like a class
+    # sending the same few prompts at once (request coalescing)
+    def send(session, base_url, index):
+        seed = index % distinct_prompts if distinct_prompts else index
+        payload = {'messages': synthetic_conversation(history_length, seed)}
+        if stream:
+            payload['stream'] = True
+            with session.post(f'{base_url}/chat', json=payload, stream=True, timeout=120) as response:
+                body = b''.join(response.iter_content(chunk_size=None))
+            return response.status_code == 200 and b'event: done' in body
+        response = session.post(f'{base_url}/chat', json=payload, timeout=120)
+        return response.status_code == 200 and 'reply' in response.json()
+    return send
+
+def numbers_scenario(session, base_url, index):
+    response = session.get(f'{base_url}/get_all_numbers', timeout=30)
+    return response.status_code == 200 and 'N/A' not in response.json().values()
+
+def subscribe_scenario(session, base_url, index):
+    email = f'bench-{uuid.uuid4().hex}@example.com'
+    response = session.post(f'{base_url}/subscribe_email', json={'email': email}, timeout=30)
+    return response.status_code == 200
+
+def application_scenario(resume_bytes):
+    def send(session, base_url, index):
+        form = {
+            'fullName': 'Benchmark Applicant',
+            'email': f'bench-{uuid.uuid4().hex}@example.com',
+            'phoneNumber': '0000000000',
+            'education': 'University',
+            'division': 'Technology'
+        }
+        files = {'resume': ('resume.pdf', io.BytesIO(resume_bytes), 'application/pdf')}
+        response = session.post(f'{base_url}/submit_application', data=form, files=files, timeout=60)
+        return response.status_code == 200
+    return send
+
+def build_scenarios(app_module, args):
+    """
+    DESCRIPTION:
+        Scenario list: (name, send function, concurrency, before-request hook).
+        The cold cache scenario runs one request at a time and empties the
+        stats cache before each one, so every request reads MongoDB.
+    """
+
+    def invalidate_numbers():
+        app_module.core.stats_cache.invalidate(app_module.NUMBERS_CACHE_KEY)
+
+    resume_bytes = os.urandom(args.resume_kb * 1024)
+    scenarios = [
+        (f'chat_history_{length}', chat_scenario(length), args.concurrency, None)
+        for length in args.history_lengths
+    ]
+    scenarios += [
+        (f'chat_stream_history_{args.history_lengths[-1]}', chat_scenario(args.history_lengths[-1], stream=True),
+         args.concurrency, None),
+        ('chat_classroom', chat_scenario(1, distinct_prompts=5), args.concurrency, None),
+        ('get_all_numbers_cold', numbers_scenario, 1, invalidate_numbers),
+        ('get_all_numbers_warm', numbers_scenario, args.concurrency, None),
+        ('subscribe_email', subscribe_scenario, args.concurrency, None),
+        ('submit_application', application_scenario(resume_bytes), args.concurrency, None)
+    ]
+    if args.only:
+        scenarios = [scenario for scenario in scenarios if any(name in scenario[0] for name in args.only)]
+    return scenarios
+
+def run_scenario(base_url, send, total, concurrency, before = None, warmup = 0):
+    """
+    DESCRIPTION:
+        Send `total` requests with `concurrency` client threads.
+
+    OUTPUT SIGNATURE:
+        dict with requests, errors, rps and p50/p95/p99 latency in milliseconds
+    """
+
+    local = threading.local()
+
+    def session():
+        if not hasattr(local, 'session'):
+            local.session = requests.Session()
+        return local.session
+
+    def one(index):
+        if before:
+            before()
+        started = time.perf_counter()
+        try:
+            ok = send(session(), base_url, index)
+        except requests.RequestException:
+            ok = False
+        return time.perf_counter() - started, ok
+
+    for index in range(warmup):
+        one(-1 - index)
+
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        started = time.perf_counter()
+        results = list(pool.map(one, range(total)))
+        elapsed = time.perf_counter() - started
+
+    latencies = sorted(latency * 1000 for latency, _ in results)
+    return {
+        'requests': total,
+        'errors': sum(1 for _, ok in results if not ok),
+        'rps': round(total / elapsed, 2),
+        'p50_ms': round(percentile(latencies, 50), 2),
+        'p95_ms': round(percentile(latencies, 95), 2),
+        'p99_ms': round(percentile(latencies, 99), 2)
+    }
+
+# -----------------------
+# APP UNDER TEST
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+def load_app(server_mode, openai_base_url):
+    """
+    DESCRIPTION:
+        Import app_async.py or app.py wired to the stand-ins. Must run
+        before the app module is imported anywhere else.
+    """
+
+    os.environ['OPENAI_BASE_URL'] = openai_base_url
+    # Every benchmark request comes from the same address; the rate limiter
+    # is measured separately by bench_rate_limit.py
+    os.environ.setdefault('RATE_LIMIT_ENABLED', 'false')
+
+    import helper_chat
+    import helper_mongodb
+
+    client = mongomock_client()
+    helper_chat.load_api_key = lambda: 'benchmark-key'
+    helper_mongodb.connect_to_mongo = lambda *args, **kwargs: client
+    helper_mongodb.connect_to_mongo_async = lambda *args, **kwargs: AsyncMongomockClient(client)
+
+    return importlib.import_module('app' if server_mode == 'flask' else 'app_async')
+
+@contextlib.contextmanager
+def serving(app_module, server_mode):
+    """
+    DESCRIPTION:
+        Serve the app on a free local port from a background thread and
+        yield its base URL.
+    """
+
+    port = free_port()
+    if server_mode == 'flask':
+        from werkzeug.serving import make_server
+
+        server = make_server('127.0.0.1', port, app_module.app, threaded=True)
+        thread = threading.Thread(target=server.serve_forever, daemon=True)
+        thread.start()
+        try:
+            yield f'http://127.0.0.1:{port}'
+        finally:
+            server.shutdown()
+        return
+
+    import uvicorn
+
+    server = uvicorn.Server(uvicorn.Config(app_module.app, host='127.0.0.1', port=port,
+                                           log_level='warning', access_log=False))
+    thread = threading.Thread(target=server.run, daemon=True)
+    thread.start()
+    while not server.started:
+        if not thread.is_alive():
+            raise RuntimeError('uvicorn failed to start')
+        time.sleep(0.05)
+    try:
+        yield f'http://127.0.0.1:{port}'
+    finally:
+        server.should_exit = True
+        thread.join(timeout=15)
+
+# -----------------------
+# REPORTING
+
+def print_report(results, settings):
+    print(f"\nSEVY backend benchmark ({settings})\n")
+    header = f"{'scenario':<28} {'requests':>8} {'errors':>6} {'rps':>9} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9}"
+    print(header)
+    print('-' * len(header))
+    for name, result in results.items():
+        print(f"{name:<28} {result['requests']:>8} {result['errors']:>6} {result['rps']:>9} "
+              f"{result['p50_ms']:>9} {result['p95_ms']:>9} {result['p99_ms']:>9}")
+    print()
+
+def compare_to_baseline(results, baseline, tolerance):
+    """
+    DESCRIPTION:
+        List the scenarios whose p95 latency grew or whose throughput
+        dropped by more than `tolerance` (fraction) against a baseline run.
+    """
+
+    regressions = []
+    for name, base in baseline.get('results', {}).items():
+        current = results.get(name)
+        if current is None:
+            continue
+        if current['p95_ms'] > base['p95_ms'] * (1 + tolerance):
+            regressions.append(f"{name}: p95 {base['p95_ms']} ms -> {current['p95_ms']} ms")
+        if current['rps'] < base['rps'] * (1 - tolerance):
+            regressions.append(f"{name}: rps {base['rps']} -> {current['rps']}")
+        if current['errors'] > base['errors']:
+            regressions.append(f"{name}: errors {base['errors']} -> {current['errors']}")
+    return regressions
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Benchmark the SEVY backend against local stand-ins')
+    parser.add_argument('--server', choices=('async', 'flask'), default='async',
+                        help='app_async.py served by uvicorn, or app.py on the Flask server')
+    parser.add_argument('--requests', type=int, default=200, help='requests per scenario')
+    parser.add_argument('--concurrency', type=int, default=16, help='concurrent client threads')
+    parser.add_argument('--warmup', type=int, default=5, help='unmeasured requests before each scenario')
+    parser.add_argument('--history-lengths', type=int, nargs='+', default=[1, 8, 32],
+                        help='chat history lengths to replay (the last one is also streamed)')
+    parser.add_argument('--openai-latency-ms', type=float, default=500)
+    parser.add_argument('--openai-jitter-ms', type=float, default=100)
+    parser.add_argument('--openai-chunk-ms', type=float, default=20)
+    parser.add_argument('--openai-slow-ratio', type=float, default=0.0,
+                        help='share of OpenAI requests delayed by --openai-slow-ms (latency tail)')
+    parser.add_argument('--openai-slow-ms', type=float, default=3000)
+    parser.add_argument('--resume-kb', type=int, default=256, help='size of the uploaded resume')
+    parser.add_argument('--only', nargs='+', help='only run scenarios whose name contains one of these')
+    parser.add_argument('--json', help='write the results to this file')
+    parser.add_argument('--baseline', help='compare to a previous --json file, exit 1 on regression')
+    parser.add_argument('--tolerance', type=float, default=0.2,
+                        help='allowed p95/rps change against the baseline (default 0.2 = 20%%)')
+    parser.add_argument('--verbose', action='store_true', help='show the app logs')
+    return parser.parse_args()
+
+def main():
+    args = parse_args()
+    args.history_lengths = sorted(args.history_lengths)
+    settings = {
+        'server': args.server,
+        'requests': args.requests,
+        'concurrency': args.concurrency,
+        'openai_latency_ms': args.openai_latency_ms,
+        'openai_jitter_ms': args.openai_jitter_ms,
+        'openai_chunk_ms': args.openai_chunk_ms,
+        'openai_slow_ratio': args.openai_slow_ratio,
+        'openai_slow_ms': args.openai_slow_ms
+    }
+
+    fake_openai = FakeOpenAIServer(args.openai_latency_ms, args.openai_jitter_ms, args.openai_chunk_ms,
+                                   args.openai_slow_ratio, args.openai_slow_ms).start()
+    results = {}
+    try:
+        with contextlib.ExitStack() as stack:
+            if not args.verbose:
+                # The app prints one line per request; keep it off the terminal
+                stack.enter_context(contextlib.redirect_stdout(stack.enter_context(open(os.devnull, 'w'))))
+            app_module = load_app(args.server, fake_openai.base_url)
+            with serving(app_module, args.server) as base_url:
+                for name, send, concurrency, before in build_scenarios(app_module, args):
+                    results[name] = run_scenario(base_url, send, args.requests, concurrency, before, args.warmup)
+                    sys.stderr.write(f"{name}: done\n")
+    finally:
+        fake_openai.stop()
+
+    settings_text = ', '.join(f'{key}={value}' for key, value in settings.items())
+    print_report(results, settings_text)
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump({'settings': settings, 'results': results}, f, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare_to_baseline(results, json.load(f), args.tolerance)
+        if regressions:
+            print('Regressions against the baseline:')
+            for line in regressions:
+                print(f'  {line}')
+            sys.exit(1)
+        print('No regressions against the baseline.')
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,117 @@
+import mongomock
+import mongomock.collection
+
+# In-memory MongoDB stand-in for the benchmarks (requires mongomock, see
+# requirements-dev.txt). Only used by run_benchmarks.py, never by the app.
+
+def _accept_sort_argument():
+    # pymongo >= 4.11 passes `sort` to the bulk update/replace builders,
+    # which mongomock 4.x does not accept yet. The option is unused by the
+    # backend's bulk writes, so it is dropped.
+    builder = mongomock.collection.BulkOperationBuilder
+    for name in ('add_update', 'add_replace'):
+        original = getattr(builder, name, None)
+        if original is None or getattr(original, '_accepts_sort', False):
+            continue
+
+        def wrapper(self, *args, _original = original, **kwargs):
+            kwargs.pop('sort', None)
+            return _original(self, *args, **kwargs)
+
+        wrapper._accepts_sort = True
+        setattr(builder, name, wrapper)
+
+_accept_sort_argument()
+
+def seed_store(client):
+    """
+    DESCRIPTION:
+        Create the SEVY_numbers documents the stats endpoints read.
+        The inflation date is set to today's date by the caller if the
+        daily inflation should not run during the benchmark.
+    """
+
+    client["SEVY_database"]["SEVY_numbers"].insert_many([
+        {'sevy_ai_answers': 25000},
+        {'sevy_ai_real_answers': 1200},
+        {'sevy_educators_number': 140},
+        {'students_taught': 9000},
+        {'sevy_ai_last_inflation_date': '2000-01-01'}
+    ])
+
+def mongomock_client():
+    client = mongomock.MongoClient()
+    seed_store(client)
+    return client
+
+class AsyncCursor:
+    def __init__(self, cursor):
+        self._cursor = cursor
+        self._iterator = None
+
+    def __getattr__(self, name):
+        attribute = getattr(self._cursor, name)
+        if not callable(attribute):
+            return attribute
+
+        def chain(*args, **kwargs):
+            result = attribute(*args, **kwargs)
+            return self if result is self._cursor else result
+        return chain
+
+    async def to_list(self, length = None):
+        return list(self._cursor)
+
+    def __aiter__(self):
+        self._iterator = iter(self._cursor)
+        return self
+
+    async def __anext__(self):
+        try:
+            return next(self._iterator)
+        except StopIteration:
+            raise StopAsyncIteration
+
+class AsyncCollection:
+    def __init__(self, collection):
+        self._collection = collection
+
+    def find(self, *args, **kwargs):
+        return AsyncCursor(self._collection.find(*args, **kwargs))
+
+    async def aggregate(self, *args, **kwargs):
+        return AsyncCursor(self._collection.aggregate(*args, **kwargs))
+
+    def __getattr__(self, name):
+        method = getattr(self._collection, name)
+
+        async def call(*args, **kwargs):
+            return method(*args, **kwargs)
+        return call
+
+class AsyncDatabase:
+    def __init__(self, database):
+        self._database = database
+
+    def __getitem__(self, name):
+        return AsyncCollection(self._database[name])
+
+    async def command(self, *args, **kwargs):
+        return {'ok': 1.0}
+
+class AsyncMongomockClient:
+    """
+    DESCRIPTION:
+        Minimal AsyncMongoClient look-alike over a mongomock client, for
+        app_async.py. Calls run inline on the event loop (they are in memory).
+    """
+
+    def __init__(self, client):
+        self._client = client
+        self.admin = AsyncDatabase(client['admin'])
+
+    def __getitem__(self, name):
+        return AsyncDatabase(self._client[name])
+
+    async def close(self):
+        pass
@@ -0,0 +1,445 @@
+import asyncio
+import collections
+import math
+import os
+import random
+import threading
+import time
+
+# Admission control for outbound OpenAI calls, shared by app.py and
+# app_async.py.
+#
+# Every chat completion first asks the controller for a slot. A call is
+# admitted when:
+#   - fewer than CHAT_MAX_CONCURRENCY calls are in flight, and
+#   - the request and token buckets (OPENAI_REQUESTS_PER_MINUTE,
+#     OPENAI_TOKENS_PER_MINUTE) hold enough budget for it. The token cost is
+#     estimated before the call and corrected with response.usage after it.
+# Otherwise the caller waits in a FIFO queue (first come, first served).
+# Waiting is bounded:
+#   - OPENAI_QUEUE_MAX_DEPTH   - callers beyond it are rejected right away
+#   - OPENAI_QUEUE_TIMEOUT_SECONDS - longest wait for a slot. A caller whose
+#     estimated wait already exceeds it is rejected right away instead of
+#     queueing for nothing (deadline-aware shedding).
+# Rejected callers get OpenAIBusy with a retry_after hint in seconds, which
+# the apps turn into a "busy, retry after" reply.
+#
+# Admitted calls that fail with 429, 5xx or a connection error are retried
+# up to OPENAI_MAX_RETRIES times with jittered exponential backoff (honoring
+# the provider's Retry-After). A call still rate limited after that, or
+# whose next backoff would outlast its deadline, also raises OpenAIBusy. The
+# OpenAI clients are created with max_retries=0 so that retries only happen
+# here.
+#
+# A call keeps its slot while it backs off. Under a provider outage the
+# slots therefore fill up sooner (each retry holds one for up to
+# OPENAI_RETRY_MAX_SECONDS) and new callers queue or are shed. That is on
+# purpose: giving the slot back would let queued callers send more requests
+# to a provider that is already rate limiting us, and the retry would then
+# queue behind them and likely miss its deadline.
+#
+# Limits are per process: with several workers or instances, divide the
+# account limits accordingly. A limit of 0 disables that bucket.
+
+class OpenAIBusy(Exception):
+    """
+    DESCRIPTION:
+        An OpenAI call was not admitted (reason: 'queue_full', 'deadline',
+        'timeout') or the provider kept rate limiting it
+        ('upstream_rate_limited'). retry_after is a whole number of seconds.
+    """
+
+    def __init__(self, reason, retry_after, waited = 0.0):
+        super().__init__(reason)
+        self.reason = reason
+        self.retry_after = max(1, int(math.ceil(retry_after)))
+        self.waited = waited
+
+class TokenBucket:
+    """
+    DESCRIPTION:
+        Budget refilled continuously at per_minute / 60 per second, holding
+        at most one minute of budget. per_minute = 0 means unlimited.
+    """
+
+    def __init__(self, per_minute):
+        self.capacity = float(per_minute)
+        self.rate = self.capacity / 60.0
+        self.level = self.capacity
+        self._updated = time.monotonic()
+
+    @property
+    def unlimited(self):
+        return self.capacity <= 0
+
+    def refill(self, now):
+        if not self.unlimited:
+            self.level = min(self.capacity, self.level + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def cost(self, amount):
+        # A single call larger than the bucket could never be admitted
+        return min(amount, self.capacity)
+
+    def seconds_until(self, amount):
+        if self.unlimited:
+            return 0.0
+        return max(0.0, (self.cost(amount) - self.level) / self.rate)
+
+    def take(self, amount):
+        if not self.unlimited:
+            self.level -= self.cost(amount)
+
+    def adjust(self, amount):
+        # Positive: refund an overestimate, negative: charge an underestimate
+        if not self.unlimited:
+            self.level = min(self.capacity, self.level + amount)
+
+class AdmissionTicket:
+    def __init__(self, tokens, waited):
+        self.tokens = tokens
+        self.waited = waited
+        self.admitted_at = time.monotonic()
+        self.released = False
+
+class _Waiter:
+    def __init__(self, tokens, deadline, notify):
+        self.tokens = tokens
+        self.deadline = deadline
+        self.notify = notify
+        self.admitted = False
+
+class AdmissionController:
+    """
+    DESCRIPTION:
+        Concurrency limit, request/token buckets, bounded FIFO wait queue and
+        retries for OpenAI calls. acquire() / acquire_async() return an
+        AdmissionTicket that must be given back with release().
+
+    INPUT SIGNATURE:
+        max_concurrency: calls in flight (default: CHAT_MAX_CONCURRENCY or 64)
+        requests_per_minute: default OPENAI_REQUESTS_PER_MINUTE or 0 (unlimited)
+        tokens_per_minute: default OPENAI_TOKENS_PER_MINUTE or 0 (unlimited)
+        max_queue: waiting callers (default: OPENAI_QUEUE_MAX_DEPTH or 128)
+        queue_timeout: longest wait in seconds (default: OPENAI_QUEUE_TIMEOUT_SECONDS or 10)
+        max_retries: retries after a 429/5xx (default: OPENAI_MAX_RETRIES or 2)
+        retry_base: first backoff in seconds (default: OPENAI_RETRY_BASE_SECONDS or 0.5)
+        retry_max: longest backoff in seconds (default: OPENAI_RETRY_MAX_SECONDS or 8)
+    """
+
+    def __init__(self, max_concurrency = None, requests_per_minute = None, tokens_per_minute = None,
+                 max_queue = None, queue_timeout = None, max_retries = None, retry_base = None,
+                 retry_max = None):
+        def setting(value, name, default, cast):
+            return cast(value if value is not None else os.getenv(name, default))
+
+        self.max_concurrency = max(1, setting(max_concurrency, 'CHAT_MAX_CONCURRENCY', 64, int))
+        self.max_queue = max(0, setting(max_queue, 'OPENAI_QUEUE_MAX_DEPTH', 128, int))
+        self.queue_timeout = setting(queue_timeout, 'OPENAI_QUEUE_TIMEOUT_SECONDS', 10, float)
+        self.max_retries = max(0, setting(max_retries, 'OPENAI_MAX_RETRIES', 2, int))
+        self.retry_base = setting(retry_base, 'OPENAI_RETRY_BASE_SECONDS', 0.5, float)
+        self.retry_max = setting(retry_max, 'OPENAI_RETRY_MAX_SECONDS', 8, float)
+        self._requests = TokenBucket(setting(requests_per_minute, 'OPENAI_REQUESTS_PER_MINUTE', 0, float))
+        self._tokens = TokenBucket(setting(tokens_per_minute, 'OPENAI_TOKENS_PER_MINUTE', 0, float))
+
+        self._lock = threading.Lock()
+        self._queue = collections.deque()
+        self._in_flight = 0
+        self._average_call_seconds = 0.0
+        self._next_check = None
+        self._stats = {
+            'admitted': 0,
+            'rejected_queue_full': 0,
+            'rejected_deadline': 0,
+            'rejected_timeout': 0,
+            'rejected_upstream_rate_limited': 0,
+            'retries': 0
+        }
+
+    def acquire(self, tokens):
+        """
+        DESCRIPTION:
+            Wait (blocking the thread) until a call estimated at `tokens`
+            tokens may start.
+
+        OUTPUT SIGNATURE:
+            AdmissionTicket
+
+        RAISES:
+            OpenAIBusy when the call is shed or waited queue_timeout seconds
+        """
+
+        started = time.monotonic()
+        admitted = threading.Event()
+        waiter = self._enqueue(tokens, started, admitted.set)
+        if waiter is None:
+            return AdmissionTicket(tokens, 0.0)
+
+        try:
+            while True:
+                timeout = self._poll(waiter, started)
+                if timeout is None:
+                    return AdmissionTicket(tokens, time.monotonic() - started)
+                admitted.wait(timeout)
+        except BaseException:
+            self._abandon(waiter, tokens)
+            raise
+
+    def try_acquire(self, tokens):
+        """
+        DESCRIPTION:
+            Admit a call estimated at `tokens` tokens only if it can start
+            right away and nobody is queued (used for optional extra calls,
+            e.g. hedged requests).
+
+        OUTPUT SIGNATURE:
+            AdmissionTicket, or None if the call would have to wait
+        """
+
+        with self._lock:
+            self._refill(time.monotonic())
+            if self._queue or not self._can_start(tokens):
+                return None
+            self._start(tokens)
+        return AdmissionTicket(tokens, 0.0)
+
+    async def acquire_async(self, tokens):
+        """
+        DESCRIPTION:
+            Same as acquire() for the asyncio server; waits without blocking
+            the event loop.
+        """
+
+        started = time.monotonic()
+        loop = asyncio.get_running_loop()
+        admitted = asyncio.Event()
+        waiter = self._enqueue(tokens, started, lambda: loop.call_soon_threadsafe(admitted.set))
+        if waiter is None:
+            return AdmissionTicket(tokens, 0.0)
+
+        try:
+            while True:
+                timeout = self._poll(waiter, started)
+                if timeout is None:
+                    return AdmissionTicket(tokens, time.monotonic() - started)
+                try:
+                    await asyncio.wait_for(admitted.wait(), timeout)
+                except asyncio.TimeoutError:
+                    pass
+        except BaseException:
+            # Also covers cancellation (client gone while queued)
+            self._abandon(waiter, tokens)
+            raise
+
+    def release(self, ticket, used_tokens = None):
+        """
+        DESCRIPTION:
+            Give the slot of a finished call back. used_tokens (from
+            response.usage.total_tokens) corrects the token estimate of the
+            ticket. Safe to call more than once.
+        """
+
+        with self._lock:
+            if ticket.released:
+                return
+            ticket.released = True
+            self._in_flight -= 1
+            duration = time.monotonic() - ticket.admitted_at
+            self._average_call_seconds = (duration if self._average_call_seconds == 0
+                                          else 0.8 * self._average_call_seconds + 0.2 * duration)
+            if used_tokens is not None:
+                now = time.monotonic()
+                self._tokens.refill(now)
+                self._tokens.adjust(ticket.tokens - used_tokens)
+            self._pump(time.monotonic())
+
+    def call(self, function, deadline = None):
+        """
+        DESCRIPTION:
+            Run function() (one OpenAI request), retrying 429, 5xx and
+            connection errors with jittered exponential backoff.
+
+        INPUT SIGNATURE:
+            function: makes the request
+            deadline: helper_hedging.Deadline; no retry is started that
+                      could not begin before it (optional)
+
+        RAISES:
+            OpenAIBusy if the provider still rate limits after the retries
+            or the backoff would outlast the deadline, otherwise the last
+            error
+
+        CAUTION:
+            The caller keeps its admission slot during the backoff (see the
+            module comment).
+        """
+
+        attempt = 0
+        while True:
+            try:
+                return function()
+            except Exception as e:
+                delay = self._retry_delay(e, attempt, deadline)
+                if delay is None:
+                    raise
+                attempt += 1
+                time.sleep(delay)
+
+    async def call_async(self, function, deadline = None):
+        """
+        DESCRIPTION:
+            Same as call() for a coroutine function.
+        """
+
+        attempt = 0
+        while True:
+            try:
+                return await function()
+            except Exception as e:
+                delay = self._retry_delay(e, attempt, deadline)
+                if delay is None:
+                    raise
+                attempt += 1
+                await asyncio.sleep(delay)
+
+    def stats(self):
+        """
+        DESCRIPTION:
+            Calls in flight, callers waiting, and admission counters since
+            the process started.
+        """
+
+        with self._lock:
+            stats = dict(self._stats)
+            stats['in_flight'] = self._in_flight
+            stats['queued'] = len(self._queue)
+        return stats
+
+    def _enqueue(self, tokens, now, notify):
+        # Returns None when admitted right away, otherwise the queued waiter
+        with self._lock:
+            self._refill(now)
+            if not self._queue and self._can_start(tokens):
+                self._start(tokens)
+                return None
+            if len(self._queue) >= self.max_queue:
+                self._reject('queue_full', self._estimated_wait(tokens))
+            estimated_wait = self._estimated_wait(tokens)
+            if estimated_wait > self.queue_timeout:
+                self._reject('deadline', estimated_wait)
+            waiter = _Waiter(tokens, now + self.queue_timeout, notify)
+            self._queue.append(waiter)
+            return waiter
+
+    def _poll(self, waiter, started):
+        # None once admitted, otherwise how long to wait before checking again
+        with self._lock:
+            now = time.monotonic()
+            self._pump(now)
+            if waiter.admitted:
+                return None
+            if now >= waiter.deadline:
+                self._queue.remove(waiter)
+                # The head may be admissible now that this waiter is gone
+                self._pump(now)
+                self._reject('timeout', self._estimated_wait(waiter.tokens), now - started)
+            timeout = waiter.deadline - now
+            if self._next_check is not None:
+                timeout = min(timeout, max(0.001, self._next_check - now))
+            return timeout
+
+    def _abandon(self, waiter, tokens):
+        with self._lock:
+            if waiter.admitted:
+                # Admitted just as the caller gave up: hand the slot back
+                self._in_flight -= 1
+                self._requests.adjust(1)
+                self._tokens.adjust(tokens)
+            elif waiter in self._queue:
+                self._queue.remove(waiter)
+            self._pump(time.monotonic())
+
+    def _pump(self, now):
+        # Admit waiters from the head of the queue while they fit (FIFO:
+        # a large request at the head is not overtaken by smaller ones)
+        self._refill(now)
+        self._next_check = None
+        while self._queue:
+            head = self._queue[0]
+            if not self._can_start(head.tokens):
+                if self._in_flight < self.max_concurrency:
+                    # Only the buckets are short: check again once they refilled
+                    self._next_check = now + max(self._requests.seconds_until(1),
+                                                 self._tokens.seconds_until(head.tokens))
+                break
+            self._queue.popleft()
+            self._start(head.tokens)
+            head.admitted = True
+            head.notify()
+
+    def _refill(self, now):
+        self._requests.refill(now)
+        self._tokens.refill(now)
+
+    def _can_start(self, tokens):
+        return (self._in_flight < self.max_concurrency
+                and self._requests.seconds_until(1) == 0
+                and self._tokens.seconds_until(tokens) == 0)
+
+    def _start(self, tokens):
+        self._in_flight += 1
+        self._requests.take(1)
+        self._tokens.take(tokens)
+        self._stats['admitted'] += 1
+
+    def _estimated_wait(self, tokens):
+        # Time until a new caller would be admitted: the budget of everyone
+        # ahead of it has to refill, and the calls in flight have to finish
+        waiting = len(self._queue) + 1
+        wait = max(self._requests.seconds_until(waiting),
+                   self._tokens.seconds_until(sum(waiter.tokens for waiter in self._queue) + tokens))
+        if self._in_flight + waiting > self.max_concurrency:
+            rounds = math.ceil((self._in_flight + waiting - self.max_concurrency) / self.max_concurrency)
+            wait = max(wait, rounds * self._average_call_seconds)
+        return wait
+
+    def _reject(self, reason, retry_after, waited = 0.0):
+        self._stats[f'rejected_{reason}'] += 1
+        raise OpenAIBusy(reason, retry_after, waited)
+
+    def _retry_delay(self, error, attempt, deadline = None):
+        # Seconds to wait before retrying `error`, or None to give up
+        status = getattr(error, 'status_code', None)
+        rate_limited = status == 429
+        retryable = rate_limited or (status is not None and status >= 500) or \
+            type(error).__name__ in ('APIConnectionError', 'APITimeoutError')
+        if not retryable:
+            return None
+
+        retry_after = _retry_after_header(error)
+        if attempt >= self.max_retries or (retry_after or 0) > self.retry_max:
+            if rate_limited:
+                with self._lock:
+                    self._reject('upstream_rate_limited', retry_after or self.retry_max)
+            return None
+
+        # Full jitter: spreads the retries of callers that failed together
+        delay = max(random.uniform(0, min(self.retry_max, self.retry_base * 2 ** attempt)), retry_after or 0)
+        with self._lock:
+            if deadline is not None and delay >= deadline.remaining():
+                # No retry is started that could not begin before the deadline
+                if rate_limited:
+                    self._reject('upstream_rate_limited', delay)
+                return None
+            self._stats['retries'] += 1
+        return delay
+
+def _retry_after_header(error):
+    response = getattr(error, 'response', None)
+    headers = getattr(response, 'headers', None)
+    if not headers:
+        return None
+    try:
+        return float(headers.get('retry-after'))
+    except (TypeError, ValueError):
+        return None
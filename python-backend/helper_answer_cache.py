@@ -0,0 +1,265 @@
+import hashlib
+import math
+import os
+import re
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+
+# Opt-in answer cache for first-turn /chat questions.
+#
+# Many sessions open with the same short question ("what is consent",
+# "đồng ý là gì"). When ANSWER_CACHE_ENABLED is set, the reply to a
+# single-turn conversation is cached, keyed on the normalized question, and
+# reused for identical (or, with ANSWER_CACHE_EMBEDDINGS, very similar)
+# questions instead of calling the model again.
+#
+# PRIVACY (consistent with chat() in app.py):
+# - The question text is never stored. Entries hold a SHA-256 of the
+#   normalized question, an optional embedding vector and the answer.
+# - Multi-turn conversations always bypass the cache.
+# - Long questions and questions that look like they carry personal data
+#   (emails, phone numbers, links) are never cached.
+# - Entries live in process memory only, with TTL and LRU eviction.
+
+ANSWER_CACHE_ENABLED = os.getenv('ANSWER_CACHE_ENABLED', 'false').lower() in ('1', 'true', 'yes')
+ANSWER_CACHE_EMBEDDINGS = os.getenv('ANSWER_CACHE_EMBEDDINGS', 'false').lower() in ('1', 'true', 'yes')
+ANSWER_CACHE_EMBEDDING_MODEL = os.getenv('ANSWER_CACHE_EMBEDDING_MODEL', 'text-embedding-3-small')
+
+EMAIL_PATTERN = re.compile(r'\S+@\S+\.\S+')
+PHONE_PATTERN = re.compile(r'(?:\d[\s\-.()]*){7,}')
+URL_PATTERN = re.compile(r'https?://|www\.', re.IGNORECASE)
+
+def normalize_question(text):
+    """
+    DESCRIPTION:
+        Normalize a question so trivial variations share one cache key:
+        Unicode NFKC, case folding, punctuation removed, whitespace collapsed.
+        Diacritics are kept (they change the meaning of Vietnamese words).
+    """
+
+    text = unicodedata.normalize('NFKC', text).casefold()
+    text = ''.join(' ' if unicodedata.category(ch).startswith('P') else ch for ch in text)
+    return ' '.join(text.split())
+
+def script_bucket(text):
+    """
+    DESCRIPTION:
+        Coarse script class of a question. Similarity lookups only compare
+        questions in the same bucket, so an English answer is never served
+        for a Vietnamese question that happens to embed close to it.
+    """
+
+    letters = [ch for ch in text if ch.isalpha()]
+    if all(ch.isascii() for ch in letters):
+        return 'latin-ascii'
+    if all('LATIN' in unicodedata.name(ch, '') for ch in letters):
+        return 'latin-extended'
+    return 'other'
+
+def cosine_similarity(a, b):
+    dot = sum(x * y for x, y in zip(a, b))
+    norm = math.sqrt(sum(x * x for x in a)) * math.sqrt(sum(y * y for y in b))
+    return dot / norm if norm else 0.0
+
+class AnswerCache:
+    """
+    DESCRIPTION:
+        TTL + LRU cache of anonymized first-turn question/answer pairs.
+
+    INPUT SIGNATURE:
+        max_entries: LRU capacity (default: ANSWER_CACHE_MAX_ENTRIES or 512)
+        ttl: seconds an answer may be reused (default: ANSWER_CACHE_TTL_SECONDS or 86400)
+        similarity_threshold: minimum cosine similarity for an embedding
+                              match (default: ANSWER_CACHE_SIMILARITY or 0.95)
+        max_question_chars: longer questions are never cached
+                            (default: ANSWER_CACHE_MAX_QUESTION_CHARS or 200)
+        enabled: default ANSWER_CACHE_ENABLED
+        use_embeddings: default ANSWER_CACHE_EMBEDDINGS
+    """
+
+    def __init__(self, max_entries = None, ttl = None, similarity_threshold = None,
+                 max_question_chars = None, enabled = None, use_embeddings = None):
+        self.max_entries = int(max_entries if max_entries is not None
+                               else os.getenv('ANSWER_CACHE_MAX_ENTRIES', 512))
+        self.ttl = float(ttl if ttl is not None else os.getenv('ANSWER_CACHE_TTL_SECONDS', 86400))
+        self.similarity_threshold = float(similarity_threshold if similarity_threshold is not None
+                                          else os.getenv('ANSWER_CACHE_SIMILARITY', 0.95))
+        self.max_question_chars = int(max_question_chars if max_question_chars is not None
+                                      else os.getenv('ANSWER_CACHE_MAX_QUESTION_CHARS', 200))
+        self.enabled = ANSWER_CACHE_ENABLED if enabled is None else enabled
+        self.use_embeddings = ANSWER_CACHE_EMBEDDINGS if use_embeddings is None else use_embeddings
+
+        self._entries = OrderedDict()  # key hash -> entry
+        self._lock = threading.Lock()
+        self._stats = {
+            'hits': 0,
+            'semantic_hits': 0,
+            'misses': 0,
+            'bypassed': 0,
+            'saved_seconds': 0.0
+        }
+
+    def question_for(self, messages_history):
+        """
+        DESCRIPTION:
+            Return the normalized question if this conversation may use the
+            cache, otherwise None (and count it as bypassed).
+            Only single-turn conversations with one short user message qualify.
+        """
+
+        if not self.enabled:
+            return None
+
+        if len(messages_history) != 1:
+            self._count('bypassed')
+            return None
+
+        message = messages_history[0]
+        if (not isinstance(message, dict) or message.get('role') != 'user'
+                or not isinstance(message.get('content'), str)):
+            self._count('bypassed')
+            return None
+
+        content = message['content']
+        if (len(content) > self.max_question_chars
+                or EMAIL_PATTERN.search(content)
+                or PHONE_PATTERN.search(content)
+                or URL_PATTERN.search(content)):
+            self._count('bypassed')
+            return None
+
+        question = normalize_question(content)
+        if not question:
+            self._count('bypassed')
+            return None
+        return question
+
+    def lookup(self, question, embed = None):
+        """
+        DESCRIPTION:
+            Look up a cached answer for a normalized question. Exact matches
+            are checked first. On an exact miss, if embeddings are enabled and
+            embed is given, the question is embedded and the most similar
+            entry of the same script bucket above similarity_threshold is used.
+
+        INPUT SIGNATURE:
+            question: normalized question from question_for()
+            embed: function question -> embedding vector (optional)
+
+        OUTPUT SIGNATURE:
+            (answer, vector): the cached answer or None, and the question's
+            embedding (None if it was not computed). Pass the vector to put()
+            so a miss does not need a second embedding call.
+        """
+
+        answer = self._find_exact(question)
+        if answer is not None or not (self.use_embeddings and embed):
+            return self._record(answer, 'hits'), None
+
+        vector = embed(question)
+        return self._record(self._find_similar(question, vector), 'semantic_hits'), vector
+
+    async def lookup_async(self, question, embed = None):
+        """
+        DESCRIPTION:
+            Same as lookup() for the asyncio server. embed is an async function.
+        """
+
+        answer = self._find_exact(question)
+        if answer is not None or not (self.use_embeddings and embed):
+            return self._record(answer, 'hits'), None
+
+        vector = await embed(question)
+        return self._record(self._find_similar(question, vector), 'semantic_hits'), vector
+
+    def put(self, question, answer, latency, vector = None):
+        """
+        DESCRIPTION:
+            Cache the answer to a normalized question.
+
+        INPUT SIGNATURE:
+            question: normalized question from question_for()
+            answer: model reply (string)
+            latency: seconds the model took, credited as saved on every hit
+            vector: optional embedding of the question
+        """
+
+        key = self._key(question)
+        with self._lock:
+            self._entries[key] = {
+                'key': key,
+                'bucket': script_bucket(question),
+                'vector': vector,
+                'answer': answer,
+                'latency': latency,
+                'stored_at': time.time()
+            }
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def stats(self):
+        """
+        DESCRIPTION:
+            Hit rate and model latency saved since the process started.
+        """
+
+        with self._lock:
+            stats = dict(self._stats)
+            stats['entries'] = len(self._entries)
+        lookups = stats['hits'] + stats['semantic_hits'] + stats['misses']
+        stats['hit_rate'] = round((stats['hits'] + stats['semantic_hits']) / lookups, 4) if lookups else 0.0
+        stats['saved_seconds'] = round(stats['saved_seconds'], 3)
+        stats['enabled'] = self.enabled
+        return stats
+
+    def _find_exact(self, question):
+        with self._lock:
+            self._evict_expired(time.time())
+            entry = self._entries.get(self._key(question))
+            if entry is None:
+                return None
+            self._entries.move_to_end(entry['key'])
+            return entry
+
+    def _find_similar(self, question, vector):
+        if vector is None:
+            return None
+        bucket = script_bucket(question)
+        with self._lock:
+            entry = None
+            best_similarity = self.similarity_threshold
+            for candidate in self._entries.values():
+                if candidate['vector'] is None or candidate['bucket'] != bucket:
+                    continue
+                similarity = cosine_similarity(vector, candidate['vector'])
+                if similarity >= best_similarity:
+                    entry, best_similarity = candidate, similarity
+            if entry is not None:
+                self._entries.move_to_end(entry['key'])
+            return entry
+
+    def _record(self, entry, kind):
+        with self._lock:
+            if entry is None:
+                self._stats['misses'] += 1
+                return None
+            self._stats[kind] += 1
+            self._stats['saved_seconds'] += entry['latency']
+            return entry['answer']
+
+    def _key(self, question):
+        return hashlib.sha256(question.encode('utf-8')).hexdigest()
+
+    def _evict_expired(self, now):
+        # Entries are in LRU order, not insertion order, so scan them all;
+        # the cache is small and this only runs under the lock on lookups
+        expired = [key for key, entry in self._entries.items() if now - entry['stored_at'] >= self.ttl]
+        for key in expired:
+            del self._entries[key]
+
+    def _count(self, name):
+        with self._lock:
+            self._stats[name] += 1
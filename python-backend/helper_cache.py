@@ -0,0 +1,452 @@
+import asyncio
+import hashlib
+import json
+import os
+import threading
+import time
+
+# Cache layer for the public SEVY stats.
+#
+# StatsCache.get() / get_async() return a cached value and take care of
+# refreshing it:
+#   - fresh (younger than ttl): returned as is
+#   - stale (younger than ttl + stale_ttl): returned as is, and ONE background
+#     refresh is started (stale-while-revalidate)
+#   - missing or too old: ONE caller runs the loader, concurrent callers wait
+#     for its result instead of all hitting MongoDB (single flight)
+# If a refresh fails, the last known value keeps being served, even after it
+# expired from the backend (last_known() also returns it without a load).
+#
+# Backends:
+#   memory - in-process dict (default)
+#   redis  - shared by every instance (STATS_CACHE_BACKEND=redis, REDIS_URL).
+#            Requires the optional `redis` package.
+
+# HTTP caching for the GET variants of the stats endpoints
+STATS_HTTP_MAX_AGE = int(os.getenv('STATS_HTTP_MAX_AGE_SECONDS', 30))
+STATS_HTTP_STALE = int(os.getenv('STATS_HTTP_STALE_SECONDS', 300))
+
+def stats_etag(result):
+    """
+    DESCRIPTION:
+        Strong ETag for a stats result dict. The same values always give the
+        same ETag, on every instance.
+    """
+
+    payload = json.dumps(result, sort_keys=True, separators=(',', ':'), default=str)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()[:32]
+
+def stats_cache_control(result):
+    """
+    DESCRIPTION:
+        Cache-Control header for a stats result dict. Results with missing
+        values ('N/A', e.g. when MongoDB is unreachable) are never cached.
+    """
+
+    if 'N/A' in result.values():
+        return 'no-store'
+    return f'public, max-age={STATS_HTTP_MAX_AGE}, stale-while-revalidate={STATS_HTTP_STALE}'
+
+class InProcessCacheBackend:
+    """
+    DESCRIPTION:
+        Per-process cache storage. Entries are {'value': ..., 'stored_at': ...}.
+    """
+
+    is_remote = False
+
+    def __init__(self):
+        self._entries = {}
+
+    def get(self, key):
+        return self._entries.get(key)
+
+    def set(self, key, entry, expire_seconds):
+        self._entries[key] = entry
+
+    def delete(self, key):
+        self._entries.pop(key, None)
+
+    def try_lock(self, key, seconds):
+        # Refreshes are already single-flight inside a process
+        return True
+
+    def unlock(self, key):
+        pass
+
+class RedisCacheBackend:
+    """
+    DESCRIPTION:
+        Cache storage shared by every instance through Redis.
+        Entries are stored as JSON and expire after ttl + stale_ttl.
+        try_lock() gives cross-instance single flight, so only one instance
+        refreshes a stale entry at a time.
+
+    INPUT SIGNATURE:
+        url: Redis connection URL (default: REDIS_URL or redis://localhost:6379/0)
+        prefix: key prefix for every cache entry
+    """
+
+    is_remote = True
+
+    def __init__(self, url = None, prefix = 'sevy:cache:'):
+        import redis
+
+        self.prefix = prefix
+        self.client = redis.Redis.from_url(
+            url or os.getenv('REDIS_URL', 'redis://localhost:6379/0'),
+            socket_timeout=0.5,
+            socket_connect_timeout=0.5
+        )
+
+    def get(self, key):
+        raw = self.client.get(self.prefix + key)
+        return json.loads(raw) if raw else None
+
+    def set(self, key, entry, expire_seconds):
+        self.client.set(self.prefix + key, json.dumps(entry), ex=max(1, int(expire_seconds)))
+
+    def delete(self, key):
+        self.client.delete(self.prefix + key)
+
+    def try_lock(self, key, seconds):
+        return bool(self.client.set(self.prefix + key + ':lock', '1', nx=True, px=int(seconds * 1000)))
+
+    def unlock(self, key):
+        self.client.delete(self.prefix + key + ':lock')
+
+def create_cache_backend(name = None):
+    """
+    DESCRIPTION:
+        Build the backend selected by STATS_CACHE_BACKEND ('memory' or 'redis').
+        Falls back to the in-process backend if Redis is unavailable.
+    """
+
+    name = (name or os.getenv('STATS_CACHE_BACKEND', 'memory')).lower()
+    if name == 'redis':
+        try:
+            return RedisCacheBackend()
+        except Exception as e:
+            print(f"Redis cache backend unavailable, using in-process cache: {e}", flush=True)
+    return InProcessCacheBackend()
+
+class RefreshRunningElsewhere(Exception):
+    """Raised when another instance holds the refresh lock of a shared entry."""
+
+class _Flight:
+    def __init__(self):
+        self.done = threading.Event()
+        self.value = None
+        self.error = None
+
+class StatsCache:
+    """
+    DESCRIPTION:
+        Single-flight, stale-while-revalidate cache with a pluggable backend.
+
+    INPUT SIGNATURE:
+        ttl: seconds an entry is fresh (default: STATS_CACHE_TTL_SECONDS or 30)
+        stale_ttl: extra seconds a stale entry may be served while it is
+                   refreshed in the background (default: STATS_CACHE_STALE_SECONDS or 300)
+        backend: cache backend (default: create_cache_backend())
+        wait_timeout: seconds a caller waits for another caller's load
+    """
+
+    def __init__(self, ttl = None, stale_ttl = None, backend = None, wait_timeout = 10):
+        self.ttl = float(ttl if ttl is not None else os.getenv('STATS_CACHE_TTL_SECONDS', 30))
+        self.stale_ttl = float(stale_ttl if stale_ttl is not None
+                               else os.getenv('STATS_CACHE_STALE_SECONDS', 300))
+        self.backend = backend if backend is not None else create_cache_backend()
+        self.wait_timeout = wait_timeout
+
+        self._lock = threading.Lock()
+        self._inflight = {}        # key -> _Flight (threads)
+        self._async_inflight = {}  # key -> asyncio.Future (event loop)
+        self._refresh_tasks = set()  # background refreshes; the loop only keeps weak references
+        self._last_known = {}      # key -> last value seen by this process
+        self._stats = {
+            'hits': 0,
+            'stale_hits': 0,
+            'misses': 0,
+            'coalesced': 0,
+            'refreshes': 0,
+            'refresh_errors': 0
+        }
+
+    def stats(self):
+        """
+        DESCRIPTION:
+            Hit and miss counters since the process started.
+            coalesced counts callers that waited on another caller's load.
+        """
+
+        with self._lock:
+            stats = dict(self._stats)
+        lookups = stats['hits'] + stats['stale_hits'] + stats['misses'] + stats['coalesced']
+        served_from_cache = stats['hits'] + stats['stale_hits'] + stats['coalesced']
+        stats['hit_ratio'] = round(served_from_cache / lookups, 4) if lookups else 0.0
+        stats['backend'] = 'redis' if self.backend.is_remote else 'memory'
+        return stats
+
+    def last_known(self, key):
+        """
+        DESCRIPTION:
+            Last value this process loaded or read for key, however old, or
+            None. Never calls the loader or the backend: for serving stats
+            while the database is unavailable.
+        """
+
+        with self._lock:
+            return self._last_known.get(key)
+
+    def invalidate(self, key):
+        try:
+            self.backend.delete(key)
+        except Exception as e:
+            print(f"Cache invalidate error (non-fatal): {e}", flush=True)
+
+    # -----------------------
+    # SYNC API (Flask)
+
+    def get(self, key, loader):
+        """
+        DESCRIPTION:
+            Return the cached value for key, calling loader() when it has to
+            be (re)loaded.
+
+        INPUT SIGNATURE:
+            key: cache key (string)
+            loader: function returning a JSON-serializable value
+
+        OUTPUT SIGNATURE:
+            The cached or freshly loaded value. Raises the loader's exception
+            only if there is no previous value to fall back to.
+        """
+
+        entry = self._backend_get(key)
+        state = self._classify(entry)
+
+        if state == 'fresh':
+            self._count('hits')
+            return entry['value']
+
+        if state == 'stale':
+            self._count('stale_hits')
+            self._refresh_in_background(key, loader)
+            return entry['value']
+
+        return self._load(key, loader, entry)
+
+    def _load(self, key, loader, entry):
+        if entry is None:
+            # Expired from the backend: fall back to the value seen last
+            entry = self._last_known_entry(key)
+        with self._lock:
+            flight = self._inflight.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._inflight[key] = _Flight()
+
+        if not leader:
+            # Another request is already loading this key: wait for its result
+            self._count('coalesced')
+            flight.done.wait(self.wait_timeout)
+            if flight.done.is_set() and flight.error is None:
+                return flight.value
+            if entry is not None:
+                return entry['value']
+            raise flight.error or TimeoutError(f"Timed out waiting for cache key '{key}'")
+
+        self._count('misses')
+        self._run_flight(key, loader, flight, wait_for_remote = True)
+        if flight.error is None:
+            return flight.value
+        if entry is not None:
+            print(f"Cache refresh failed, serving last known '{key}'", flush=True)
+            return entry['value']
+        raise flight.error
+
+    def _refresh_in_background(self, key, loader):
+        with self._lock:
+            if key in self._inflight:
+                return
+            flight = self._inflight[key] = _Flight()
+
+        threading.Thread(
+            target=self._run_flight, args=(key, loader, flight),
+            name=f'cache-refresh-{key}', daemon=True
+        ).start()
+
+    def _run_flight(self, key, loader, flight, wait_for_remote = False):
+        try:
+            locked = self._try_lock(key)
+            if not locked:
+                # Another instance is refreshing the shared entry
+                entry = self._wait_for_remote(key) if wait_for_remote else None
+                if entry is not None:
+                    flight.value = entry['value']
+                    return
+                if not wait_for_remote:
+                    raise RefreshRunningElsewhere(key)
+            try:
+                flight.value = loader()
+                self._store(key, flight.value)
+            finally:
+                if locked:
+                    self._unlock(key)
+        except RefreshRunningElsewhere as e:
+            flight.error = e
+        except Exception as e:
+            flight.error = e
+            self._count('refresh_errors')
+            print(f"Cache refresh error for '{key}': {e}", flush=True)
+        finally:
+            with self._lock:
+                self._inflight.pop(key, None)
+            flight.done.set()
+
+    def _wait_for_remote(self, key):
+        deadline = time.time() + min(self.wait_timeout, 2)
+        while time.time() < deadline:
+            time.sleep(0.05)
+            entry = self._backend_get(key)
+            if self._classify(entry) == 'fresh':
+                return entry
+        return None
+
+    # -----------------------
+    # ASYNC API (Quart)
+
+    async def get_async(self, key, loader):
+        """
+        DESCRIPTION:
+            Same as get() for the asyncio server. loader is an async function.
+        """
+
+        entry = await self._run_backend(self._backend_get, key)
+        state = self._classify(entry)
+
+        if state == 'fresh':
+            self._count('hits')
+            return entry['value']
+
+        if state == 'stale':
+            self._count('stale_hits')
+            if key not in self._async_inflight:
+                future = self._async_inflight[key] = asyncio.get_running_loop().create_future()
+                task = asyncio.create_task(self._run_flight_async(key, loader, future))
+                self._refresh_tasks.add(task)
+                task.add_done_callback(self._refresh_tasks.discard)
+            return entry['value']
+
+        future = self._async_inflight.get(key)
+        if future is not None:
+            # Another request is already loading this key: wait for its result
+            self._count('coalesced')
+            try:
+                return await asyncio.wait_for(asyncio.shield(future), self.wait_timeout)
+            except Exception:
+                if entry is not None:
+                    return entry['value']
+                raise
+
+        if entry is None:
+            # Expired from the backend: fall back to the value seen last
+            entry = self._last_known_entry(key)
+        self._count('misses')
+        future = self._async_inflight[key] = asyncio.get_running_loop().create_future()
+        await self._run_flight_async(key, loader, future, wait_for_remote = True)
+        if future.exception() is None:
+            return future.result()
+        if entry is not None:
+            print(f"Cache refresh failed, serving last known '{key}'", flush=True)
+            return entry['value']
+        raise future.exception()
+
+    async def _run_flight_async(self, key, loader, future, wait_for_remote = False):
+        try:
+            locked = await self._run_backend(self._try_lock, key)
+            if not locked:
+                # Another instance is refreshing the shared entry
+                entry = await self._run_backend(self._wait_for_remote, key) if wait_for_remote else None
+                if entry is not None:
+                    future.set_result(entry['value'])
+                    return
+                if not wait_for_remote:
+                    raise RefreshRunningElsewhere(key)
+            try:
+                value = await loader()
+                await self._run_backend(self._store, key, value)
+            finally:
+                if locked:
+                    await self._run_backend(self._unlock, key)
+            future.set_result(value)
+        except Exception as e:
+            if not isinstance(e, RefreshRunningElsewhere):
+                self._count('refresh_errors')
+                print(f"Cache refresh error for '{key}': {e}", flush=True)
+            future.set_exception(e)
+            future.exception()  # mark as retrieved when nobody is waiting
+        finally:
+            self._async_inflight.pop(key, None)
+
+    async def _run_backend(self, function, *args):
+        # Remote backends do network I/O, keep it off the event loop
+        if self.backend.is_remote:
+            return await asyncio.to_thread(function, *args)
+        return function(*args)
+
+    # -----------------------
+    # INTERNALS
+
+    def _classify(self, entry):
+        if entry is None:
+            return 'missing'
+        age = time.time() - entry['stored_at']
+        if age < self.ttl:
+            return 'fresh'
+        if age < self.ttl + self.stale_ttl:
+            return 'stale'
+        return 'expired'
+
+    def _count(self, name):
+        with self._lock:
+            self._stats[name] += 1
+
+    def _backend_get(self, key):
+        try:
+            entry = self.backend.get(key)
+        except Exception as e:
+            print(f"Cache backend read error (non-fatal): {e}", flush=True)
+            return None
+        if entry is not None:
+            with self._lock:
+                self._last_known[key] = entry['value']
+        return entry
+
+    def _last_known_entry(self, key):
+        with self._lock:
+            if key not in self._last_known:
+                return None
+            return {'value': self._last_known[key], 'stored_at': 0}
+
+    def _store(self, key, value):
+        with self._lock:
+            self._stats['refreshes'] += 1
+            self._last_known[key] = value
+        try:
+            self.backend.set(key, {'value': value, 'stored_at': time.time()}, self.ttl + self.stale_ttl)
+        except Exception as e:
+            print(f"Cache backend write error (non-fatal): {e}", flush=True)
+
+    def _try_lock(self, key):
+        try:
+            return self.backend.try_lock(key, self.wait_timeout)
+        except Exception:
+            return True
+
+    def _unlock(self, key):
+        try:
+            self.backend.unlock(key)
+        except Exception:
+            pass
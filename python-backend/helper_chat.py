@@ -0,0 +1,253 @@
+# Shared chat helpers for the Flask (app.py) and asyncio (app_async.py) servers.
+# Everything here is framework-agnostic: no request objects, no clients.
+
+from helper_startup import load_env_file
+import functools
+import hashlib
+import os
+import json
+
+@functools.lru_cache(maxsize=None)
+def get_token_encoding():
+    """
+    Local token counting. tiktoken is used when available; otherwise a
+    conservative estimate based on the UTF-8 size of the text is used.
+    Loaded on first use (or by the startup warm-up), not at import time,
+    since reading the encoding takes a noticeable part of a cold start.
+    """
+    try:
+        import tiktoken
+        return tiktoken.get_encoding(os.getenv('CHAT_TOKEN_ENCODING', 'o200k_base'))
+    except Exception:
+        return None
+
+def load_api_key():
+    if not load_env_file():
+        return None, None
+
+    return os.getenv('openai_api_key')
+
+DEFAULT_MODEL = "gpt-5-nano-2025-08-07"
+
+# Token budget for everything sent to the model (system prompt + history).
+# Older turns are dropped until the conversation fits.
+CHAT_INPUT_TOKEN_BUDGET = int(os.getenv('CHAT_INPUT_TOKEN_BUDGET', 6000))
+
+# Tokens the chat format adds per message and to prime the reply
+TOKENS_PER_MESSAGE = 4
+TOKENS_PER_REPLY = 3
+
+# Completion (including reasoning) tokens assumed per call when reserving
+# token budget before the call; corrected with response.usage afterwards
+CHAT_EXPECTED_COMPLETION_TOKENS = int(os.getenv('CHAT_EXPECTED_COMPLETION_TOKENS', 1000))
+
+NO_MESSAGE_REPLY = 'No message received'
+ERROR_REPLY = 'Sorry, I encountered an error processing your request.'
+RATE_LIMITED_REPLY = 'You are sending questions too quickly. Please wait a moment and try again.'
+BUSY_REPLY = 'SEVY AI is receiving a lot of questions right now. Please try again in a moment.'
+DEVELOPER_MODE_REPLY = "This is a default response in developer mode."
+
+# Comprehensive system prompt for SEVY AI with language detection priority
+SYSTEM_MESSAGE = """# CRITICAL INSTRUCTION: Language Matching
+
+You MUST respond in the EXACT language the user writes in. This is absolutely non-negotiable and overrides all other contextual information.
+
+**Language Matching Examples:**
+- User writes in French ("Bonjour" or "C'est quoi l'éducation sexuelle?") → You respond ENTIRELY in French
+- User writes in Spanish ("Hola" or "¿Qué es el sexo seguro?") → You respond ENTIRELY in Spanish
+- User writes in English ("Hello" or "What is consent?") → You respond ENTIRELY in English
+- User writes in German ("Hallo" or "Was ist Aufklärung?") → You respond ENTIRELY in German
+- User writes in Vietnamese ("Xin chào" or "Tình dục an toàn là gì?") → You respond ENTIRELY in Vietnamese
+- User writes in Italian ("Ciao" or "Cos'è l'educazione sessuale?") → You respond ENTIRELY in Italian
+
+Do NOT assume the user's language based on organizational context. Always match their input language precisely, even with single-word inputs.
+
+---
+
+## Your Identity
+
+You are SEVY AI, an AI assistant created by Sex Education for Vietnamese Youth (SEVY), a nonprofit organization dedicated to providing comprehensive sex education.
+
+**IMPORTANT**: You are created by SEVY, not by OpenAI or any other organization. You are powered by SEVY's expertise in sex education for youth.
+
+## About SEVY
+
+SEVY is a nonprofit organization with a clear mission:
+- **SEVY AI**: Provides free and private counseling 24/7 to anyone with an Internet connection. Trained on SEVY's in-house curricula, SEVY AI can answer all sex-education-related questions where in-person assistance is not yet available. All conversations are encrypted in transit, and data is never stored.
+- **In-Person Education**: SEVY provides in-person sex education to students at partner schools at no cost. Always.
+- **Vision**: We believe free and accessible sex education is a fundamental human right. SEVY set out on a mission to bring sex education to every child, starting in our home country, Vietnam.
+
+## Your Role and Scope
+
+**Your Mission**: Provide accurate, age-appropriate, non-judgmental sex education information in a safe and supportive manner.
+
+**In Scope**: Questions related to:
+- Sexual health, anatomy, and physiology
+- Relationships, consent, and communication
+- Contraception, pregnancy, and STI prevention
+- Puberty, development, and body changes
+- LGBTQ+ topics and gender identity
+- Sexual safety, boundaries, and rights
+- Mental and emotional aspects of sexuality
+- Any other sex-education-related topics
+
+**Out of Scope**: Questions unrelated to sex education (e.g., weather, math homework, general knowledge).
+- When asked out-of-scope questions, politely decline and remind the user: "I'm SEVY AI, and I specialize in sex education topics. I'm here to answer any questions related to sexual health, relationships, or related topics. Is there anything in this area I can help you with?"
+
+## Content Guidelines
+
+1. **Age-Appropriate Language**: Use clear, accessible language suitable for youth. Avoid overly clinical terminology when simpler terms work, but remain scientifically accurate.
+
+2. **Non-Judgmental Stance**: Be supportive, empathetic, and non-judgmental regardless of the question or situation. Create a safe space where users feel comfortable asking anything.
+
+3. **Cultural Sensitivity**: When users are in Vietnam or when Vietnamese cultural context is relevant, be mindful of local cultural dynamics, family structures, and social norms around sex education while providing evidence-based information. For users in other countries or cultural contexts, adapt appropriately to their background.
+
+4. **Practical Solutions**: Provide actionable advice and practical solutions rather than directing users elsewhere, whenever possible.
+
+## Crisis Intervention Protocol
+
+If a user mentions abuse, assault, self-harm, or any crisis situation:
+
+1. **Acknowledge with empathy**: "I'm so sorry you're going through this. Your safety and well-being are the most important priority."
+
+2. **Ask for location**: "To provide you with the most relevant resources, could you let me know which city or country you're in?"
+
+3. **Provide localized resources**: Once location is provided, offer specific hotlines, organizations, or resources available in their area:
+   - **Vietnam**: Include Vietnamese resources (e.g., local hotlines, NGOs, hospitals)
+   - **Other countries**: Provide appropriate resources for their specific location
+   - **General**: If location is unclear, provide both local and international resources
+
+4. **Encourage professional help**: Gently encourage seeking help from trusted adults, counselors, or authorities as appropriate.
+
+## Conversation Style
+
+- Maintain conversation context across messages to provide coherent, personalized responses
+- Be warm, supportive, and approachable
+- Provide evidence-based information with empathy
+- Match the user's communication style and formality level
+
+---
+
+**REMINDER**: Always respond in the EXACT language the user writes in. Never default to any language based on organizational context."""
+
+def count_tokens(text):
+    """Count the tokens of a string locally (no API call)."""
+    encoding = get_token_encoding()
+    if encoding is not None:
+        return len(encoding.encode(text, disallowed_special=()))
+    return len(text.encode('utf-8')) // 3 + 1
+
+def count_message_tokens(message):
+    """Tokens used by one chat message, including the chat format overhead."""
+    content = message.get('content', '') if isinstance(message, dict) else message
+    if not isinstance(content, str):
+        content = json.dumps(content, ensure_ascii=False)
+    return TOKENS_PER_MESSAGE + count_tokens(content)
+
+# The system prompt is built once and sent as the identical first message of
+# every request, so the provider's automatic prompt caching can reuse it.
+# PROMPT_CACHE_KEY routes requests sharing this prefix to the same cache and
+# changes whenever the prompt changes.
+SYSTEM_PROMPT_MESSAGE = {"role": "system", "content": SYSTEM_MESSAGE}
+PROMPT_CACHE_KEY = 'sevy-system-' + hashlib.sha256(SYSTEM_MESSAGE.encode('utf-8')).hexdigest()[:16]
+
+@functools.lru_cache(maxsize=None)
+def system_prompt_tokens():
+    """Tokens of the system prompt message (counted once)."""
+    return count_message_tokens(SYSTEM_PROMPT_MESSAGE)
+
+def build_messages_for_api(messages_history):
+    """Prepend the SEVY AI system prompt to the conversation history."""
+    messages_for_api = [SYSTEM_PROMPT_MESSAGE]
+    messages_for_api.extend(messages_history)
+    return messages_for_api
+
+def estimate_request_tokens(messages_for_api):
+    """Tokens reserved for one chat completion: the input plus the expected completion."""
+    input_tokens = sum(count_message_tokens(message) for message in messages_for_api[1:])
+    return system_prompt_tokens() + input_tokens + TOKENS_PER_REPLY + CHAT_EXPECTED_COMPLETION_TOKENS
+
+def wants_stream(data, accept_header=''):
+    """
+    Streaming mode is enabled with {"stream": true} in the JSON body or an
+    "Accept: text/event-stream" header.
+    """
+    return data.get('stream', False) is True or 'text/event-stream' in (accept_header or '')
+
+def extract_messages_history(data):
+    """
+    Read the conversation from a /chat request body.
+    Accepts either:
+    - Legacy format: {"message": "..."}
+    - New format: {"messages": [...]}
+
+    Returns:
+        List of message objects, or None if no usable message was sent
+    """
+    # Support both legacy single message and new messages array format
+    messages_history = data.get('messages', [])
+    legacy_message = data.get('message', '')
+
+    # If legacy format, convert to messages array
+    if legacy_message and not messages_history:
+        messages_history = [{"role": "user", "content": legacy_message}]
+        print("Using legacy single-message format", flush=True)
+
+    # Validate messages array
+    if not messages_history or not isinstance(messages_history, list):
+        return None
+
+    return messages_history
+
+def trim_to_token_budget(messages_history, budget=None):
+    """
+    Keep the most recent messages that fit the input token budget.
+
+    Messages are counted newest first and older turns are dropped once the
+    budget (system prompt + history + reply priming) would be exceeded.
+    The latest message is always kept, even if it alone is over budget.
+
+    Returns:
+        (messages_history, input_tokens): the trimmed conversation and the
+        estimated input tokens of the request
+    """
+    budget = CHAT_INPUT_TOKEN_BUDGET if budget is None else budget
+    used = system_prompt_tokens() + TOKENS_PER_REPLY
+
+    kept = 0
+    for message in reversed(messages_history):
+        tokens = count_message_tokens(message)
+        if kept and used + tokens > budget:
+            break
+        used += tokens
+        kept += 1
+
+    dropped = len(messages_history) - kept
+    if dropped:
+        messages_history = messages_history[dropped:]
+        print(f"Applied token budget: dropped {dropped} older messages to fit {budget} tokens", flush=True)
+
+    return messages_history, used
+
+def log_token_usage(usage):
+    """
+    Print the token counts of one completion (metadata only, no content).
+    cached_tokens shows how much of the prompt was served from the
+    provider's prompt cache.
+    """
+    if usage is None:
+        return
+    details = getattr(usage, 'prompt_tokens_details', None)
+    cached_tokens = getattr(details, 'cached_tokens', None) or 0
+    print(f"Token usage: prompt={usage.prompt_tokens} (cached={cached_tokens}) "
+          f"completion={usage.completion_tokens} total={usage.total_tokens}", flush=True)
+
+def format_sse(event, data):
+    """Format one Server-Sent Events frame with a JSON payload."""
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+# Headers sent with every SSE response
+SSE_HEADERS = {
+    'Cache-Control': 'no-cache',
+    'X-Accel-Buffering': 'no'  # disable proxy buffering (nginx)
+}
@@ -0,0 +1,408 @@
+import asyncio
+import collections
+import contextvars
+import hashlib
+import json
+import os
+import threading
+import time
+
+# Request coalescing (single flight) for chat completions.
+#
+# When a class uses SEVY AI together, many students send the same prompt
+# within seconds. Chats whose conversation (after trimming) and model are
+# identical share one upstream OpenAI call instead of starting one each:
+#   - blocking chats wait for the reply of the first one
+#   - streaming chats subscribe to one shared stream; a late subscriber first
+#     gets the deltas it missed, then follows along. The shared stream runs
+#     in the background so it does not end when the first client
+#     disconnects; it is closed once every subscriber has gone.
+# A finished reply can still be joined for CHAT_COALESCE_WINDOW_SECONDS
+# (default 3); failed calls are never reused after they finished.
+#
+# At most CHAT_COALESCE_MAX_KEYS (default 1000) conversations are tracked;
+# beyond that, chats simply make their own call. CHAT_COALESCE_ENABLED=false
+# turns coalescing off.
+#
+# PRIVACY: conversations are identified by a SHA-256 of their content, and
+# shared replies are only held in memory for the window above: a background
+# thread drops them when it ends (or once the last chat still reading a
+# shared stream is done with it), whether or not other chats arrive.
+
+CHAT_COALESCE_ENABLED = os.getenv('CHAT_COALESCE_ENABLED', 'true').lower() in ('1', 'true', 'yes')
+
+def coalesce_key(messages_history, model):
+    """
+    DESCRIPTION:
+        Key of a conversation for coalescing: identical (role, content) turns,
+        ignoring surrounding whitespace, and the same model give the same key.
+
+    INPUT SIGNATURE:
+        messages_history: list of {'role': ..., 'content': ...} dicts
+        model: model name (string)
+
+    OUTPUT SIGNATURE:
+        Hex digest (string)
+    """
+
+    turns = [[message.get('role'), (message.get('content') or '').strip()] for message in messages_history]
+    payload = json.dumps([model, turns], ensure_ascii=False, separators=(',', ':'))
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+class StreamAbandoned(Exception):
+    """Ends a shared stream that every subscriber has left."""
+
+class _Flight:
+    def __init__(self, is_async = False):
+        self.chunks = []           # deltas so far (streams only)
+        self.value = None          # reply (blocking calls only)
+        self.error = None
+        self.failed = False
+        self.finished_at = None
+        self.expired = False
+        self.subscribers = 0
+        if is_async:
+            self.changed = asyncio.Event()
+            self.task = None
+        else:
+            self.changed = threading.Condition()
+
+    @property
+    def reusable(self):
+        # Still running, or finished successfully within the window
+        return self.finished_at is None or not self.failed
+
+class ChatCoalescer:
+    """
+    DESCRIPTION:
+        Shares one upstream call between identical concurrent chats.
+
+    INPUT SIGNATURE:
+        window: seconds a finished reply can still be joined
+                (default: CHAT_COALESCE_WINDOW_SECONDS or 3)
+        max_keys: most conversations tracked at once
+                  (default: CHAT_COALESCE_MAX_KEYS or 1000)
+        enabled: default CHAT_COALESCE_ENABLED
+    """
+
+    def __init__(self, window = None, max_keys = None, enabled = None):
+        self.window = float(window if window is not None else os.getenv('CHAT_COALESCE_WINDOW_SECONDS', 3))
+        self.max_keys = max(1, int(max_keys if max_keys is not None
+                                   else os.getenv('CHAT_COALESCE_MAX_KEYS', 1000)))
+        self.enabled = CHAT_COALESCE_ENABLED if enabled is None else enabled
+
+        self._lock = threading.Lock()
+        self._flights = {}                     # key -> _Flight
+        self._expiring = collections.deque()   # (expires_at, key, flight), finished successfully, oldest first
+        self._expiry_changed = threading.Condition(self._lock)
+        self._sweeper = None
+        self._stats = {
+            'upstream_calls': 0,
+            'saved_blocking': 0,
+            'saved_stream': 0,
+            'bypassed': 0
+        }
+
+    def stats(self):
+        """
+        DESCRIPTION:
+            Upstream calls made through the coalescer, calls saved per mode
+            (chats served by another chat's call), chats that bypassed it
+            because too many conversations were tracked, and tracked entries.
+        """
+
+        with self._lock:
+            stats = dict(self._stats)
+            stats['entries'] = len(self._flights)
+        return stats
+
+    def _join(self, key, is_async):
+        # key is (mode, coalesce_key): blocking and streaming calls are never
+        # shared with each other. Returns (flight, leader), or (None, False)
+        # when too many conversations are tracked.
+        now = time.monotonic()
+        with self._lock:
+            self._expire(now)
+
+            flight = self._flights.get(key)
+            if flight is not None and flight.reusable and (
+                    flight.finished_at is None or now - flight.finished_at < self.window):
+                flight.subscribers += 1
+                return flight, False
+            if len(self._flights) >= self.max_keys and key not in self._flights:
+                self._stats['bypassed'] += 1
+                return None, False
+
+            flight = self._flights[key] = _Flight(is_async)
+            flight.subscribers = 1
+            self._stats['upstream_calls'] += 1
+            return flight, True
+
+    def _finish(self, key, flight, error = None, failed = False):
+        with self._lock:
+            flight.error = error
+            flight.failed = failed or error is not None
+            flight.finished_at = time.monotonic()
+            if flight.failed:
+                if self._flights.get(key) is flight:
+                    del self._flights[key]
+                return
+            self._expiring.append((flight.finished_at + self.window, key, flight))
+            self._expiry_changed.notify()
+            if self._sweeper is None:
+                self._sweeper = threading.Thread(target=self._sweep, name='chat-coalesce-expiry', daemon=True)
+                self._sweeper.start()
+
+    def _leave(self, flight):
+        # A chat is done with the flight's reply
+        with self._lock:
+            flight.subscribers -= 1
+            if flight.subscribers <= 0 and flight.expired:
+                self._clear(flight)
+
+    def _expire(self, now):
+        # Called with _lock held: forget the replies finished more than window ago
+        while self._expiring and self._expiring[0][0] <= now:
+            _, key, flight = self._expiring.popleft()
+            if self._flights.get(key) is flight:
+                del self._flights[key]
+            flight.expired = True
+            if flight.subscribers <= 0:
+                self._clear(flight)
+
+    @staticmethod
+    def _clear(flight):
+        flight.value = None
+        flight.chunks = []
+        if hasattr(flight, 'task'):
+            flight.task = None
+
+    def _sweep(self):
+        # Expires replies on time even when no other chat comes in
+        with self._lock:
+            while True:
+                if not self._expiring:
+                    self._expiry_changed.wait()
+                    continue
+                delay = self._expiring[0][0] - time.monotonic()
+                if delay > 0:
+                    self._expiry_changed.wait(delay)
+                    continue
+                self._expire(time.monotonic())
+
+    def _count_saved(self, mode):
+        with self._lock:
+            self._stats[f'saved_{mode}'] += 1
+
+    # -----------------------
+    # SYNC API (Flask)
+
+    def run(self, key, fn):
+        """
+        DESCRIPTION:
+            Call fn() once for all concurrent callers with the same key.
+
+        INPUT SIGNATURE:
+            key: coalesce_key() of the conversation
+            fn: function returning the reply (None counts as a failure)
+
+        OUTPUT SIGNATURE:
+            (reply, shared): shared is True if the reply came from another
+            caller's call. Raises fn's exception to every waiting caller.
+        """
+
+        key = ('blocking', key)
+        flight, leader = self._join(key, False) if self.enabled else (None, False)
+        if flight is None:
+            return fn(), False
+
+        try:
+            if leader:
+                try:
+                    flight.value = fn()
+                except Exception as e:
+                    self._finish(key, flight, e)
+                    raise
+                else:
+                    self._finish(key, flight, failed = not flight.value)
+                finally:
+                    with flight.changed:
+                        flight.changed.notify_all()
+                return flight.value, False
+
+            with flight.changed:
+                flight.changed.wait_for(lambda: flight.finished_at is not None)
+            if flight.error is not None:
+                raise flight.error
+            if flight.value:
+                self._count_saved('blocking')
+            return flight.value, True
+        finally:
+            self._leave(flight)
+
+    def stream(self, key, fn):
+        """
+        DESCRIPTION:
+            Iterate one shared fn() stream for all concurrent callers with
+            the same key. The first caller starts a background thread that
+            pumps fn() into the flight.
+
+        INPUT SIGNATURE:
+            key: coalesce_key() of the conversation
+            fn: function returning an iterator of text deltas
+
+        OUTPUT SIGNATURE:
+            (deltas, shared): an iterator over every delta of the stream,
+            and whether it is another caller's stream. Iterating raises
+            fn's exception after the deltas received before it.
+        """
+
+        key = ('stream', key)
+        flight, leader = self._join(key, False) if self.enabled else (None, False)
+        if flight is None:
+            return fn(), False
+        if leader:
+            # Runs in the caller's context, so the caller's request profile
+            # (helper_profiling.py) sees the upstream call
+            threading.Thread(target=contextvars.copy_context().run, args=(self._pump, key, flight, fn),
+                             name='chat-coalesce-stream', daemon=True).start()
+        return self._subscribe(flight, not leader), not leader
+
+    def _pump(self, key, flight, fn):
+        error = None
+        deltas = fn()
+        try:
+            for delta in deltas:
+                with flight.changed:
+                    flight.chunks.append(delta)
+                    flight.changed.notify_all()
+                with self._lock:
+                    abandoned = flight.subscribers == 0
+                if abandoned:
+                    error = StreamAbandoned(key)
+                    break
+        except Exception as e:
+            error = e
+        finally:
+            close = getattr(deltas, 'close', None)
+            if close is not None:
+                close()
+            self._finish(key, flight, error)
+            with flight.changed:
+                flight.changed.notify_all()
+
+    def _subscribe(self, flight, shared):
+        index = 0
+        try:
+            while True:
+                with flight.changed:
+                    flight.changed.wait_for(lambda: len(flight.chunks) > index or flight.finished_at is not None)
+                    chunks = flight.chunks[index:]
+                    finished = flight.finished_at is not None
+                for delta in chunks:
+                    yield delta
+                index += len(chunks)
+                if finished and index >= len(flight.chunks):
+                    break
+            if flight.error is not None:
+                raise flight.error
+            if shared:
+                self._count_saved('stream')
+        finally:
+            self._leave(flight)
+
+    # -----------------------
+    # ASYNC API (Quart)
+
+    async def run_async(self, key, fn):
+        """
+        DESCRIPTION:
+            Same as run() for the asyncio server. fn is an async function;
+            it runs in its own task, so a disconnecting first caller does
+            not cancel the call for the others.
+        """
+
+        key = ('blocking', key)
+        flight, leader = self._join(key, True) if self.enabled else (None, False)
+        if flight is None:
+            return await fn(), False
+
+        try:
+            if leader:
+                flight.task = asyncio.ensure_future(self._run_flight_async(key, flight, fn))
+            value = await asyncio.shield(flight.task)
+            if not leader and value:
+                self._count_saved('blocking')
+            return value, not leader
+        finally:
+            self._leave(flight)
+
+    async def _run_flight_async(self, key, flight, fn):
+        try:
+            flight.value = await fn()
+        except BaseException as e:
+            self._finish(key, flight, e)
+            raise
+        self._finish(key, flight, failed = not flight.value)
+        return flight.value
+
+    def stream_async(self, key, fn):
+        """
+        DESCRIPTION:
+            Same as stream() for the asyncio server. fn returns an async
+            iterator of text deltas, pumped by a background task.
+
+        OUTPUT SIGNATURE:
+            (deltas, shared): an async iterator and whether it is another
+            caller's stream
+        """
+
+        key = ('stream', key)
+        flight, leader = self._join(key, True) if self.enabled else (None, False)
+        if flight is None:
+            return fn(), False
+        if leader:
+            flight.task = asyncio.ensure_future(self._pump_async(key, flight, fn))
+        return self._subscribe_async(flight, not leader), not leader
+
+    async def _pump_async(self, key, flight, fn):
+        error = None
+        deltas = fn()
+        try:
+            async for delta in deltas:
+                flight.chunks.append(delta)
+                self._notify_async(flight)
+                if flight.subscribers == 0:
+                    error = StreamAbandoned(key)
+                    break
+        except Exception as e:
+            error = e
+        finally:
+            close = getattr(deltas, 'aclose', None)
+            if close is not None:
+                await close()
+            self._finish(key, flight, error)
+            self._notify_async(flight)
+
+    @staticmethod
+    def _notify_async(flight):
+        changed, flight.changed = flight.changed, asyncio.Event()
+        changed.set()
+
+    async def _subscribe_async(self, flight, shared):
+        index = 0
+        try:
+            while True:
+                changed = flight.changed
+                while index < len(flight.chunks):
+                    yield flight.chunks[index]
+                    index += 1
+                if flight.finished_at is not None and index >= len(flight.chunks):
+                    break
+                await changed.wait()
+            if flight.error is not None:
+                raise flight.error
+            if shared:
+                self._count_saved('stream')
+        finally:
+            self._leave(flight)
@@ -0,0 +1,1095 @@
+from helper_mongodb import (
+    AnswerCounterAggregator, MongoCircuitBreaker, MongoUnavailable, build_application_document,
+    build_subscription_document, subscribe_email_address, subscribe_email_address_async,
+    apply_daily_inflation, apply_daily_inflation_async, sevy_numbers_pipeline, parse_sevy_numbers,
+    ensure_email_list_index, ensure_counter_shards, close_mongo_client
+)
+from helper_cache import StatsCache, stats_etag, stats_cache_control
+from helper_answer_cache import AnswerCache, ANSWER_CACHE_EMBEDDING_MODEL
+from helper_uploads import uploaded_bytes
+from helper_write_queue import WriteBehindQueue, WriteQueueFull, WRITE_QUEUE_ENABLED
+from helper_admission import AdmissionController, OpenAIBusy
+from helper_hedging import Deadline, Hedger, read_first_delta, read_first_delta_async
+from helper_rate_limit import RateLimiter, client_address, client_id, CLIENT_ID_HEADER
+from helper_coalesce import ChatCoalescer, coalesce_key
+from helper_export import ExportFormatter, export_cursor, parse_export_time, ensure_export_indexes, \
+    load_admin_token, admin_authorized, admin_token_matches
+from helper_profiling import RequestProfiler, profile_span, register_mongo_profiling
+from helper_metrics import (
+    record_openai_call, record_openai_first_token, register_cache_collectors, register_mongo_command_metrics,
+    register_write_queue_collectors, record_upload, record_openai_admission, register_admission_collectors,
+    register_rate_limit_collectors, record_chat_route, register_coalesce_collectors,
+    register_hedge_collectors, register_profiler_collectors, register_breaker_collectors
+)
+from helper_chat import (
+    DEFAULT_MODEL, ERROR_REPLY, BUSY_REPLY, DEVELOPER_MODE_REPLY, PROMPT_CACHE_KEY,
+    estimate_request_tokens, build_messages_for_api, log_token_usage, format_sse, get_token_encoding
+)
+from werkzeug.http import quote_etag
+from datetime import datetime, timezone
+import asyncio
+import os
+import threading
+import time
+
+# Request-independent core of the SEVY backend, shared by the Flask
+# (app.py) and asyncio (app_async.py) servers.
+#
+# SevyCore owns the clients and the services both servers need (OpenAI
+# admission and hedging, the Mongo circuit breaker, the answer counter, the
+# write queue, the caches, the rate limiter, the coalescer and the profiler)
+# and does everything a route does once its request is parsed: chat replies
+# and SSE frames, the SEVY numbers, form writes, exports and startup steps.
+# The apps only translate between their framework and these calls. Methods
+# that wait on I/O come as a blocking version (app.py) and an *_async one
+# (app_async.py).
+#
+# Replies are (payload, status, headers) tuples, or payload dicts, which
+# both frameworks return as JSON.
+
+# Environment detection for privacy-aware logging
+# In production (Google Cloud Run), K_SERVICE environment variable is always set
+# Local development environments will not have this variable
+IS_PRODUCTION = os.getenv('K_SERVICE') is not None
+
+NUMBERS_CACHE_KEY = 'sevy_numbers'
+
+# Probes and admin endpoints are never profiled
+UNPROFILED_ENDPOINTS = ('ready', 'export', 'profiles', 'profiles_collapsed')
+NUMBERS_UNAVAILABLE = {
+    'sevy_educators_number': 'N/A',
+    'sevy_ai_answers': 'N/A',
+    'students_taught': 'N/A'
+}
+
+# -----------------------
+# REPLIES
+
+def busy_payload(busy):
+    return {'reply': BUSY_REPLY, 'error': 'busy', 'retryAfter': busy.retry_after}
+
+def busy_reply(busy):
+    """503 "busy, retry after" reply for a chat that could not be admitted."""
+    return busy_payload(busy), 503, {'Retry-After': str(busy.retry_after)}
+
+def rate_limited_reply(endpoint, retry_after, body):
+    print(f"Rate limited: {endpoint}", flush=True)
+    return body, 429, {'Retry-After': str(retry_after)}
+
+def database_unavailable_reply(endpoint, retry_after):
+    """503 reply, sent at once, while MongoDB is unavailable (see MongoCircuitBreaker)."""
+    print(f"Database unavailable: {endpoint}", flush=True)
+    return {'success': False, 'error': 'database_unavailable', 'retryAfter': retry_after}, \
+        503, {'Retry-After': str(retry_after)}
+
+def upload_too_large_reply():
+    print("Application rejected: upload too large", flush=True)
+    return {'success': False, 'error': 'file_too_large'}, 413
+
+def admin_error_reply(endpoint, authorization):
+    """
+    None if the Authorization header carries the admin token (see
+    helper_export.py), otherwise the error reply: 404 while ADMIN_TOKEN is
+    not set, 401 for a missing or wrong token.
+    """
+    admin_token = load_admin_token()
+    if admin_token is None:
+        return {'success': False, 'error': 'not_found'}, 404
+    if not admin_authorized(authorization, admin_token):
+        print(f"Unauthorized admin request: {endpoint}", flush=True)
+        return {'success': False, 'error': 'unauthorized'}, 401, {'WWW-Authenticate': 'Bearer'}
+    return None
+
+def stats_reply(result, method, if_none_match):
+    """
+    Reply of a stats endpoint. GET requests get ETag and Cache-Control
+    headers, and a bodiless 304 when If-None-Match matches.
+    POST requests keep the original uncached response.
+    """
+    if method != 'GET':
+        return result
+
+    etag = stats_etag(result)
+    headers = {'Cache-Control': stats_cache_control(result), 'ETag': quote_etag(etag)}
+    if if_none_match.contains_weak(etag):
+        return '', 304, headers
+    return result, 200, headers
+
+def log_discarded_upload(file_storage, peak_memory = None):
+    """Report the size (and, if traced, parse peak memory) of a discarded upload."""
+    size = uploaded_bytes(file_storage)
+    record_upload(size, peak_memory)
+    peak = f", peak parse memory {peak_memory} bytes" if peak_memory is not None else ""
+    print(f"Resume file received: {file_storage.filename} ({size} bytes, not stored{peak})", flush=True)
+
+def log_completion_error(kind, error):
+    # PRIVACY: Only print detailed error info in local development
+    if IS_PRODUCTION:
+        print(f"\nError {kind} completion: OpenAI API error\n", flush=True)
+    else:
+        print(f"\nError {kind} completion: {error}\n", flush=True)
+
+def reply_frames(reply):
+    """SSE frames of a reply that is complete up front: one delta, then done."""
+    return [format_sse('delta', {'delta': reply}), format_sse('done', {'reply': reply})]
+
+# -----------------------
+# CORE
+
+class SevyCore:
+    """
+    DESCRIPTION:
+        The services and request-independent logic of the backend.
+
+    INPUT SIGNATURE:
+        openai_client: OpenAI client (AsyncOpenAI for the *_async methods),
+            usually a helper_startup.LazyClient
+        mongo_client: MongoDB client of the request path (AsyncMongoClient
+            for the *_async methods)
+        sync_mongo_client: synchronous MongoDB client of the background
+            threads (answer counter, write queue) and the startup steps;
+            defaults to mongo_client
+    """
+
+    def __init__(self, openai_client, mongo_client, sync_mongo_client = None):
+        self.openai_client = openai_client
+        self.mongo_client = mongo_client
+        self.sync_mongo_client = mongo_client if sync_mongo_client is None else sync_mongo_client
+
+        # Concurrency limit, rate limits, wait queue and retries for OpenAI
+        # calls (see helper_admission.py). Waiting async chats do not hold a thread.
+        self.openai_admission = AdmissionController()
+        register_admission_collectors(self.openai_admission)
+
+        # Second request for unusually slow OpenAI calls, within a budget
+        # (see helper_hedging.py; off unless OPENAI_HEDGING_ENABLED=true)
+        self.openai_hedger = Hedger(self.openai_admission)
+        register_hedge_collectors(self.openai_hedger)
+
+        # Mongo command timings and pool events for /metrics (must be
+        # registered before the clients are created; they are lazy)
+        register_mongo_command_metrics()
+        # Mongo command spans of profiled requests (only with PROFILING_ENABLED)
+        register_mongo_profiling()
+
+        # Circuit breaker for request-path MongoDB calls (short deadlines, fails
+        # fast while MongoDB is down - see helper_mongodb.py). While it is open,
+        # stats are served from the last known values, answer counts stay
+        # buffered and forms answer 503 database_unavailable.
+        self.mongo_breaker = MongoCircuitBreaker()
+        register_breaker_collectors(self.mongo_breaker)
+
+        # Buffered SEVY AI answer counter - increments are summed in memory and written
+        # by a background thread as one shard update, at most COUNTER_MAX_CRASH_LOSS behind
+        self.answer_counter = AnswerCounterAggregator(self.sync_mongo_client, breaker=self.mongo_breaker)
+
+        # Optional write-behind queue for form submissions (WRITE_QUEUE_ENABLED,
+        # see helper_write_queue.py). Started by the warm-up; until then
+        # submissions are written directly.
+        self.write_queue = None
+
+        # Shared stats cache for all numbers endpoints (30 second TTL, single-flight
+        # refresh, stale-while-revalidate, pluggable backend - see helper_cache.py)
+        self.stats_cache = StatsCache()
+
+        # Opt-in cache of anonymized first-turn answers (ANSWER_CACHE_ENABLED,
+        # see helper_answer_cache.py for the privacy rules)
+        self.answer_cache = AnswerCache()
+        register_cache_collectors(self.stats_cache, self.answer_cache)
+
+        # Per-client rate limits for /chat and the form endpoints (see helper_rate_limit.py)
+        self.rate_limiter = RateLimiter()
+        register_rate_limit_collectors(self.rate_limiter)
+
+        # Identical concurrent chats share one OpenAI call (see helper_coalesce.py)
+        self.chat_coalescer = ChatCoalescer()
+        register_coalesce_collectors(self.chat_coalescer)
+
+        # Opt-in profiling of sampled or requested requests (PROFILING_ENABLED,
+        # see helper_profiling.py)
+        self.request_profiler = RequestProfiler()
+        register_profiler_collectors(self.request_profiler)
+
+        # UTC day for which this process already ran the daily inflation check
+        self._inflation_checked_day = None
+        self._inflation_lock = threading.Lock()
+        self._inflation_running = False
+
+    # -----------------------
+    # SHARED HELPERS
+
+    def warm_up_steps(self, ping):
+        """Startup steps for helper_startup.WarmUp; ping checks the request-path client."""
+        return [
+            ('openai_client', self.openai_client.resolve),
+            ('token_encoding', get_token_encoding),
+            ('mongo_ping', ping),
+            ('email_list_index', self.prepare_email_list),
+            ('counter_shards', self.prepare_counter_shards),
+            ('export_indexes', self.prepare_export_indexes),
+            ('write_queue', self.start_write_queue)
+        ]
+
+    def prepare_email_list(self):
+        # Unique index that keeps SEVY_email_list free of duplicates (one-time
+        # backfill and de-duplication on first start, see ensure_email_list_index)
+        removed_duplicates = ensure_email_list_index(self.sync_mongo_client["SEVY_database"]["SEVY_email_list"])
+        if removed_duplicates:
+            print(f"Removed {removed_duplicates} duplicate email subscriptions", flush=True)
+
+    def prepare_counter_shards(self):
+        # Answer counter shards (see helper_mongodb.py), created with the
+        # synchronous client that also writes them; a no-op once they exist
+        created = ensure_counter_shards(self.sync_mongo_client["SEVY_database"]["SEVY_numbers"])
+        if created:
+            print(f"Created {created} answer counter shards", flush=True)
+
+    def prepare_export_indexes(self):
+        # (time, _id) indexes behind the export endpoint; a no-op once they exist
+        ensure_export_indexes(self.sync_mongo_client["SEVY_database"])
+
+    def start_write_queue(self):
+        # The queue drains from a background thread, so it uses the synchronous client
+        if WRITE_QUEUE_ENABLED:
+            self.write_queue = WriteBehindQueue(self.sync_mongo_client["SEVY_database"])
+            register_write_queue_collectors(self.write_queue)
+
+    def begin_profile(self, route, endpoint, method, profile_header):
+        """
+        Profile this request if it is sampled or carries
+        X-Sevy-Profile: <ADMIN_TOKEN> (see helper_profiling.py).
+        Returns the RequestProfile, or None.
+        """
+        if not self.request_profiler.enabled or endpoint in UNPROFILED_ENDPOINTS:
+            return None
+        requested = profile_header is not None and admin_token_matches(profile_header, load_admin_token())
+        return self.request_profiler.begin(route, method, requested)
+
+    def profiles_payload(self, route = None):
+        return {
+            'enabled': self.request_profiler.enabled,
+            'sampleRate': self.request_profiler.sample_rate,
+            'stats': self.request_profiler.stats(),
+            'profiles': [profile.summary() for profile in self.request_profiler.profiles(route)]
+        }
+
+    def cache_stats_payload(self):
+        return {
+            'stats_cache': self.stats_cache.stats(),
+            'answer_cache': self.answer_cache.stats()
+        }
+
+    def open_export(self, name, args):
+        """
+        DESCRIPTION:
+            Formatter and cursor of an export (see helper_export.py), from the
+            format, since, until, after and limit query parameters.
+
+        RAISES:
+            MongoUnavailable while the breaker is open
+            ValueError for an unknown export or invalid parameters
+        """
+
+        if self.mongo_breaker.is_open():
+            raise MongoUnavailable('MongoDB circuit breaker is open', self.mongo_breaker.retry_after())
+        formatter = ExportFormatter(name, args.get('format', 'csv'))
+        cursor = export_cursor(
+            self.mongo_client["SEVY_database"], name,
+            since=parse_export_time(args.get('since')),
+            until=parse_export_time(args.get('until')),
+            after=args.get('after'),
+            limit=args.get('limit', type=int)
+        )
+        # PRIVACY: only the export name and format, never exported data
+        print(f"Exporting {name} as {formatter.export_format}", flush=True)
+        return formatter, cursor
+
+    def _cached_reply_hit(self):
+        print("Answer cache hit", flush=True)
+
+    def _generated(self, question, vector, reply, shared, started):
+        if reply and shared:
+            print("Coalesced with an identical in-flight chat", flush=True)
+        elif reply and question:
+            self.answer_cache.put(question, reply, time.perf_counter() - started, vector)
+
+    def _final_reply(self, route, reply):
+        record_chat_route(route, 'success' if reply else 'error')
+        if reply:
+            # PRIVACY: Only print AI responses in local development, never in production
+            if not IS_PRODUCTION:
+                print(f"\nGenerated reply: {reply}\n", flush=True)
+            return reply
+        print("Error: generate_completion returned None", flush=True)
+        return ERROR_REPLY
+
+    def _developer_reply(self, streaming = False):
+        print(f"Developer mode active - {'streaming' if streaming else 'returning'} default response", flush=True)
+        return DEVELOPER_MODE_REPLY
+
+    def _rate_limit_client(self, remote_addr, headers):
+        # The client address, and the X-Sevy-Client ID if one is sent (only /chat uses it)
+        return client_address(remote_addr, headers.get('X-Forwarded-For')), client_id(headers.get(CLIENT_ID_HEADER))
+
+    def _admitted(self, ticket):
+        record_openai_admission('admitted', ticket.waited)
+        return ticket
+
+    def _not_admitted(self, busy):
+        record_openai_admission('rejected', busy.waited)
+        print(f"OpenAI call not admitted: {busy.reason}", flush=True)
+
+    def _completion_failed(self, model, started, error):
+        record_openai_call(model, 'blocking', 'error', time.perf_counter() - started)
+        if not isinstance(error, OpenAIBusy):
+            log_completion_error('generating', error)
+
+    def _stream_error_frame(self, route, error):
+        if isinstance(error, OpenAIBusy):
+            record_chat_route(route, 'busy')
+            return format_sse('error', busy_payload(error))
+        log_completion_error('streaming', error)
+        record_chat_route(route, 'error')
+        return format_sse('error', {
+            'error': 'generation_failed',
+            'reply': ERROR_REPLY
+        })
+
+    def _stream_done_frame(self, route, question, vector, parts, shared, started):
+        reply = ''.join(parts).strip()
+        # PRIVACY: Only print AI responses in local development, never in production
+        if not IS_PRODUCTION:
+            print(f"\nStreamed reply: {reply}\n", flush=True)
+        if shared:
+            print("Coalesced with an identical in-flight stream", flush=True)
+        elif reply and question:
+            self.answer_cache.put(question, reply, time.perf_counter() - started, vector)
+        record_chat_route(route)
+        return format_sse('done', {'reply': reply})
+
+    def _stored(self, kind, stored_id, queued):
+        print(f"{kind} {'queued' if queued else 'stored successfully'}: {stored_id}", flush=True)
+        return {'success': True}
+
+    def _form_failed(self, endpoint, action, error):
+        if isinstance(error, MongoUnavailable):
+            return database_unavailable_reply(endpoint, error.retry_after)
+        print(f"Error processing {action}: {error}", flush=True)
+        return {'success': False}, 500
+
+    def _duplicate_subscription(self, email):
+        print(f"Duplicate email subscription attempt: {email}", flush=True)
+        return {'success': False, 'isDuplicate': True}, 409
+
+    def _inflation_due(self, today_str):
+        # Retried by a later request once MongoDB is back
+        return self._inflation_checked_day != today_str and not self.mongo_breaker.is_open()
+
+    def _inflation_checked(self, today_str, applied):
+        self._inflation_checked_day = today_str
+        if applied is not None:
+            current_displayed, inflation_rate = applied
+            # Invalidate cache so the new value is served immediately
+            self.stats_cache.invalidate(NUMBERS_CACHE_KEY)
+            print(f"Applied daily inflation: {current_displayed} -> {int(current_displayed * (1 + inflation_rate))} (+{inflation_rate:.2%})", flush=True)
+
+    def _numbers_fetched(self, result):
+        print(f"Fetched numbers: {result}", flush=True)
+        return result
+
+    # -----------------------
+    # SYNC API (Flask)
+
+    def rate_limit(self, rule, remote_addr, headers):
+        """
+        Count a request against its client's rate limit (see helper_rate_limit.py).
+        Returns 0 if allowed, otherwise the seconds to wait.
+        PRIVACY: the client address and ID are never logged.
+        """
+        return self.rate_limiter.check(rule, *self._rate_limit_client(remote_addr, headers))
+
+    def admit_openai_call(self, messages_for_api):
+        """Wait for an OpenAI call slot (see helper_admission.py). Raises OpenAIBusy."""
+        try:
+            return self._admitted(self.openai_admission.acquire(estimate_request_tokens(messages_for_api)))
+        except OpenAIBusy as e:
+            self._not_admitted(e)
+            raise
+
+    def generate_completion(self, messages_history, model = DEFAULT_MODEL):
+        """
+        Generate AI completion with conversation context.
+
+        Args:
+            messages_history: List of message objects with 'role' and 'content'
+            model: OpenAI model to use
+
+        Returns:
+            AI response string or None on error
+
+        Raises:
+            OpenAIBusy when the call is not admitted or stays rate limited
+        """
+        # Build messages array: system message + conversation history
+        messages_for_api = build_messages_for_api(messages_history)
+        ticket = self.admit_openai_call(messages_for_api)
+
+        deadline = Deadline()
+        started = time.perf_counter()
+        usage = None
+        try:
+            def attempt():
+                return self.openai_admission.call(lambda: self.openai_client.chat.completions.create(
+                    model=model,
+                    messages=messages_for_api,
+                    n=1,
+                    stop=None,
+                    prompt_cache_key=PROMPT_CACHE_KEY,
+                    timeout=deadline.attempt_timeout()
+                ), deadline)
+
+            # A second request is sent if this one is unusually slow (see helper_hedging.py)
+            with profile_span('openai_call'):
+                response, hedged = self.openai_hedger.run('blocking', attempt, ticket.tokens)
+            record_openai_first_token('blocking', time.perf_counter() - started, hedged)
+            usage = response.usage
+            record_openai_call(model, 'blocking', 'success', time.perf_counter() - started, usage)
+            log_token_usage(usage)
+            self.answer_counter.increment()
+            return response.choices[0].message.content.strip()
+        except OpenAIBusy as e:
+            self._completion_failed(model, started, e)
+            raise
+        except Exception as e:
+            self._completion_failed(model, started, e)
+            return None
+        finally:
+            self.openai_admission.release(ticket, getattr(usage, 'total_tokens', None))
+
+    def generate_completion_stream(self, messages_history, model = DEFAULT_MODEL):
+        """
+        Stream an AI completion with conversation context.
+
+        Args:
+            messages_history: List of message objects with 'role' and 'content'
+            model: OpenAI model to use
+
+        Yields:
+            Text deltas as they arrive from the model
+
+        Raises:
+            OpenAIBusy when the call is not admitted or stays rate limited, or
+            any other OpenAI error. The caller turns it into an SSE error frame.
+
+        The call keeps its admission slot until the stream has finished.
+        The answer counter is only updated once the stream has finished. If the
+        client disconnects mid-stream (every client, for a stream shared by
+        chat_coalescer), the upstream stream is closed and the answer is not
+        counted.
+        """
+        messages_for_api = build_messages_for_api(messages_history)
+        ticket = self.admit_openai_call(messages_for_api)
+
+        deadline = Deadline()
+        started = time.perf_counter()
+        usage = None
+        outcome = 'error'
+        try:
+            # Only opening the stream is retried: a failure after the first
+            # delta would repeat text the client already has
+            def attempt():
+                opened = self.openai_admission.call(lambda: self.openai_client.chat.completions.create(
+                    model=model,
+                    messages=messages_for_api,
+                    n=1,
+                    stop=None,
+                    prompt_cache_key=PROMPT_CACHE_KEY,
+                    stream=True,
+                    stream_options={"include_usage": True},
+                    timeout=deadline.attempt_timeout()
+                ), deadline)
+                # Returns once the first token is there
+                return read_first_delta(opened)
+
+            def close_stream(opened):
+                opened[0].close()
+
+            # A second request is sent if this one is unusually slow (see helper_hedging.py)
+            with profile_span('openai_first_token'):
+                (stream, chunks), hedged = self.openai_hedger.run('stream', attempt, ticket.tokens, close_stream)
+            record_openai_first_token('stream', time.perf_counter() - started, hedged)
+            try:
+                with profile_span('openai_stream'):
+                    for chunk in chunks:
+                        # With include_usage, the final chunk carries the token usage
+                        if chunk.usage is not None:
+                            usage = chunk.usage
+                            log_token_usage(usage)
+                        if not chunk.choices:
+                            continue
+                        delta = chunk.choices[0].delta.content
+                        if delta:
+                            yield delta
+            finally:
+                stream.close()
+            outcome = 'success'
+        finally:
+            # A client disconnect closes this generator early and is counted as an error
+            record_openai_call(model, 'stream', outcome, time.perf_counter() - started, usage)
+            self.openai_admission.release(ticket, getattr(usage, 'total_tokens', None))
+
+        self.answer_counter.increment()
+
+    def embed_question(self, question):
+        response = self.openai_client.embeddings.create(model=ANSWER_CACHE_EMBEDDING_MODEL, input=question)
+        return response.data[0].embedding
+
+    def lookup_cached_answer(self, messages_history):
+        """
+        Look up the opt-in answer cache.
+        Returns (question, vector, answer); question is None when the
+        conversation bypasses the cache, answer is None on a miss.
+        """
+        question = self.answer_cache.question_for(messages_history)
+        if question is None:
+            return None, None, None
+        try:
+            answer, vector = self.answer_cache.lookup(question, self.embed_question)
+        except Exception as e:
+            # PRIVACY: only the error type, never the question
+            print(f"Answer cache lookup error (non-fatal): {type(e).__name__}", flush=True)
+            return question, None, None
+        return question, vector, answer
+
+    def chat_reply(self, messages_history, developer_mode = False, route = None):
+        """
+        DESCRIPTION:
+            Reply of a blocking chat: the developer mode reply, the canned
+            reply of the route, a cached answer or a generated one.
+            ERROR_REPLY when generation failed.
+
+        INPUT SIGNATURE:
+            messages_history: windowed conversation
+            developer_mode: boolean
+            route: helper_router.ChatRoute of the conversation (None in developer mode)
+
+        OUTPUT SIGNATURE:
+            Reply text (string)
+
+        RAISES:
+            OpenAIBusy when the OpenAI call could not be admitted
+        """
+
+        if developer_mode:
+            return self._developer_reply()
+
+        question, vector, reply = None, None, route.reply
+        if not reply and route.cacheable:
+            question, vector, reply = self.lookup_cached_answer(messages_history)
+            if reply:
+                self._cached_reply_hit()
+        if reply:
+            self.answer_counter.increment()
+        else:
+            # Generate AI response with full conversation context
+            # LLM naturally detects and responds in the user's language
+            started = time.perf_counter()
+            try:
+                reply, shared = self.chat_coalescer.run(
+                    coalesce_key(messages_history, route.model),
+                    lambda: self.generate_completion(messages_history, model=route.model)
+                )
+            except OpenAIBusy:
+                record_chat_route(route, 'busy')
+                raise
+            self._generated(question, vector, reply, shared, started)
+            if reply and shared:
+                # The answer was counted once by the call we shared
+                self.answer_counter.increment()
+        return self._final_reply(route, reply)
+
+    def chat_frames(self, messages_history, developer_mode = False, route = None):
+        """
+        Server-Sent Events frames of a streamed chat reply.
+
+        Frames (every data payload is JSON):
+        - event: delta  data: {"delta": "<text>"}   one per model chunk
+        - event: done   data: {"reply": "<full reply>"}   sent once on success
+        - event: error  data: {"error": "<code>", "reply": "<fallback text>"}
+          sent once on failure, always the last frame. Any deltas received
+          before an error frame should be discarded by the client.
+
+        Error codes: "no_message", "generation_failed", and "busy" (OpenAI
+        calls are saturated; the frame also carries "retryAfter" in seconds).
+
+        route is the helper_router.ChatRoute of the conversation (None in
+        developer mode); canned and cached replies are sent as a single delta.
+        """
+        if developer_mode:
+            yield from reply_frames(self._developer_reply(streaming=True))
+            return
+
+        if route.reply:
+            self.answer_counter.increment()
+            yield from reply_frames(route.reply)
+            record_chat_route(route)
+            return
+
+        question, vector, cached_reply = None, None, None
+        if route.cacheable:
+            question, vector, cached_reply = self.lookup_cached_answer(messages_history)
+        if cached_reply:
+            self._cached_reply_hit()
+            self.answer_counter.increment()
+            yield from reply_frames(cached_reply)
+            record_chat_route(route)
+            return
+
+        started = time.perf_counter()
+        parts = []
+        deltas, shared = self.chat_coalescer.stream(
+            coalesce_key(messages_history, route.model),
+            lambda: self.generate_completion_stream(messages_history, model=route.model)
+        )
+        try:
+            for delta in deltas:
+                parts.append(delta)
+                yield format_sse('delta', {'delta': delta})
+        except Exception as e:
+            yield self._stream_error_frame(route, e)
+            return
+        if shared:
+            # The answer was counted once by the stream we shared
+            self.answer_counter.increment()
+        yield self._stream_done_frame(route, question, vector, parts, shared, started)
+
+    def queue_write(self, collection_name, document, key_field = None):
+        """
+        Queue a form submission in the write-behind queue, if it is enabled.
+        Returns the queued document _id, or None when the caller must write
+        to MongoDB directly (queue disabled, full, or failing).
+        """
+        if self.write_queue is None:
+            return None
+        try:
+            return self.write_queue.enqueue(collection_name, document, key_field)
+        except WriteQueueFull:
+            print("Write queue full, writing directly", flush=True)
+        except Exception as e:
+            print(f"Write queue error, writing directly: {type(e).__name__}", flush=True)
+        return None
+
+    def submit_application(self, form, remote_addr):
+        """
+        Store the text fields of an application (never the resume), queued
+        in write-behind mode. Returns the reply.
+        """
+        try:
+            # Prepare application data (without resume)
+            application_data = build_application_document(form, remote_addr)
+
+            # Acknowledge as soon as the application is queued locally (write-behind mode)
+            queued_id = self.queue_write("SEVY_applications", application_data)
+            if queued_id is not None:
+                return self._stored("Application", queued_id, True)
+
+            # Store in MongoDB
+            collection = self.mongo_client["SEVY_database"]["SEVY_applications"]
+            result = self.mongo_breaker.call(lambda: collection.insert_one(application_data))
+            return self._stored("Application", result.inserted_id, False)
+        except Exception as e:
+            return self._form_failed('submit_application', 'application', e)
+
+    def subscribe_email(self, data, remote_addr):
+        """
+        Subscribe the email of a {"email": ...} payload unless it already is
+        (a single upsert on the normalized email, backed by a unique index).
+        Returns the reply: 409 isDuplicate for a known email.
+        """
+        try:
+            email = data.get('email', '').strip()
+
+            # Write-behind mode: duplicates are merged when the queue drains
+            subscription_data = build_subscription_document(email, remote_addr)
+            queued_id = self.queue_write("SEVY_email_list", subscription_data, key_field='emailNormalized')
+            if queued_id is not None:
+                return self._stored("Email subscription", queued_id, True)
+
+            collection = self.mongo_client["SEVY_database"]["SEVY_email_list"]
+
+            # Store in MongoDB unless already subscribed (one round trip)
+            inserted_id = self.mongo_breaker.call(lambda: subscribe_email_address(collection, email, remote_addr))
+            if inserted_id is None:
+                return self._duplicate_subscription(email)
+            return self._stored("Email subscription", inserted_id, False)
+        except Exception as e:
+            return self._form_failed('subscribe_email', 'email subscription', e)
+
+    def load_sevy_numbers(self):
+        """
+        Cache loader: read the SEVY numbers (counter shards summed) in one aggregation.
+        Fails fast with MongoUnavailable while the breaker is open, and the
+        cache then serves the last known numbers.
+        """
+        collection = self.mongo_client["SEVY_database"]["SEVY_numbers"]
+        return self._numbers_fetched(
+            self.mongo_breaker.call(lambda: parse_sevy_numbers(collection.aggregate(sevy_numbers_pipeline()))))
+
+    def get_cached_numbers(self):
+        return self.stats_cache.get(NUMBERS_CACHE_KEY, self.load_sevy_numbers)
+
+    def all_numbers(self):
+        """
+        All SEVY numbers from the shared stats cache, after the daily
+        inflation check; 'N/A' values when they cannot be read.
+        """
+        # Daily inflation check (in-memory day check, Mongo is only hit on a new UTC day)
+        self.check_daily_inflation()
+        # Cached numbers (one request refreshes, the others get the cached value)
+        try:
+            return self.get_cached_numbers()
+        except Exception as e:
+            print(f"Error fetching numbers: {e}", flush=True)
+            return dict(NUMBERS_UNAVAILABLE)
+
+    def single_number(self, field):
+        """{field: value} of one SEVY number from the shared stats cache, 'N/A' on error."""
+        print(f"Getting {field} value...", flush=True)
+        try:
+            value = self.get_cached_numbers()[field]
+            print(f"{field} value: {value}", flush=True)
+            return {field: value}
+        except Exception as e:
+            print(f"Error: {e}", flush=True)
+            return {field: 'N/A'}
+
+    def check_daily_inflation(self):
+        """
+        Run the daily inflation claim at most once per UTC day in this process.
+        The claim itself is idempotent across instances (see apply_daily_inflation),
+        so every other request of the day needs no database operation.
+        """
+        today_str = datetime.now(timezone.utc).strftime('%Y-%m-%d')
+        if not self._inflation_due(today_str):
+            return
+
+        # Only one thread runs the check; concurrent requests skip it instead of waiting
+        if not self._inflation_lock.acquire(blocking=False):
+            return
+        try:
+            if self._inflation_checked_day == today_str:
+                return
+            collection = self.mongo_client["SEVY_database"]["SEVY_numbers"]
+            self._inflation_checked(today_str, self.mongo_breaker.call(lambda: apply_daily_inflation(collection, today_str)))
+        except Exception as e:
+            print(f"Inflation check error (non-fatal): {e}", flush=True)
+        finally:
+            self._inflation_lock.release()
+
+    def ping_mongo(self):
+        self.mongo_client.admin.command('ping')
+
+    # -----------------------
+    # ASYNC API (Quart)
+
+    async def rate_limit_async(self, rule, remote_addr, headers):
+        """Same as rate_limit()."""
+        return await self.rate_limiter.check_async(rule, *self._rate_limit_client(remote_addr, headers))
+
+    async def admit_openai_call_async(self, messages_for_api):
+        """Same as admit_openai_call(); waiting does not hold a thread."""
+        try:
+            return self._admitted(await self.openai_admission.acquire_async(estimate_request_tokens(messages_for_api)))
+        except OpenAIBusy as e:
+            self._not_admitted(e)
+            raise
+
+    async def generate_completion_async(self, messages_history, model = DEFAULT_MODEL):
+        """Same as generate_completion(), with the AsyncOpenAI client."""
+        messages_for_api = build_messages_for_api(messages_history)
+        ticket = await self.admit_openai_call_async(messages_for_api)
+
+        deadline = Deadline()
+        started = time.perf_counter()
+        usage = None
+        try:
+            async def attempt():
+                return await self.openai_admission.call_async(lambda: self.openai_client.chat.completions.create(
+                    model=model,
+                    messages=messages_for_api,
+                    n=1,
+                    stop=None,
+                    prompt_cache_key=PROMPT_CACHE_KEY,
+                    timeout=deadline.attempt_timeout()
+                ), deadline)
+
+            # A second request is sent if this one is unusually slow (see helper_hedging.py)
+            with profile_span('openai_call'):
+                response, hedged = await self.openai_hedger.run_async('blocking', attempt, ticket.tokens)
+            record_openai_first_token('blocking', time.perf_counter() - started, hedged)
+            usage = response.usage
+            record_openai_call(model, 'blocking', 'success', time.perf_counter() - started, usage)
+            log_token_usage(usage)
+            await self.answer_counter.increment_async()
+            return response.choices[0].message.content.strip()
+        except OpenAIBusy as e:
+            self._completion_failed(model, started, e)
+            raise
+        except Exception as e:
+            self._completion_failed(model, started, e)
+            return None
+        finally:
+            self.openai_admission.release(ticket, getattr(usage, 'total_tokens', None))
+
+    async def generate_completion_stream_async(self, messages_history, model = DEFAULT_MODEL):
+        """Same as generate_completion_stream(), with the AsyncOpenAI client."""
+        messages_for_api = build_messages_for_api(messages_history)
+        ticket = await self.admit_openai_call_async(messages_for_api)
+
+        deadline = Deadline()
+        started = time.perf_counter()
+        usage = None
+        outcome = 'error'
+        try:
+            # Only opening the stream is retried (see generate_completion_stream)
+            async def attempt():
+                opened = await self.openai_admission.call_async(lambda: self.openai_client.chat.completions.create(
+                    model=model,
+                    messages=messages_for_api,
+                    n=1,
+                    stop=None,
+                    prompt_cache_key=PROMPT_CACHE_KEY,
+                    stream=True,
+                    stream_options={"include_usage": True},
+                    timeout=deadline.attempt_timeout()
+                ), deadline)
+                # Returns once the first token is there
+                return await read_first_delta_async(opened)
+
+            async def close_stream(opened):
+                await opened[0].close()
+
+            # A second request is sent if this one is unusually slow (see helper_hedging.py)
+            with profile_span('openai_first_token'):
+                (stream, chunks), hedged = await self.openai_hedger.run_async('stream', attempt, ticket.tokens, close_stream)
+            record_openai_first_token('stream', time.perf_counter() - started, hedged)
+            try:
+                with profile_span('openai_stream'):
+                    async for chunk in chunks:
+                        # With include_usage, the final chunk carries the token usage
+                        if chunk.usage is not None:
+                            usage = chunk.usage
+                            log_token_usage(usage)
+                        if not chunk.choices:
+                            continue
+                        delta = chunk.choices[0].delta.content
+                        if delta:
+                            yield delta
+            finally:
+                await stream.close()
+            outcome = 'success'
+        finally:
+            # A client disconnect closes this generator early and is counted as an error
+            record_openai_call(model, 'stream', outcome, time.perf_counter() - started, usage)
+            self.openai_admission.release(ticket, getattr(usage, 'total_tokens', None))
+
+        await self.answer_counter.increment_async()
+
+    async def embed_question_async(self, question):
+        response = await self.openai_client.embeddings.create(model=ANSWER_CACHE_EMBEDDING_MODEL, input=question)
+        return response.data[0].embedding
+
+    async def lookup_cached_answer_async(self, messages_history):
+        """Same as lookup_cached_answer()."""
+        question = self.answer_cache.question_for(messages_history)
+        if question is None:
+            return None, None, None
+        try:
+            answer, vector = await self.answer_cache.lookup_async(question, self.embed_question_async)
+        except Exception as e:
+            # PRIVACY: only the error type, never the question
+            print(f"Answer cache lookup error (non-fatal): {type(e).__name__}", flush=True)
+            return question, None, None
+        return question, vector, answer
+
+    async def chat_reply_async(self, messages_history, developer_mode = False, route = None):
+        """Same as chat_reply()."""
+        if developer_mode:
+            return self._developer_reply()
+
+        question, vector, reply = None, None, route.reply
+        if not reply and route.cacheable:
+            question, vector, reply = await self.lookup_cached_answer_async(messages_history)
+            if reply:
+                self._cached_reply_hit()
+        if reply:
+            await self.answer_counter.increment_async()
+        else:
+            started = time.perf_counter()
+            try:
+                reply, shared = await self.chat_coalescer.run_async(
+                    coalesce_key(messages_history, route.model),
+                    lambda: self.generate_completion_async(messages_history, model=route.model)
+                )
+            except OpenAIBusy:
+                record_chat_route(route, 'busy')
+                raise
+            self._generated(question, vector, reply, shared, started)
+            if reply and shared:
+                # The answer was counted once by the call we shared
+                await self.answer_counter.increment_async()
+        return self._final_reply(route, reply)
+
+    async def chat_frames_async(self, messages_history, developer_mode = False, route = None):
+        """Same as chat_frames()."""
+        if developer_mode:
+            for frame in reply_frames(self._developer_reply(streaming=True)):
+                yield frame
+            return
+
+        if route.reply:
+            await self.answer_counter.increment_async()
+            for frame in reply_frames(route.reply):
+                yield frame
+            record_chat_route(route)
+            return
+
+        question, vector, cached_reply = None, None, None
+        if route.cacheable:
+            question, vector, cached_reply = await self.lookup_cached_answer_async(messages_history)
+        if cached_reply:
+            self._cached_reply_hit()
+            await self.answer_counter.increment_async()
+            for frame in reply_frames(cached_reply):
+                yield frame
+            record_chat_route(route)
+            return
+
+        started = time.perf_counter()
+        parts = []
+        deltas, shared = self.chat_coalescer.stream_async(
+            coalesce_key(messages_history, route.model),
+            lambda: self.generate_completion_stream_async(messages_history, model=route.model)
+        )
+        try:
+            async for delta in deltas:
+                parts.append(delta)
+                yield format_sse('delta', {'delta': delta})
+        except Exception as e:
+            yield self._stream_error_frame(route, e)
+            return
+        if shared:
+            # The answer was counted once by the stream we shared
+            await self.answer_counter.increment_async()
+        yield self._stream_done_frame(route, question, vector, parts, shared, started)
+
+    async def queue_write_async(self, collection_name, document, key_field = None):
+        """Same as queue_write(); the enqueue runs in a worker thread."""
+        if self.write_queue is None:
+            return None
+        try:
+            return await asyncio.to_thread(self.write_queue.enqueue, collection_name, document, key_field)
+        except WriteQueueFull:
+            print("Write queue full, writing directly", flush=True)
+        except Exception as e:
+            print(f"Write queue error, writing directly: {type(e).__name__}", flush=True)
+        return None
+
+    async def submit_application_async(self, form, remote_addr):
+        """Same as submit_application()."""
+        try:
+            application_data = build_application_document(form, remote_addr)
+
+            queued_id = await self.queue_write_async("SEVY_applications", application_data)
+            if queued_id is not None:
+                return self._stored("Application", queued_id, True)
+
+            collection = self.mongo_client["SEVY_database"]["SEVY_applications"]
+            result = await self.mongo_breaker.call_async(lambda: collection.insert_one(application_data))
+            return self._stored("Application", result.inserted_id, False)
+        except Exception as e:
+            return self._form_failed('submit_application', 'application', e)
+
+    async def subscribe_email_async(self, data, remote_addr):
+        """Same as subscribe_email()."""
+        try:
+            email = data.get('email', '').strip()
+
+            subscription_data = build_subscription_document(email, remote_addr)
+            queued_id = await self.queue_write_async("SEVY_email_list", subscription_data, key_field='emailNormalized')
+            if queued_id is not None:
+                return self._stored("Email subscription", queued_id, True)
+
+            collection = self.mongo_client["SEVY_database"]["SEVY_email_list"]
+            inserted_id = await self.mongo_breaker.call_async(
+                lambda: subscribe_email_address_async(collection, email, remote_addr))
+            if inserted_id is None:
+                return self._duplicate_subscription(email)
+            return self._stored("Email subscription", inserted_id, False)
+        except Exception as e:
+            return self._form_failed('subscribe_email', 'email subscription', e)
+
+    async def load_sevy_numbers_async(self):
+        """Same as load_sevy_numbers(), with the AsyncMongoClient."""
+        collection = self.mongo_client["SEVY_database"]["SEVY_numbers"]
+
+        async def read():
+            cursor = await collection.aggregate(sevy_numbers_pipeline())
+            return parse_sevy_numbers(await cursor.to_list())
+
+        return self._numbers_fetched(await self.mongo_breaker.call_async(read))
+
+    async def get_cached_numbers_async(self):
+        return await self.stats_cache.get_async(NUMBERS_CACHE_KEY, self.load_sevy_numbers_async)
+
+    async def all_numbers_async(self):
+        """Same as all_numbers()."""
+        await self.check_daily_inflation_async()
+        try:
+            return await self.get_cached_numbers_async()
+        except Exception as e:
+            print(f"Error fetching numbers: {e}", flush=True)
+            return dict(NUMBERS_UNAVAILABLE)
+
+    async def single_number_async(self, field):
+        """Same as single_number()."""
+        print(f"Getting {field} value...", flush=True)
+        try:
+            value = (await self.get_cached_numbers_async())[field]
+            print(f"{field} value: {value}", flush=True)
+            return {field: value}
+        except Exception as e:
+            print(f"Error: {e}", flush=True)
+            return {field: 'N/A'}
+
+    async def check_daily_inflation_async(self):
+        """Same as check_daily_inflation()."""
+        today_str = datetime.now(timezone.utc).strftime('%Y-%m-%d')
+        if self._inflation_running or not self._inflation_due(today_str):
+            return
+
+        # Single event loop: the flag is set before the first await, so only
+        # one coroutine runs the check while the others skip it
+        self._inflation_running = True
+        try:
+            collection = self.mongo_client["SEVY_database"]["SEVY_numbers"]
+            self._inflation_checked(today_str, await self.mongo_breaker.call_async(
+                lambda: apply_daily_inflation_async(collection, today_str)))
+        except Exception as e:
+            print(f"Inflation check error (non-fatal): {e}", flush=True)
+        finally:
+            self._inflation_running = False
+
+    async def ping_mongo_async(self):
+        await self.mongo_client.admin.command('ping')
+
+    async def close_async(self):
+        """Flush the answer counter and the write queue, then close the clients that were created."""
+        await asyncio.to_thread(self.answer_counter.close)
+        if self.write_queue is not None:
+            await asyncio.to_thread(self.write_queue.close)
+        close_mongo_client()
+        if self.mongo_client.is_created:
+            await self.mongo_client.close()
+        if self.openai_client.is_created:
+            await self.openai_client.close()
@@ -0,0 +1,457 @@
+import argparse
+import csv
+import hmac
+import io
+import json
+import os
+import sys
+from datetime import datetime, timezone
+from bson import ObjectId
+from helper_startup import load_env_file
+
+# Streaming bulk export of SEVY_applications and SEVY_email_list, as CSV or
+# NDJSON, for the admin export endpoint (GET /export/<name>) and the command
+# line (python helper_export.py --help).
+#
+# Documents are read from a projected cursor sorted by (time field, _id), in
+# batches of EXPORT_BATCH_SIZE (default 500), and written out one batch at a
+# time, so memory use does not grow with the collection. The sort is served
+# by the (submittedAt, _id) and (subscribedAt, _id) indexes created at
+# startup (ensure_export_indexes), which also back the since/until filters.
+#
+# Every row ends with a checkpoint (time field and _id of the row). Passing
+# the last checkpoint received as `after` resumes an interrupted export
+# right after that row.
+#
+# Older documents may hold their time field as a string, or not at all.
+# Those are exported as stored (strings as is, missing as empty) and get
+# checkpoints too; in the sort they come before the dates (BSON order:
+# missing, string, date). since/until only select documents with a date.
+#
+# The endpoint needs `Authorization: Bearer <ADMIN_TOKEN>` and answers 404
+# while ADMIN_TOKEN is not set (.env or environment).
+#
+# PRIVACY: exports contain applicant and subscriber contact details. IP
+# addresses are never exported, and nothing exported is logged.
+
+EXPORT_BATCH_SIZE = max(1, int(os.getenv('EXPORT_BATCH_SIZE', 500)))
+
+EXPORT_FORMATS = {
+    'csv': 'text/csv; charset=utf-8',
+    'ndjson': 'application/x-ndjson; charset=utf-8'
+}
+
+# Exportable collections: time field used for ranges and checkpoints, and the
+# exported fields besides _id and the time field
+EXPORTS = {
+    'applications': {
+        'collection': 'SEVY_applications',
+        'time_field': 'submittedAt',
+        'fields': ('fullName', 'email', 'phoneNumber', 'education', 'division')
+    },
+    'subscribers': {
+        'collection': 'SEVY_email_list',
+        'time_field': 'subscribedAt',
+        'fields': ('email', 'isActive', 'source')
+    }
+}
+
+# Types of the time field that checkpoints support, in BSON sort order
+CHECKPOINT_TYPES = ('null', 'string', 'date')
+
+# Spreadsheet applications run cells starting with these as formulas
+CSV_FORMULA_PREFIXES = ('=', '+', '-', '@', '\t', '\r')
+
+def load_admin_token():
+    """
+    Load the admin token from the .env file or the environment.
+    Returns None when it is not set (admin endpoints disabled).
+    """
+    load_env_file()
+    return os.getenv('ADMIN_TOKEN') or None
+
+def admin_authorized(authorization, admin_token):
+    """
+    DESCRIPTION:
+        Check an Authorization header against the admin token, in constant time.
+
+    INPUT SIGNATURE:
+        authorization: value of the Authorization header (string or None)
+        admin_token: load_admin_token()
+
+    OUTPUT SIGNATURE:
+        True if the header is "Bearer <admin_token>"
+    """
+
+    if not authorization:
+        return False
+    scheme, _, token = authorization.partition(' ')
+    return scheme.lower() == 'bearer' and admin_token_matches(token, admin_token)
+
+def admin_token_matches(token, admin_token):
+    """True if token (e.g. a header value) is the admin token, compared in constant time."""
+    if not admin_token or not token:
+        return False
+    return hmac.compare_digest(token.strip().encode(), admin_token.encode())
+
+def parse_export_time(value):
+    """
+    DESCRIPTION:
+        Parse a since/until bound: an ISO 8601 date or date and time. Times
+        without a UTC offset are UTC, like the stored timestamps.
+
+    OUTPUT SIGNATURE:
+        Naive UTC datetime, or None for an empty value
+
+    RAISES:
+        ValueError for anything else
+    """
+
+    if not value:
+        return None
+    parsed = datetime.fromisoformat(value.strip().replace('Z', '+00:00'))
+    if parsed.tzinfo is not None:
+        parsed = parsed.astimezone(timezone.utc).replace(tzinfo=None)
+    return parsed
+
+def _time_type(value):
+    # CHECKPOINT_TYPES entry of a time field value, or None
+    if value is None:
+        return 'null'
+    if isinstance(value, str):
+        return 'string'
+    if isinstance(value, datetime):
+        return 'date'
+    return None
+
+def format_export_time(value):
+    """
+    DESCRIPTION:
+        Exported text of a time field: ISO 8601 UTC for a date, strings
+        (older documents) as stored, None when missing.
+    """
+
+    if isinstance(value, datetime):
+        if value.tzinfo is not None:
+            value = value.astimezone(timezone.utc).replace(tzinfo=None)
+        return value.isoformat() + 'Z'
+    if value is None or isinstance(value, str):
+        return value
+    return str(value)
+
+def encode_checkpoint(timestamp, document_id):
+    """
+    DESCRIPTION:
+        Checkpoint of a row: "<ISO time>_<_id>" for a date, "s:<text>_<_id>"
+        for a string time field, "null_<_id>" when it is missing.
+
+    OUTPUT SIGNATURE:
+        String, or None for a time field of another type
+    """
+
+    kind = _time_type(timestamp)
+    if kind == 'date':
+        return f"{timestamp.isoformat()}_{document_id}"
+    if kind == 'string':
+        return f"s:{timestamp}_{document_id}"
+    if kind == 'null':
+        return f"null_{document_id}"
+    return None
+
+def decode_checkpoint(checkpoint):
+    """
+    DESCRIPTION:
+        Inverse of encode_checkpoint().
+
+    OUTPUT SIGNATURE:
+        (timestamp, document_id): timestamp is a datetime, a string or
+        None, as stored; document_id is an ObjectId when it looks like one
+
+    RAISES:
+        ValueError if the checkpoint is malformed
+    """
+
+    timestamp, separator, document_id = checkpoint.strip().rpartition('_')
+    if not separator or not document_id:
+        raise ValueError('malformed checkpoint')
+    document_id = ObjectId(document_id) if ObjectId.is_valid(document_id) else document_id
+    if timestamp == 'null':
+        return None, document_id
+    if timestamp.startswith('s:'):
+        return timestamp[2:], document_id
+    return datetime.fromisoformat(timestamp), document_id
+
+def export_spec(name):
+    """
+    DESCRIPTION:
+        EXPORTS entry of an export.
+
+    RAISES:
+        ValueError for an unknown export name
+    """
+
+    if name not in EXPORTS:
+        raise ValueError(f"unknown export (expected one of: {', '.join(EXPORTS)})")
+    return EXPORTS[name]
+
+def export_query(name, since = None, until = None, after = None):
+    """
+    DESCRIPTION:
+        Filter, projection and sort of an export.
+
+    INPUT SIGNATURE:
+        name: key of EXPORTS
+        since: only documents at or after this time (datetime, optional)
+        until: only documents before this time (datetime, optional)
+        after: resume after this checkpoint (string, optional)
+
+    OUTPUT SIGNATURE:
+        (filter, projection, sort) for find()
+
+    RAISES:
+        ValueError for an unknown export or a malformed checkpoint
+    """
+
+    spec = export_spec(name)
+    time_field = spec['time_field']
+
+    time_range = {}
+    if since is not None:
+        time_range['$gte'] = since
+    if until is not None:
+        time_range['$lt'] = until
+    conditions = [{time_field: time_range}] if time_range else []
+    if after:
+        # Strictly after the checkpoint row in (time field, _id) order: the
+        # rows after it with a time field of the same type, then every row
+        # of the types sorted after that one
+        timestamp, document_id = decode_checkpoint(after)
+        kind = _time_type(timestamp)
+        resume = [{time_field: timestamp, '_id': {'$gt': document_id}}]
+        if kind != 'null':
+            resume.insert(0, {time_field: {'$gt': timestamp}})
+        resume += [{time_field: {'$type': later}}
+                   for later in CHECKPOINT_TYPES[CHECKPOINT_TYPES.index(kind) + 1:]]
+        conditions.append({'$or': resume})
+
+    query_filter = conditions[0] if len(conditions) == 1 else ({'$and': conditions} if conditions else {})
+    projection = {field: True for field in (time_field,) + spec['fields']}
+    return query_filter, projection, [(time_field, 1), ('_id', 1)]
+
+def export_cursor(database, name, since = None, until = None, after = None, limit = None, batch_size = None):
+    """
+    DESCRIPTION:
+        Open the batched, projected cursor of an export. Works with the
+        synchronous and the asynchronous client (find() does not wait in
+        either).
+
+    INPUT SIGNATURE:
+        database: the SEVY_database database
+        name, since, until, after: see export_query()
+        limit: most rows exported (optional)
+        batch_size: documents per cursor batch (default: EXPORT_BATCH_SIZE)
+    """
+
+    query_filter, projection, sort = export_query(name, since, until, after)
+    cursor = database[export_spec(name)['collection']].find(query_filter, projection)
+    cursor = cursor.sort(sort).batch_size(batch_size or EXPORT_BATCH_SIZE)
+    if limit is not None and limit > 0:
+        cursor = cursor.limit(limit)
+    return cursor
+
+def export_response_headers(name, export_format):
+    """Download headers of an export response; exports are never cached."""
+    return {
+        'Content-Disposition': f'attachment; filename="sevy_{name}.{export_format}"',
+        'Cache-Control': 'no-store'
+    }
+
+def ensure_export_indexes(database):
+    """
+    DESCRIPTION:
+        Create the (time field, _id) index of every export. Run once at
+        startup; a no-op for indexes that already exist.
+    """
+
+    for spec in EXPORTS.values():
+        time_field = spec['time_field']
+        database[spec['collection']].create_index(
+            [(time_field, 1), ('_id', 1)], name=f'{time_field}_id_export'
+        )
+
+def _csv_cell(value):
+    # Text cells that a spreadsheet would run as a formula are quoted
+    if value is None:
+        return ''
+    if isinstance(value, str) and value.startswith(CSV_FORMULA_PREFIXES):
+        return "'" + value
+    return value
+
+class ExportFormatter:
+    """
+    DESCRIPTION:
+        Turns exported documents into CSV or NDJSON text. Columns: _id, the
+        time field (ISO 8601, UTC), the export's fields, checkpoint.
+
+    INPUT SIGNATURE:
+        name: key of EXPORTS
+        export_format: 'csv' or 'ndjson'
+
+    RAISES:
+        ValueError for an unknown export or format
+    """
+
+    def __init__(self, name, export_format):
+        if export_format not in EXPORT_FORMATS:
+            raise ValueError(f"unknown format (expected one of: {', '.join(EXPORT_FORMATS)})")
+        self.spec = export_spec(name)
+        self.export_format = export_format
+        self.columns = ('_id', self.spec['time_field']) + self.spec['fields'] + ('checkpoint',)
+        self.last_checkpoint = None
+
+    def header(self):
+        if self.export_format != 'csv':
+            return ''
+        return self._csv([self.columns])
+
+    def format(self, documents):
+        """Text of a batch of documents; remembers the checkpoint of the last one."""
+        records = [self._record(document) for document in documents]
+        if records:
+            self.last_checkpoint = records[-1]['checkpoint']
+        if self.export_format == 'csv':
+            return self._csv([[_csv_cell(record[column]) for column in self.columns] for record in records])
+        return ''.join(json.dumps(record, ensure_ascii=False, default=str) + '\n' for record in records)
+
+    def _record(self, document):
+        timestamp = document.get(self.spec['time_field'])
+        record = {
+            '_id': str(document['_id']),
+            self.spec['time_field']: format_export_time(timestamp)
+        }
+        for field in self.spec['fields']:
+            record[field] = document.get(field)
+        record['checkpoint'] = encode_checkpoint(timestamp, document['_id'])
+        return record
+
+    @staticmethod
+    def _csv(rows):
+        buffer = io.StringIO()
+        csv.writer(buffer, lineterminator='\n').writerows(rows)
+        return buffer.getvalue()
+
+# -----------------------
+# SYNC API (Flask, command line)
+
+def stream_export(cursor, formatter, batch_size = None):
+    """
+    DESCRIPTION:
+        Yield the export as text chunks of batch_size rows, header first.
+        Closes the cursor when done or when the consumer stops early.
+
+    INPUT SIGNATURE:
+        cursor: export_cursor() of the synchronous client
+        formatter: ExportFormatter; its last_checkpoint follows the chunks
+        batch_size: rows per chunk (default: EXPORT_BATCH_SIZE)
+    """
+
+    batch_size = batch_size or EXPORT_BATCH_SIZE
+    try:
+        header = formatter.header()
+        if header:
+            yield header
+        batch = []
+        for document in cursor:
+            batch.append(document)
+            if len(batch) >= batch_size:
+                yield formatter.format(batch)
+                batch = []
+        if batch:
+            yield formatter.format(batch)
+    finally:
+        cursor.close()
+
+# -----------------------
+# ASYNC API (Quart)
+
+async def stream_export_async(cursor, formatter, batch_size = None):
+    """
+    DESCRIPTION:
+        Same as stream_export() for an AsyncMongoClient cursor.
+    """
+
+    batch_size = batch_size or EXPORT_BATCH_SIZE
+    try:
+        header = formatter.header()
+        if header:
+            yield header
+        batch = []
+        async for document in cursor:
+            batch.append(document)
+            if len(batch) >= batch_size:
+                yield formatter.format(batch)
+                batch = []
+        if batch:
+            yield formatter.format(batch)
+    finally:
+        await cursor.close()
+
+# -----------------------
+# COMMAND LINE
+
+def write_checkpoint(path, checkpoint):
+    # Written to a temporary file and renamed, so the file is never half written
+    temporary_path = f'{path}.tmp'
+    with open(temporary_path, 'w') as file:
+        file.write(checkpoint + '\n')
+    os.replace(temporary_path, path)
+
+def read_checkpoint(path):
+    if not path or not os.path.isfile(path):
+        return None
+    with open(path) as file:
+        return file.read().strip() or None
+
+def main(argv = None):
+    parser = argparse.ArgumentParser(description='Stream SEVY applications or subscribers as CSV or NDJSON.')
+    parser.add_argument('name', choices=tuple(EXPORTS), help='what to export')
+    parser.add_argument('--format', choices=tuple(EXPORT_FORMATS), default='csv')
+    parser.add_argument('--since', help='only rows at or after this ISO date/time (UTC)')
+    parser.add_argument('--until', help='only rows before this ISO date/time (UTC)')
+    parser.add_argument('--after', help='resume after this checkpoint')
+    parser.add_argument('--limit', type=int, help='most rows exported')
+    parser.add_argument('--output', help='file to write (default: standard output)')
+    parser.add_argument('--checkpoint-file',
+                        help='keep the last exported checkpoint in this file, and resume from it '
+                             '(appending to --output) if it exists')
+    args = parser.parse_args(argv)
+
+    # Imported here so the endpoint helpers above do not need a connection
+    from helper_mongodb import get_mongo_client, close_mongo_client
+
+    after = args.after or read_checkpoint(args.checkpoint_file)
+    formatter = ExportFormatter(args.name, args.format)
+    cursor = export_cursor(get_mongo_client()['SEVY_database'], args.name,
+                           parse_export_time(args.since), parse_export_time(args.until), after, args.limit)
+
+    resuming = after is not None and args.output and os.path.isfile(args.output)
+    output = open(args.output, 'a' if resuming else 'w', newline='') if args.output else sys.stdout
+    try:
+        for index, chunk in enumerate(stream_export(cursor, formatter)):
+            if resuming and index == 0 and chunk == formatter.header():
+                continue  # the file already starts with the header
+            output.write(chunk)
+            output.flush()
+            if args.checkpoint_file and formatter.last_checkpoint:
+                write_checkpoint(args.checkpoint_file, formatter.last_checkpoint)
+    finally:
+        if output is not sys.stdout:
+            output.close()
+        close_mongo_client()
+
+    if formatter.last_checkpoint:
+        print(f"Last checkpoint: {formatter.last_checkpoint}", file=sys.stderr)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,402 @@
+import asyncio
+import collections
+import math
+import os
+import queue
+import threading
+import time
+
+# Deadlines and hedged requests for OpenAI calls, shared by app.py and
+# app_async.py.
+#
+# Deadlines (see Deadline):
+#   OPENAI_ATTEMPT_TIMEOUT_SECONDS (default 30) - timeout of one request
+#       (connect, and each read of a stream)
+#   OPENAI_TOTAL_TIMEOUT_SECONDS (default 60) - time after admission for the
+#       answer, or for the first streamed chunk, retries included. A retry
+#       that could not start before it is not attempted, and the last
+#       attempt only gets the time that is left.
+#
+# Hedging (see Hedger, off unless OPENAI_HEDGING_ENABLED=true):
+#   When a call has not returned its first token after the
+#   OPENAI_HEDGE_PERCENTILE (default 95) of recent time-to-first-token
+#   (at least OPENAI_HEDGE_MIN_DELAY_SECONDS, default 0.5), a second,
+#   identical request is sent and whichever answers first is used. The
+#   other one is cancelled: its stream is closed, or its task cancelled on
+#   the asyncio server. A blocking call on the Flask server cannot be
+#   interrupted; its late answer is dropped, and the hedge's admission slot
+#   is only given back once it has returned.
+#   Hedges in flight are capped at OPENAI_HEDGE_BUDGET_PERCENT (default 5)
+#   percent of the calls in flight (at least one), need a free admission
+#   slot (helper_admission.py) and only start once 20 calls have been timed.
+#   A hedge gives its budget slot back as soon as its request has answered,
+#   failed or been cancelled, so a lasting slow tail keeps being hedged.
+
+OPENAI_HEDGING_ENABLED = os.getenv('OPENAI_HEDGING_ENABLED', 'false').lower() in ('1', 'true', 'yes')
+
+# Calls timed before the first hedge, and recent calls kept per mode
+HEDGE_MIN_SAMPLES = 20
+HEDGE_WINDOW = 500
+
+class Deadline:
+    """
+    DESCRIPTION:
+        Overall and per-attempt time limits of one OpenAI call.
+
+    INPUT SIGNATURE:
+        total: seconds for the whole call (default: OPENAI_TOTAL_TIMEOUT_SECONDS or 60)
+        attempt: seconds per request (default: OPENAI_ATTEMPT_TIMEOUT_SECONDS or 30)
+    """
+
+    def __init__(self, total = None, attempt = None):
+        self.total = float(total if total is not None else os.getenv('OPENAI_TOTAL_TIMEOUT_SECONDS', 60))
+        self.attempt = float(attempt if attempt is not None else os.getenv('OPENAI_ATTEMPT_TIMEOUT_SECONDS', 30))
+        self.expires_at = time.monotonic() + self.total
+
+    def remaining(self):
+        return self.expires_at - time.monotonic()
+
+    def attempt_timeout(self):
+        """
+        DESCRIPTION:
+            Timeout for the next request: the attempt timeout, or the time
+            left if that is shorter.
+
+        RAISES:
+            TimeoutError once the deadline has passed
+        """
+
+        remaining = self.remaining()
+        if remaining <= 0:
+            raise TimeoutError('OpenAI call deadline exceeded')
+        return min(self.attempt, remaining)
+
+def read_first_delta(stream):
+    """
+    DESCRIPTION:
+        Read a chat completion stream up to its first chunk with text, so
+        the time to first token is known when this returns. Closes the
+        stream if reading fails.
+
+    OUTPUT SIGNATURE:
+        (stream, chunks): chunks iterates over every chunk of the stream,
+        starting with the ones already read
+    """
+
+    iterator = iter(stream)
+    head = []
+    try:
+        for chunk in iterator:
+            head.append(chunk)
+            if chunk.choices and chunk.choices[0].delta.content:
+                break
+    except BaseException:
+        stream.close()
+        raise
+
+    def chunks():
+        yield from head
+        yield from iterator
+
+    return stream, chunks()
+
+async def read_first_delta_async(stream):
+    """
+    DESCRIPTION:
+        Same as read_first_delta() for an async stream.
+    """
+
+    iterator = stream.__aiter__()
+    head = []
+    try:
+        async for chunk in iterator:
+            head.append(chunk)
+            if chunk.choices and chunk.choices[0].delta.content:
+                break
+    except BaseException:
+        await stream.close()
+        raise
+
+    async def chunks():
+        for chunk in head:
+            yield chunk
+        async for chunk in iterator:
+            yield chunk
+
+    return stream, chunks()
+
+class Hedger:
+    """
+    DESCRIPTION:
+        Sends a second request when the first one is slower than the recent
+        OPENAI_HEDGE_PERCENTILE of time-to-first-token, within a budget.
+
+    INPUT SIGNATURE:
+        admission: helper_admission.AdmissionController; hedges only start
+                   when it has a free slot
+        enabled: default OPENAI_HEDGING_ENABLED
+        percentile: default OPENAI_HEDGE_PERCENTILE or 95
+        budget_percent: most hedges in flight per 100 calls in flight, at
+                        least one (default: OPENAI_HEDGE_BUDGET_PERCENT or 5)
+        min_delay: shortest hedge delay in seconds (default: OPENAI_HEDGE_MIN_DELAY_SECONDS or 0.5)
+    """
+
+    def __init__(self, admission, enabled = None, percentile = None, budget_percent = None, min_delay = None):
+        self.admission = admission
+        self.enabled = OPENAI_HEDGING_ENABLED if enabled is None else enabled
+        self.percentile = float(percentile if percentile is not None
+                                else os.getenv('OPENAI_HEDGE_PERCENTILE', 95))
+        self.budget_percent = float(budget_percent if budget_percent is not None
+                                    else os.getenv('OPENAI_HEDGE_BUDGET_PERCENT', 5))
+        self.min_delay = float(min_delay if min_delay is not None
+                               else os.getenv('OPENAI_HEDGE_MIN_DELAY_SECONDS', 0.5))
+
+        self._lock = threading.Lock()
+        self._first_token = collections.defaultdict(lambda: collections.deque(maxlen=HEDGE_WINDOW))
+        self._calls_in_flight = 0
+        self._hedges_in_flight = 0
+        self._stats = {
+            'calls': 0,
+            'hedged': 0,
+            'hedge_wins': 0,
+            'budget_denied': 0,
+            'no_capacity': 0
+        }
+
+    def hedge_delay(self, mode):
+        """
+        DESCRIPTION:
+            Seconds after which a call of this mode ('blocking' or 'stream')
+            is hedged, or None while hedging is off or too few calls were timed.
+        """
+
+        if not self.enabled:
+            return None
+        with self._lock:
+            samples = sorted(self._first_token[mode])
+        if len(samples) < HEDGE_MIN_SAMPLES:
+            return None
+        rank = max(1, math.ceil(self.percentile / 100 * len(samples)))
+        return max(self.min_delay, samples[rank - 1])
+
+    def stats(self):
+        """
+        DESCRIPTION:
+            Hedging counters since start, hedges in flight and the current
+            hedge delay per mode.
+        """
+
+        with self._lock:
+            stats = dict(self._stats)
+            stats['hedges_in_flight'] = self._hedges_in_flight
+            modes = list(self._first_token)
+        stats['delay_seconds'] = {mode: self.hedge_delay(mode) for mode in modes}
+        return stats
+
+    def _observe(self, mode, seconds, hedge_won = False):
+        with self._lock:
+            self._first_token[mode].append(seconds)
+            if hedge_won:
+                self._stats['hedge_wins'] += 1
+
+    def _start_hedge(self, tokens):
+        # AdmissionTicket for a hedge, or None if the budget or the slots are
+        # used up. The budget slot taken here is given back by _end_hedge().
+        with self._lock:
+            allowed = max(1, math.floor(self._calls_in_flight * self.budget_percent / 100))
+            if self.budget_percent <= 0 or self._hedges_in_flight >= allowed:
+                self._stats['budget_denied'] += 1
+                return None
+            self._hedges_in_flight += 1
+        ticket = self.admission.try_acquire(tokens)
+        with self._lock:
+            if ticket is None:
+                self._hedges_in_flight -= 1
+                self._stats['no_capacity'] += 1
+            else:
+                self._stats['hedged'] += 1
+        return ticket
+
+    def _end_hedge(self):
+        # The hedge request answered, failed or was cancelled
+        with self._lock:
+            self._hedges_in_flight -= 1
+
+    def _count_call(self):
+        # Calls made while hedging is on, hedged or not
+        if self.enabled:
+            with self._lock:
+                self._stats['calls'] += 1
+
+    def _call_started(self):
+        with self._lock:
+            self._stats['calls'] += 1
+            self._calls_in_flight += 1
+
+    def _call_finished(self):
+        with self._lock:
+            self._calls_in_flight -= 1
+
+    # -----------------------
+    # SYNC API (Flask)
+
+    def run(self, mode, attempt, tokens = 0, discard = None):
+        """
+        DESCRIPTION:
+            Run attempt(), hedged with a second attempt() if the first one
+            is slower than hedge_delay(mode).
+
+        INPUT SIGNATURE:
+            mode: 'blocking' or 'stream'
+            attempt: function making one request; returns once the first
+                     token is there (see read_first_delta)
+            tokens: token estimate of the call, for the hedge's admission
+            discard: called with the result of the losing attempt (optional)
+
+        OUTPUT SIGNATURE:
+            (result, hedged): hedged is True if a second request was sent.
+            Raises the first attempt's error if every attempt failed.
+        """
+
+        delay = self.hedge_delay(mode)
+        if delay is None:
+            self._count_call()
+            started = time.monotonic()
+            result = attempt()
+            self._observe(mode, time.monotonic() - started)
+            return result, False
+
+        self._call_started()
+        try:
+            return self._run_hedged(mode, attempt, tokens, discard, delay)
+        finally:
+            self._call_finished()
+
+    def _run_hedged(self, mode, attempt, tokens, discard, delay):
+        started = time.monotonic()
+        results = queue.Queue()
+        # The loser keeps running after the winner has returned, so the
+        # hedge's admission slot is given back when the last attempt is done
+        running = {'attempts': 1, 'ticket': None}
+
+        def attempt_done():
+            with self._lock:
+                running['attempts'] -= 1
+                ticket = running['ticket'] if running['attempts'] == 0 else None
+            if ticket is not None:
+                self.admission.release(ticket)
+
+        def hedge_done():
+            self._end_hedge()
+            attempt_done()
+
+        self._launch(attempt, 'primary', results, on_done=attempt_done)
+        try:
+            return self._finish(mode, started, results.get(timeout=delay), False)
+        except queue.Empty:
+            pass
+
+        ticket = self._start_hedge(tokens)
+        if ticket is None:
+            return self._finish(mode, started, results.get(), False)
+        with self._lock:
+            running['attempts'] += 1
+            running['ticket'] = ticket
+        self._launch(attempt, 'hedge', results, on_done=hedge_done)
+        first = results.get()
+        if first[2] is None:
+            threading.Thread(target=self._discard_loser, args=(results, discard),
+                             name='openai-hedge-loser', daemon=True).start()
+            return self._finish(mode, started, first, True)
+        # The first one to return failed: wait for the other
+        second = results.get()
+        if second[2] is None:
+            return self._finish(mode, started, second, True)
+        raise (first if first[0] == 'primary' else second)[2]
+
+    def _launch(self, attempt, label, results, on_done = None):
+        def target():
+            try:
+                results.put((label, attempt(), None))
+            except Exception as e:
+                results.put((label, None, e))
+            finally:
+                if on_done is not None:
+                    on_done()
+
+        threading.Thread(target=target, name=f'openai-{label}', daemon=True).start()
+
+    def _finish(self, mode, started, outcome, hedged):
+        label, result, error = outcome
+        if error is not None:
+            raise error
+        self._observe(mode, time.monotonic() - started, label == 'hedge')
+        return result, hedged
+
+    @staticmethod
+    def _discard_loser(results, discard):
+        _, result, error = results.get()
+        if error is None and discard is not None:
+            try:
+                discard(result)
+            except Exception:
+                pass
+
+    # -----------------------
+    # ASYNC API (Quart)
+
+    async def run_async(self, mode, attempt, tokens = 0, discard = None):
+        """
+        DESCRIPTION:
+            Same as run() for the asyncio server. attempt and discard are
+            async functions; the losing attempt is cancelled.
+        """
+
+        delay = self.hedge_delay(mode)
+        if delay is None:
+            self._count_call()
+            started = time.monotonic()
+            result = await attempt()
+            self._observe(mode, time.monotonic() - started)
+            return result, False
+
+        self._call_started()
+        try:
+            return await self._run_hedged_async(mode, attempt, tokens, discard, delay)
+        finally:
+            self._call_finished()
+
+    async def _run_hedged_async(self, mode, attempt, tokens, discard, delay):
+        started = time.monotonic()
+        primary = asyncio.ensure_future(attempt())
+        tasks = [primary]
+        ticket = None
+        winner = None
+        try:
+            done, _ = await asyncio.wait(tasks, timeout=delay)
+            if not done:
+                ticket = self._start_hedge(tokens)
+                if ticket is not None:
+                    hedge = asyncio.ensure_future(attempt())
+                    hedge.add_done_callback(lambda _: self._end_hedge())
+                    tasks.append(hedge)
+
+            pending = set(tasks)
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                winner = next((task for task in tasks if task in done and task.exception() is None), None)
+                if winner is not None:
+                    self._observe(mode, time.monotonic() - started, winner is not primary)
+                    return winner.result(), ticket is not None
+            raise primary.exception()
+        finally:
+            for task in tasks:
+                if task is winner:
+                    continue
+                if not task.done():
+                    task.cancel()
+                elif discard is not None and not task.cancelled() and task.exception() is None:
+                    # Both answered at the same time
+                    await discard(task.result())
+            if ticket is not None:
+                self.admission.release(ticket)
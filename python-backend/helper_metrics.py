@@ -0,0 +1,539 @@
+import bisect
+import threading
+import time
+from pymongo import monitoring
+
+# Minimal Prometheus-style metrics for the SEVY backend, rendered in the
+# text exposition format on GET /metrics.
+#
+# PRIVACY: label values are limited to route templates, HTTP methods and
+# status codes, model names, MongoDB command names and fixed outcome
+# strings. Chat content, emails, IP addresses and any other request data
+# must never be used as a label value.
+#
+# Metrics are per process. With several uvicorn workers, each worker
+# exposes its own values.
+
+DEFAULT_LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+class _Metric:
+    metric_type = None
+
+    def __init__(self, name, documentation, labelnames = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def _key(self, labels):
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"{self.name} expects labels {self.labelnames}, got {tuple(labels)}")
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def _format_labels(self, key, extra = None):
+        pairs = list(zip(self.labelnames, key))
+        if extra:
+            pairs.append(extra)
+        if not pairs:
+            return ''
+        escaped = (f'{name}="{value}"'.replace('\n', ' ') for name, value in pairs)
+        return '{' + ','.join(escaped) + '}'
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.metric_type}"]
+        with self._lock:
+            items = list(self._values.items())
+        for key, value in items:
+            lines.append(f"{self.name}{self._format_labels(key)} {value}")
+        return lines
+
+class Counter(_Metric):
+    metric_type = 'counter'
+
+    def inc(self, amount = 1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+class Gauge(_Metric):
+    metric_type = 'gauge'
+
+    def set(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def inc(self, amount = 1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount = 1, **labels):
+        self.inc(-amount, **labels)
+
+class Histogram(_Metric):
+    metric_type = 'histogram'
+
+    def __init__(self, name, documentation, labelnames = (), buckets = DEFAULT_LATENCY_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = {'counts': [0] * len(self.buckets), 'sum': 0.0, 'count': 0}
+            index = bisect.bisect_left(self.buckets, value)
+            if index < len(self.buckets):
+                state['counts'][index] += 1
+            state['sum'] += value
+            state['count'] += 1
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            items = [(key, dict(state, counts=list(state['counts']))) for key, state in self._values.items()]
+        for key, state in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets, state['counts']):
+                cumulative += count
+                lines.append(f"{self.name}_bucket{self._format_labels(key, ('le', bound))} {cumulative}")
+            lines.append(f"{self.name}_bucket{self._format_labels(key, ('le', '+Inf'))} {state['count']}")
+            lines.append(f"{self.name}_sum{self._format_labels(key)} {state['sum']}")
+            lines.append(f"{self.name}_count{self._format_labels(key)} {state['count']}")
+        return lines
+
+class MetricsRegistry:
+    """
+    DESCRIPTION:
+        Holds the metrics of the process and renders them for /metrics.
+        Collectors are functions called at render time that update gauges
+        from other components (e.g. cache statistics).
+    """
+
+    def __init__(self):
+        self._metrics = []
+        self._collectors = []
+
+    def counter(self, name, documentation, labelnames = ()):
+        return self._register(Counter(name, documentation, labelnames))
+
+    def gauge(self, name, documentation, labelnames = ()):
+        return self._register(Gauge(name, documentation, labelnames))
+
+    def histogram(self, name, documentation, labelnames = (), buckets = DEFAULT_LATENCY_BUCKETS):
+        return self._register(Histogram(name, documentation, labelnames, buckets))
+
+    def add_collector(self, collector):
+        self._collectors.append(collector)
+
+    def render(self):
+        for collector in self._collectors:
+            try:
+                collector()
+            except Exception as e:
+                print(f"Metrics collector error (non-fatal): {e}", flush=True)
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+    def _register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+# Content type of the Prometheus text exposition format
+METRICS_CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+registry = MetricsRegistry()
+
+http_requests_total = registry.counter(
+    'sevy_http_requests_total', 'HTTP requests handled', ('route', 'method', 'status'))
+http_request_duration_seconds = registry.histogram(
+    'sevy_http_request_duration_seconds', 'HTTP request latency, including streamed bodies', ('route', 'method'))
+http_requests_in_flight = registry.gauge(
+    'sevy_http_requests_in_flight', 'HTTP requests currently being handled', ('route',))
+
+openai_request_duration_seconds = registry.histogram(
+    'sevy_openai_request_duration_seconds', 'OpenAI chat completion call duration', ('model', 'mode', 'outcome'))
+openai_tokens_total = registry.counter(
+    'sevy_openai_tokens_total', 'OpenAI tokens used, from response.usage', ('model', 'kind'))
+chat_route_duration_seconds = registry.histogram(
+    'sevy_chat_route_duration_seconds', 'Chat latency by route (category), target and outcome',
+    ('route', 'target', 'outcome'))
+openai_first_token_seconds = registry.histogram(
+    'sevy_openai_first_token_seconds', 'Time from admission to the answer (blocking) or first streamed token',
+    ('mode', 'hedged'))
+openai_hedge_events = registry.gauge(
+    'sevy_openai_hedge_events', 'Hedged request counters since start, by event', ('event',))
+openai_hedges_in_flight = registry.gauge(
+    'sevy_openai_hedges_in_flight', 'Hedged OpenAI requests in flight (counted against the hedge budget)')
+openai_hedge_delay_seconds = registry.gauge(
+    'sevy_openai_hedge_delay_seconds', 'Time to first token after which a call is hedged', ('mode',))
+openai_queue_wait_seconds = registry.histogram(
+    'sevy_openai_queue_wait_seconds', 'Time OpenAI calls waited for admission', ('outcome',),
+    buckets=(0.001, 0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30))
+openai_in_flight = registry.gauge(
+    'sevy_openai_in_flight', 'OpenAI calls currently admitted')
+openai_queue_depth = registry.gauge(
+    'sevy_openai_queue_depth', 'Callers waiting for an OpenAI call slot')
+openai_admission_events = registry.gauge(
+    'sevy_openai_admission_events', 'OpenAI admission counters since start, by event', ('event',))
+
+mongo_command_duration_seconds = registry.histogram(
+    'sevy_mongo_command_duration_seconds', 'MongoDB command duration', ('command', 'outcome'),
+    buckets=(0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10))
+mongo_pool_checkout_wait_seconds = registry.histogram(
+    'sevy_mongo_pool_checkout_wait_seconds', 'Time spent waiting for a pooled MongoDB connection', ('outcome',),
+    buckets=(0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1, 5, 10))
+mongo_pool_connections = registry.gauge(
+    'sevy_mongo_pool_connections', 'Pooled MongoDB connections, by state (open, in_use)', ('state',))
+mongo_pool_connections_created_total = registry.counter(
+    'sevy_mongo_pool_connections_created_total', 'MongoDB connections opened by the pool')
+mongo_pool_connections_closed_total = registry.counter(
+    'sevy_mongo_pool_connections_closed_total', 'MongoDB connections closed by the pool, by reason', ('reason',))
+mongo_pool_checkout_failures_total = registry.counter(
+    'sevy_mongo_pool_checkout_failures_total', 'Failed connection checkouts, by reason', ('reason',))
+mongo_pool_cleared_total = registry.counter(
+    'sevy_mongo_pool_cleared_total', 'Times a MongoDB pool was cleared after a network error')
+mongo_breaker_state = registry.gauge(
+    'sevy_mongo_breaker_state', 'MongoDB circuit breaker state (1 for the current state)', ('state',))
+mongo_breaker_events = registry.gauge(
+    'sevy_mongo_breaker_events', 'MongoDB circuit breaker transitions, rejected calls and outages since start, by event',
+    ('event',))
+
+stats_cache_lookups = registry.gauge(
+    'sevy_stats_cache_lookups', 'Stats cache lookups since start, by result', ('result',))
+stats_cache_hit_ratio = registry.gauge(
+    'sevy_stats_cache_hit_ratio', 'Share of stats lookups served from the cache')
+answer_cache_lookups = registry.gauge(
+    'sevy_answer_cache_lookups', 'Answer cache lookups since start, by result', ('result',))
+answer_cache_saved_seconds = registry.gauge(
+    'sevy_answer_cache_saved_seconds', 'Model latency saved by answer cache hits')
+write_queue_depth = registry.gauge(
+    'sevy_write_queue_depth', 'Form submissions waiting in the write-behind queue')
+write_queue_oldest_age_seconds = registry.gauge(
+    'sevy_write_queue_oldest_age_seconds', 'Age of the oldest queued submission (drain lag)')
+write_queue_events = registry.gauge(
+    'sevy_write_queue_events', 'Write-behind queue counters since start, by event', ('event',))
+upload_bytes = registry.histogram(
+    'sevy_upload_bytes', 'Size of uploaded (discarded) files',
+    buckets=(64 * 1024, 256 * 1024, 1024 * 1024, 2 * 1024 * 1024, 5 * 1024 * 1024, 10 * 1024 * 1024))
+upload_peak_memory_bytes = registry.histogram(
+    'sevy_upload_peak_memory_bytes', 'Peak Python memory while parsing an upload (UPLOAD_TRACE_MEMORY only)',
+    buckets=(64 * 1024, 256 * 1024, 1024 * 1024, 4 * 1024 * 1024, 16 * 1024 * 1024))
+rate_limited_requests = registry.gauge(
+    'sevy_rate_limited_requests', 'Requests refused by the per-client rate limiter since start, by rule', ('rule',))
+rate_limit_tracked_clients = registry.gauge(
+    'sevy_rate_limit_tracked_clients', 'Clients tracked by the in-process rate limiter')
+chat_upstream_calls_saved = registry.gauge(
+    'sevy_chat_upstream_calls_saved', 'OpenAI calls saved by sharing identical in-flight chats since start, by mode',
+    ('mode',))
+chat_coalesce_entries = registry.gauge(
+    'sevy_chat_coalesce_entries', 'Conversations tracked for request coalescing')
+profiled_requests = registry.gauge(
+    'sevy_profiled_requests', 'Requests profiled since start, by reason (sampled or requested)', ('reason',))
+startup_seconds = registry.gauge(
+    'sevy_startup_seconds', 'Seconds from process start to each startup phase', ('phase',))
+startup_ready = registry.gauge(
+    'sevy_ready', '1 once the startup warm-up has run')
+
+def record_openai_call(model, mode, outcome, duration, usage = None):
+    """
+    DESCRIPTION:
+        Record one OpenAI chat completion call.
+
+    INPUT SIGNATURE:
+        model: model name
+        mode: 'blocking' or 'stream'
+        outcome: 'success' or 'error'
+        duration: seconds (float)
+        usage: response.usage of the completion (optional)
+    """
+
+    openai_request_duration_seconds.observe(duration, model=model, mode=mode, outcome=outcome)
+    if usage is None:
+        return
+    details = getattr(usage, 'prompt_tokens_details', None)
+    openai_tokens_total.inc(usage.prompt_tokens or 0, model=model, kind='prompt')
+    openai_tokens_total.inc(usage.completion_tokens or 0, model=model, kind='completion')
+    openai_tokens_total.inc(getattr(details, 'cached_tokens', None) or 0, model=model, kind='cached_prompt')
+
+def record_openai_first_token(mode, seconds, hedged):
+    """
+    DESCRIPTION:
+        Record the time to first token of a call ('blocking' or 'stream'),
+        split by whether it was hedged, to compare tail latencies.
+    """
+
+    openai_first_token_seconds.observe(seconds, mode=mode, hedged='yes' if hedged else 'no')
+
+def record_chat_route(route, outcome = 'success'):
+    """
+    DESCRIPTION:
+        Finish a helper_router.ChatRoute: log and record its latency.
+        outcome: 'success', 'error' or 'busy'
+    """
+
+    chat_route_duration_seconds.observe(route.finish(outcome), route=route.category,
+                                        target=route.target, outcome=outcome)
+
+def record_openai_admission(outcome, waited):
+    """
+    DESCRIPTION:
+        Record how long an OpenAI call waited for admission.
+        outcome: 'admitted' or 'rejected'
+    """
+
+    openai_queue_wait_seconds.observe(waited, outcome=outcome)
+
+def record_upload(size, peak_memory = None):
+    """
+    DESCRIPTION:
+        Record the size of a discarded upload and, if it was measured, the
+        peak memory used while parsing it.
+    """
+
+    if size is not None:
+        upload_bytes.observe(size)
+    if peak_memory is not None:
+        upload_peak_memory_bytes.observe(peak_memory)
+
+def register_cache_collectors(stats_cache, answer_cache):
+    """
+    DESCRIPTION:
+        Export the stats cache and answer cache counters on every scrape.
+    """
+
+    def collect():
+        stats = stats_cache.stats()
+        for result in ('hits', 'stale_hits', 'misses', 'coalesced'):
+            stats_cache_lookups.set(stats[result], result=result)
+        stats_cache_hit_ratio.set(stats['hit_ratio'])
+
+        stats = answer_cache.stats()
+        for result in ('hits', 'semantic_hits', 'misses', 'bypassed'):
+            answer_cache_lookups.set(stats[result], result=result)
+        answer_cache_saved_seconds.set(stats['saved_seconds'])
+
+    registry.add_collector(collect)
+
+def register_write_queue_collectors(write_queue):
+    """
+    DESCRIPTION:
+        Export the write-behind queue depth, drain lag and counters on every scrape.
+    """
+
+    def collect():
+        stats = write_queue.stats()
+        write_queue_depth.set(stats['depth'])
+        write_queue_oldest_age_seconds.set(stats['oldest_age_seconds'])
+        for event in ('enqueued', 'drained', 'failed_batches', 'rejected'):
+            write_queue_events.set(stats[event], event=event)
+
+    registry.add_collector(collect)
+
+def register_admission_collectors(admission):
+    """
+    DESCRIPTION:
+        Export the OpenAI admission controller state and counters on every scrape.
+    """
+
+    def collect():
+        stats = admission.stats()
+        openai_in_flight.set(stats.pop('in_flight'))
+        openai_queue_depth.set(stats.pop('queued'))
+        for event, count in stats.items():
+            openai_admission_events.set(count, event=event)
+
+    registry.add_collector(collect)
+
+def register_hedge_collectors(hedger):
+    """
+    DESCRIPTION:
+        Export the hedged request counters and hedge delays on every scrape.
+    """
+
+    def collect():
+        stats = hedger.stats()
+        openai_hedges_in_flight.set(stats.pop('hedges_in_flight'))
+        for mode, delay in stats.pop('delay_seconds').items():
+            if delay is not None:
+                openai_hedge_delay_seconds.set(delay, mode=mode)
+        for event, count in stats.items():
+            openai_hedge_events.set(count, event=event)
+
+    registry.add_collector(collect)
+
+def register_rate_limit_collectors(rate_limiter):
+    """
+    DESCRIPTION:
+        Export the rate limiter counters on every scrape (rules only, never
+        client addresses).
+    """
+
+    def collect():
+        stats = rate_limiter.stats()
+        for rule in rate_limiter.rules:
+            rate_limited_requests.set(stats['rejected'].get(rule, 0), rule=rule)
+        rate_limit_tracked_clients.set(stats['tracked_clients'])
+
+    registry.add_collector(collect)
+
+def register_coalesce_collectors(coalescer):
+    """
+    DESCRIPTION:
+        Export the OpenAI calls saved by request coalescing on every scrape.
+    """
+
+    def collect():
+        stats = coalescer.stats()
+        for mode in ('blocking', 'stream'):
+            chat_upstream_calls_saved.set(stats[f'saved_{mode}'], mode=mode)
+        chat_coalesce_entries.set(stats['entries'])
+
+    registry.add_collector(collect)
+
+def register_profiler_collectors(profiler):
+    """
+    DESCRIPTION:
+        Export the counters of a helper_profiling.RequestProfiler.
+    """
+
+    def collect():
+        stats = profiler.stats()
+        for reason in ('sampled', 'requested'):
+            profiled_requests.set(stats[reason], reason=reason)
+
+    registry.add_collector(collect)
+
+def register_breaker_collectors(breaker):
+    """
+    DESCRIPTION:
+        Export the state and counters of a helper_mongodb.MongoCircuitBreaker.
+    """
+
+    def collect():
+        stats = breaker.stats()
+        for state in ('closed', 'open', 'half_open'):
+            mongo_breaker_state.set(1 if stats['state'] == state else 0, state=state)
+        for event in ('opened', 'half_opened', 'closed', 'rejected', 'failures'):
+            mongo_breaker_events.set(stats[event], event=event)
+
+    registry.add_collector(collect)
+
+def register_startup_collectors(warm_up):
+    """
+    DESCRIPTION:
+        Export the startup timings and readiness of a helper_startup.WarmUp.
+    """
+
+    def collect():
+        status = warm_up.status()
+        for phase, seconds in status['startup_seconds'].items():
+            startup_seconds.set(seconds, phase=phase)
+        startup_ready.set(1 if status['ready'] else 0)
+
+    registry.add_collector(collect)
+
+class MongoCommandMetrics(monitoring.CommandListener):
+    """
+    DESCRIPTION:
+        pymongo command listener recording the duration of every command.
+        Only the command name is used as a label, never the command body.
+    """
+
+    def started(self, event):
+        pass
+
+    def succeeded(self, event):
+        mongo_command_duration_seconds.observe(
+            event.duration_micros / 1e6, command=event.command_name, outcome='success')
+
+    def failed(self, event):
+        mongo_command_duration_seconds.observe(
+            event.duration_micros / 1e6, command=event.command_name, outcome='error')
+
+class MongoPoolMetrics(monitoring.ConnectionPoolListener):
+    """
+    DESCRIPTION:
+        pymongo connection pool listener recording checkout wait times,
+        connections opened and closed, and connections currently in use.
+        The counts cover every client of the process (pools are per client
+        and per server).
+    """
+
+    def pool_created(self, event):
+        pass
+
+    def pool_ready(self, event):
+        pass
+
+    def pool_cleared(self, event):
+        mongo_pool_cleared_total.inc()
+
+    def pool_closed(self, event):
+        pass
+
+    def connection_created(self, event):
+        mongo_pool_connections_created_total.inc()
+        mongo_pool_connections.inc(state='open')
+
+    def connection_ready(self, event):
+        pass
+
+    def connection_closed(self, event):
+        mongo_pool_connections_closed_total.inc(reason=event.reason)
+        mongo_pool_connections.dec(state='open')
+
+    def connection_check_out_started(self, event):
+        pass
+
+    def connection_check_out_failed(self, event):
+        mongo_pool_checkout_failures_total.inc(reason=event.reason)
+        mongo_pool_checkout_wait_seconds.observe(event.duration, outcome='failed')
+
+    def connection_checked_out(self, event):
+        mongo_pool_checkout_wait_seconds.observe(event.duration, outcome='success')
+        mongo_pool_connections.inc(state='in_use')
+
+    def connection_checked_in(self, event):
+        mongo_pool_connections.dec(state='in_use')
+
+_mongo_listener_registered = False
+
+def register_mongo_command_metrics():
+    """
+    DESCRIPTION:
+        Register MongoCommandMetrics and MongoPoolMetrics globally. Must run
+        before the MongoClient objects are created. Safe to call more than once.
+    """
+
+    global _mongo_listener_registered
+    if not _mongo_listener_registered:
+        monitoring.register(MongoCommandMetrics())
+        monitoring.register(MongoPoolMetrics())
+        _mongo_listener_registered = True
+
+class RequestTimer:
+    """
+    DESCRIPTION:
+        Tracks one HTTP request for the latency histogram and in-flight gauge.
+        Created when the request starts, finished once the response
+        (including any streamed body) is done.
+    """
+
+    def __init__(self, route, method):
+        self.route = route
+        self.method = method
+        self.status = '500'
+        self.started = time.perf_counter()
+        http_requests_in_flight.inc(route=route)
+
+    def finish(self):
+        http_requests_in_flight.dec(route=self.route)
+        http_request_duration_seconds.observe(
+            time.perf_counter() - self.started, route=self.route, method=self.method)
+        http_requests_total.inc(route=self.route, method=self.method, status=self.status)
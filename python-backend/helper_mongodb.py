@@ -1,10 +1,20 @@
 import random
 import string
+import math
+import time
+import pymongo
 from pymongo.mongo_client import MongoClient
+from pymongo import AsyncMongoClient
 from pymongo.server_api import ServerApi
 from pymongo.collation import Collation
-from dotenv import load_dotenv
+from pymongo import UpdateOne, ReturnDocument
+from pymongo.errors import DuplicateKeyError, ConnectionFailure, ExecutionTimeout, WTimeoutError
+from helper_startup import load_env_file
+from helper_profiling import profile_span
 from datetime import datetime
+import asyncio
+import atexit
+import threading
 import os
 import json
 import re
@@ -13,20 +23,66 @@ import re
 #   DO NOT MANUALLY USE THE FOLLOWING FUNCTIONS.
 #   THEY ARE MEANT TO BE CALLED BY OTHER FUNCTIONS.
 #   THAT WOULD APPROPRIATELY CLOSE THE CONNECTION USE.
-#   SEE upload_to_mongo() FOR EXAMPLE.
+#   USE get_mongo_client() FOR THE SHARED, POOLED CLIENT INSTEAD.
+#
+# Connection pooling: every client is created with mongo_pool_options()
+# (tunable through the MONGO_* environment variables below). The helpers in
+# this module and the Flask app share one pooled MongoClient per process,
+# returned by get_mongo_client() and closed by close_mongo_client() (also
+# run at exit). Pool events are exported on /metrics by
+# helper_metrics.MongoPoolMetrics.
+#
+# Circuit breaker: request-path MongoDB calls go through a MongoCircuitBreaker
+# (see below), which gives each call a short deadline and, after repeated
+# timeouts or connection failures, fails fast for a while instead of letting
+# every request wait for MongoDB.
 
 def load_user_password():
     """
     Load the username and password from the .env file
     """
-    if not os.path.isfile('.env'):
-        print("\n\nError: No .env file found in the repository.\n\n")
+    if not load_env_file():
         return None, None, None
 
-    load_dotenv(override=True)
     return os.getenv('username'), os.getenv('password'), os.getenv('server_address')
 
-def connect_to_mongo(username = None, password = None, server_address = None, debug = False):
+def build_mongo_uri(username, password, server_address):
+    """
+    Build the MongoDB connection URI from the credentials
+    """
+    return f"mongodb+srv://{username}:{password}{server_address}"
+
+def mongo_pool_options():
+    """
+    DESCRIPTION:
+        Connection pool settings for MongoClient / AsyncMongoClient, read
+        from the environment when a client is created:
+
+        MONGO_MAX_POOL_SIZE                - connections per server (default 100)
+        MONGO_MIN_POOL_SIZE                - connections kept open (default 0)
+        MONGO_MAX_IDLE_TIME_MS             - idle connections are closed after
+                                             this long (default 300000)
+        MONGO_SERVER_SELECTION_TIMEOUT_MS  - how long an operation waits for a
+                                             reachable server (default 10000)
+        MONGO_WAIT_QUEUE_TIMEOUT_MS        - how long an operation waits for a
+                                             free connection (default: no limit)
+
+    OUTPUT SIGNATURE:
+        dict of MongoClient keyword arguments
+    """
+
+    options = {
+        'maxPoolSize': int(os.getenv('MONGO_MAX_POOL_SIZE', 100)),
+        'minPoolSize': int(os.getenv('MONGO_MIN_POOL_SIZE', 0)),
+        'maxIdleTimeMS': int(os.getenv('MONGO_MAX_IDLE_TIME_MS', 300000)),
+        'serverSelectionTimeoutMS': int(os.getenv('MONGO_SERVER_SELECTION_TIMEOUT_MS', 10000))
+    }
+    wait_queue_timeout = os.getenv('MONGO_WAIT_QUEUE_TIMEOUT_MS')
+    if wait_queue_timeout:
+        options['waitQueueTimeoutMS'] = int(wait_queue_timeout)
+    return options
+
+def connect_to_mongo(username = None, password = None, server_address = None, debug = False, ping = True):
     """
     DESCRIPTION:
         Return the MongoClient object
@@ -37,6 +93,8 @@ def connect_to_mongo(username = None, password = None, server_address = None, de
         username: MongoDB username (string)
         password: MongoDB password (string)
         server_address: MongoDB server address (string)
+        ping: send a blocking ping to check the connection (default True).
+              Lazily created clients skip it and ping from the warm-up.
 
     OUTPUT SIGNATURE:
         client: MongoClient object
@@ -56,8 +114,11 @@ def connect_to_mongo(username = None, password = None, server_address = None, de
         username, password, server_address = load_user_password()
 
     # Construct MongoDB connection URI
-    uri = f"mongodb+srv://{username}:{password}{server_address}"
-    client = MongoClient(uri, server_api=ServerApi('1'))
+    uri = build_mongo_uri(username, password, server_address)
+    client = MongoClient(uri, server_api=ServerApi('1'), **mongo_pool_options())
+
+    if not ping:
+        return client
 
     # Send a ping to confirm a successful connection
     try:
@@ -69,6 +130,66 @@ def connect_to_mongo(username = None, password = None, server_address = None, de
 
     return client
 
+def connect_to_mongo_async(username = None, password = None, server_address = None):
+    """
+    DESCRIPTION:
+        Return an AsyncMongoClient object for the asyncio server (app_async.py).
+        Credentials are resolved the same way as in connect_to_mongo().
+
+    OUTPUT SIGNATURE:
+        client: AsyncMongoClient object
+
+    CAUTION:
+        Unlike connect_to_mongo(), no ping is sent here because it has to
+        be awaited. The caller is expected to ping on startup.
+    """
+
+    if not username or not password or not server_address:
+        username, password, server_address = load_user_password()
+
+    uri = build_mongo_uri(username, password, server_address)
+    return AsyncMongoClient(uri, server_api=ServerApi('1'), **mongo_pool_options())
+
+_shared_client = None
+_shared_client_lock = threading.Lock()
+
+def get_mongo_client():
+    """
+    DESCRIPTION:
+        Return the process-wide pooled MongoClient, created on first use
+        (without the blocking ping of connect_to_mongo()).
+        Callers share it and must not close it; see close_mongo_client().
+
+    OUTPUT SIGNATURE:
+        client: MongoClient object
+    """
+
+    global _shared_client
+    client = _shared_client
+    if client is None:
+        with _shared_client_lock:
+            if _shared_client is None:
+                _shared_client = connect_to_mongo(ping=False)
+            client = _shared_client
+    return client
+
+def close_mongo_client():
+    """
+    DESCRIPTION:
+        Close the shared client and its connection pool. A later
+        get_mongo_client() call creates a new one. Safe to call more than once.
+    """
+
+    global _shared_client
+    with _shared_client_lock:
+        client, _shared_client = _shared_client, None
+    if client is not None:
+        client.close()
+
+# Registered first, so it runs after the atexit flushes of the answer
+# counter and the write queue, which still need the client
+atexit.register(close_mongo_client)
+
 def list_mongo_databases():
     """
     DESCRIPTION:
@@ -79,7 +200,7 @@ def list_mongo_databases():
         The function will also print out the list of database names.
     """
 
-    client = connect_to_mongo()
+    client = get_mongo_client()
 
     try:
         database_names = client.list_database_names()
@@ -88,8 +209,6 @@ def list_mongo_databases():
     except Exception as e:
         print(f"Error listing databases: {e}")
         return []
-    finally:
-        client.close()
 
 def list_mongo_collections(database_name):
     """
@@ -104,8 +223,7 @@ def list_mongo_collections(database_name):
         The function will also print out the list of collection names.
     """
 
-    client = connect_to_mongo()
-    db = client[database_name]
+    db = get_mongo_client()[database_name]
 
     try:
         collection_names = db.list_collection_names()
@@ -114,24 +232,817 @@ def list_mongo_collections(database_name):
     except Exception as e:
         print(f"Error listing collections in database '{database_name}': {e}")
         return []
-    finally:
-        client.close()
 
-def update_sevy_ai_number_of_questions_answered():
-    client = connect_to_mongo()
-    db = client['SEVY_database']
-    collection = db['SEVY_numbers']
+# Sharded answer counters:
+#   The legacy SEVY_numbers documents holding sevy_ai_answers and
+#   sevy_ai_real_answers keep their value and act as the base of each
+#   counter. Increments go to one of COUNTER_SHARDS (default 8) shard
+#   documents, picked at random, so concurrent writers rarely touch the same
+#   document:
+#       {"counter_shard": k, "sevy_ai_answers_delta": n, "sevy_ai_real_answers_delta": m}
+#   A counter is its base plus the sum of its shard deltas, read with one
+#   aggregation (sevy_numbers_pipeline) and cached by the stats cache. The
+#   daily inflation adds its own sevy_ai_answers_delta to the document
+#   holding sevy_ai_last_inflation_date, in the same update as its claim.
+#   Migration: ensure_counter_shards() creates the shard documents (run at
+#   startup, idempotent); nothing is moved, so the numbers stay the same.
+#   Before rolling back to a version without shards, fold_counter_shards()
+#   adds the deltas back into the base documents.
+COUNTER_SHARDS = max(1, int(os.getenv('COUNTER_SHARDS', 8)))
+# Unique (sparse: the base documents have no shard number) index on the shard number
+COUNTER_SHARD_INDEX_NAME = 'counter_shard_unique'
 
-    # Increment the displayed (inflated) count
-    collection.update_one(
-        {"sevy_ai_answers": {"$exists": True}},
-        {"$inc": {"sevy_ai_answers": 1}}
-    )
+def sevy_numbers_pipeline():
+    """
+    DESCRIPTION:
+        Aggregation reading every public SEVY number from SEVY_numbers in
+        one round trip, including the sum of the answer counter shards.
+        Its single result document is read by parse_sevy_numbers().
+    """
+
+    return [{
+        "$group": {
+            "_id": None,
+            "sevy_educators_number": {"$max": "$sevy_educators_number"},
+            "students_taught": {"$max": "$students_taught"},
+            "sevy_ai_answers": {"$max": "$sevy_ai_answers"},
+            "sevy_ai_answers_shards": {"$sum": "$sevy_ai_answers_delta"}
+        }
+    }]
+
+def parse_sevy_numbers(all_docs):
+    """
+    DESCRIPTION:
+        Extract the public SEVY numbers from the SEVY_numbers documents or
+        from the result of sevy_numbers_pipeline(). Shared by the Flask and
+        asyncio servers.
+
+    INPUT SIGNATURE:
+        all_docs: iterable of documents from the SEVY_numbers collection
+
+    OUTPUT SIGNATURE:
+        Dictionary with sevy_educators_number, sevy_ai_answers (base plus
+        shards) and students_taught. Missing values are reported as 'N/A'.
+    """
+
+    # Initialize default values
+    result = {
+        'sevy_educators_number': 'N/A',
+        'sevy_ai_answers': 'N/A',
+        'students_taught': 'N/A'
+    }
+    answer_shards = 0
+
+    # Parse documents to extract values
+    for doc in all_docs:
+        if doc.get('sevy_educators_number') is not None:
+            result['sevy_educators_number'] = doc['sevy_educators_number']
+        if doc.get('sevy_ai_answers') is not None:
+            result['sevy_ai_answers'] = doc['sevy_ai_answers']
+        if doc.get('students_taught') is not None:
+            result['students_taught'] = doc['students_taught']
+        answer_shards += doc.get('sevy_ai_answers_shards') or doc.get('sevy_ai_answers_delta') or 0
+
+    if result['sevy_ai_answers'] != 'N/A':
+        result['sevy_ai_answers'] += answer_shards
+    return result
+
+def build_application_document(form, ip_address):
+    """
+    DESCRIPTION:
+        Build the SEVY_applications document from the submitted form fields.
+        The resume file is never part of the document.
+
+    INPUT SIGNATURE:
+        form: mapping of form field names to values (request.form)
+        ip_address: client IP address (string)
+
+    OUTPUT SIGNATURE:
+        Dictionary ready to be inserted into SEVY_applications
+    """
+
+    # Extract text fields from form data (NO validation)
+    return {
+        'fullName': form.get('fullName', '').strip(),
+        'email': form.get('email', '').strip(),
+        'phoneNumber': form.get('phoneNumber', '').strip(),
+        'education': form.get('education', '').strip(),
+        'division': form.get('division', '').strip(),
+        'submittedAt': datetime.utcnow(),
+        'ipAddress': ip_address
+    }
+
+def build_subscription_document(email, ip_address):
+    """
+    DESCRIPTION:
+        Build the SEVY_email_list document for a newsletter subscription.
+
+    INPUT SIGNATURE:
+        email: subscriber email address (string)
+        ip_address: client IP address (string)
+
+    OUTPUT SIGNATURE:
+        Dictionary ready to be inserted into SEVY_email_list
+    """
+
+    return {
+        'email': email,
+        'emailNormalized': normalize_email(email),
+        'subscribedAt': datetime.utcnow(),
+        'isActive': True,
+        'source': 'donate_page',
+        'ipAddress': ip_address
+    }
+
+# Unique index that makes SEVY_email_list subscriptions race-free
+EMAIL_LIST_INDEX_NAME = 'emailNormalized_unique'
+EMAIL_LIST_BATCH_SIZE = 500
+
+def normalize_email(email):
+    """
+    DESCRIPTION:
+        Normalized form of an email address used for duplicate detection:
+        surrounding whitespace removed, case folded.
+    """
+
+    return email.strip().casefold()
+
+def subscription_upsert_operations(email, ip_address):
+    """
+    DESCRIPTION:
+        Build the single upsert that stores a subscription unless the
+        normalized email is already subscribed.
+
+    OUTPUT SIGNATURE:
+        (filter, update) for update_one(..., upsert=True). The result's
+        upserted_id is None when the email was already subscribed.
+    """
+
+    document = build_subscription_document(email, ip_address)
+    return {'emailNormalized': document['emailNormalized']}, {'$setOnInsert': document}
+
+def subscribe_email_address(collection, email, ip_address):
+    """
+    DESCRIPTION:
+        Store a newsletter subscription in one round trip.
+
+    INPUT SIGNATURE:
+        collection: the SEVY_email_list collection
+        email: subscriber email address (string)
+        ip_address: client IP address (string)
+
+    OUTPUT SIGNATURE:
+        The inserted document id, or None if the email was already subscribed
+    """
+
+    subscription_filter, subscription_update = subscription_upsert_operations(email, ip_address)
+    try:
+        result = collection.update_one(subscription_filter, subscription_update, upsert=True)
+    except DuplicateKeyError:
+        # Concurrent signup of the same email, caught by the unique index
+        return None
+    return result.upserted_id
+
+async def subscribe_email_address_async(collection, email, ip_address):
+    """
+    DESCRIPTION:
+        Same as subscribe_email_address() for an AsyncMongoClient collection.
+    """
+
+    subscription_filter, subscription_update = subscription_upsert_operations(email, ip_address)
+    try:
+        result = await collection.update_one(subscription_filter, subscription_update, upsert=True)
+    except DuplicateKeyError:
+        return None
+    return result.upserted_id
+
+def ensure_email_list_index(collection, batch_size = EMAIL_LIST_BATCH_SIZE):
+    """
+    DESCRIPTION:
+        Make sure SEVY_email_list has the unique emailNormalized index.
+        Run once at startup; when the index already exists this is a
+        single listIndexes call.
+
+        Otherwise, in batches of batch_size:
+        1. emailNormalized is filled in on documents that lack it
+        2. duplicates are removed, keeping the earliest subscription
+           of each normalized email
+        and the unique index is then created.
+
+    INPUT SIGNATURE:
+        collection: the SEVY_email_list collection (synchronous client)
+
+    OUTPUT SIGNATURE:
+        Number of duplicate documents removed
+    """
+
+    if EMAIL_LIST_INDEX_NAME in collection.index_information():
+        return 0
+
+    # 1. Backfill the normalized email
+    operations = []
+    for doc in collection.find({'emailNormalized': {'$exists': False}}, {'email': True}).batch_size(batch_size):
+        operations.append(UpdateOne(
+            {'_id': doc['_id']},
+            {'$set': {'emailNormalized': normalize_email(str(doc.get('email') or ''))}}
+        ))
+        if len(operations) >= batch_size:
+            collection.bulk_write(operations, ordered=False)
+            operations = []
+    if operations:
+        collection.bulk_write(operations, ordered=False)
+
+    # 2. Remove duplicates, keeping the earliest subscription
+    duplicate_groups = collection.aggregate([
+        {'$sort': {'subscribedAt': 1, '_id': 1}},
+        {'$group': {'_id': '$emailNormalized', 'ids': {'$push': '$_id'}, 'count': {'$sum': 1}}},
+        {'$match': {'count': {'$gt': 1}}}
+    ], allowDiskUse=True)
+    removed = 0
+    pending_ids = []
+    for group in duplicate_groups:
+        pending_ids.extend(group['ids'][1:])
+        while len(pending_ids) >= batch_size:
+            removed += collection.delete_many({'_id': {'$in': pending_ids[:batch_size]}}).deleted_count
+            pending_ids = pending_ids[batch_size:]
+    if pending_ids:
+        removed += collection.delete_many({'_id': {'$in': pending_ids}}).deleted_count
 
-    # Increment the real count
+    # 3. Enforce uniqueness from now on
+    collection.create_index('emailNormalized', unique=True, name=EMAIL_LIST_INDEX_NAME)
+    return removed
+
+def daily_inflation_operations(today_str, current):
+    """
+    DESCRIPTION:
+        Build the update that claims the daily sevy_ai_answers inflation and
+        applies it, and pick its rate. Shared by the sync and async variants
+        of apply_daily_inflation.
+
+    INPUT SIGNATURE:
+        today_str: current UTC day ('YYYY-MM-DD')
+        current: displayed sevy_ai_answers (base plus shards)
+
+    OUTPUT SIGNATURE:
+        (claim_filter, claim_update, inflation_rate)
+        The update marks today's inflation as done and adds
+        int(current * (1 + inflation_rate)) - current to the
+        sevy_ai_answers_delta of the same document, atomically: only one
+        caller per UTC day matches it, and a crash can never record the
+        claim without the increment. Answers counted meanwhile are kept.
+    """
+
+    # Random 1-5% inflation
+    inflation_rate = random.uniform(0.01, 0.05)
+    amount = int(current * (1 + inflation_rate)) - current
+
+    claim_filter = {"sevy_ai_last_inflation_date": {"$exists": True, "$ne": today_str}}
+    claim_update = {
+        "$set": {"sevy_ai_last_inflation_date": today_str},
+        "$inc": {"sevy_ai_answers_delta": amount}
+    }
+
+    return claim_filter, claim_update, inflation_rate
+
+def apply_daily_inflation(collection, today_str):
+    """
+    DESCRIPTION:
+        Apply the daily random 1-5% inflation to sevy_ai_answers if no
+        instance has applied it yet for today: one read of the current
+        value, then one conditional update that both claims the day and
+        adds the inflation (see daily_inflation_operations). Idempotent:
+        once today's claim has been taken, the update matches nothing.
+
+    INPUT SIGNATURE:
+        collection: the SEVY_numbers collection
+        today_str: current UTC day ('YYYY-MM-DD')
+
+    OUTPUT SIGNATURE:
+        (previous_value, inflation_rate) if this call applied the
+        inflation, otherwise None
+    """
+
+    previous = parse_sevy_numbers(collection.aggregate(sevy_numbers_pipeline()))['sevy_ai_answers']
+    if previous == 'N/A':
+        return None
+    claim_filter, claim_update, inflation_rate = daily_inflation_operations(today_str, int(previous))
+
+    # Atomically claim and apply today's inflation — only one caller wins per UTC day
+    if collection.update_one(claim_filter, claim_update).modified_count == 0:
+        return None
+    return int(previous), inflation_rate
+
+async def apply_daily_inflation_async(collection, today_str):
+    """
+    DESCRIPTION:
+        Same as apply_daily_inflation() for an AsyncMongoClient collection.
+    """
+
+    cursor = await collection.aggregate(sevy_numbers_pipeline())
+    previous = parse_sevy_numbers(await cursor.to_list())['sevy_ai_answers']
+    if previous == 'N/A':
+        return None
+    claim_filter, claim_update, inflation_rate = daily_inflation_operations(today_str, int(previous))
+
+    if (await collection.update_one(claim_filter, claim_update)).modified_count == 0:
+        return None
+    return int(previous), inflation_rate
+
+def update_sevy_ai_number_of_questions_answered(amount = 1, client = None, shards = None):
+    """
+    DESCRIPTION:
+        Increment both the displayed (inflated) and the real SEVY AI answer
+        counters with a single update of one random counter shard.
+
+    INPUT SIGNATURE:
+        amount: number of answers to add to both counters (int)
+        client: MongoClient to use (optional, default: get_mongo_client())
+        shards: number of shards (default: COUNTER_SHARDS)
+    """
+
+    if client is None:
+        client = get_mongo_client()
+
+    collection = client['SEVY_database']['SEVY_numbers']
+    # upsert: a missing shard is created on its first increment
     collection.update_one(
-        {"sevy_ai_real_answers": {"$exists": True}},
-        {"$inc": {"sevy_ai_real_answers": 1}}
+        {"counter_shard": random.randrange(shards or COUNTER_SHARDS)},
+        {"$inc": {"sevy_ai_answers_delta": amount, "sevy_ai_real_answers_delta": amount}},
+        upsert=True
     )
 
-    client.close()
\ No newline at end of file
+def ensure_counter_shards(collection, shards = None):
+    """
+    DESCRIPTION:
+        Create the answer counter shard documents that do not exist yet
+        (migration from the single-document layout). Idempotent and safe to
+        run from several instances at once: a unique index on the shard
+        number makes concurrent upserts of one shard create a single
+        document. Duplicate shards left by earlier versions are merged
+        before the index is built; existing counts are untouched.
+
+    INPUT SIGNATURE:
+        collection: the SEVY_numbers collection
+        shards: number of shards (default: COUNTER_SHARDS)
+
+    OUTPUT SIGNATURE:
+        Number of shard documents created (int)
+    """
+
+    if COUNTER_SHARD_INDEX_NAME not in collection.index_information():
+        _merge_duplicate_counter_shards(collection)
+        collection.create_index('counter_shard', unique=True, sparse=True, name=COUNTER_SHARD_INDEX_NAME)
+
+    result = collection.bulk_write([
+        UpdateOne(
+            {"counter_shard": shard},
+            {"$setOnInsert": {"sevy_ai_answers_delta": 0, "sevy_ai_real_answers_delta": 0}},
+            upsert=True
+        )
+        for shard in range(shards or COUNTER_SHARDS)
+    ], ordered=False)
+    return result.upserted_count
+
+def _merge_duplicate_counter_shards(collection):
+    # Keep one document per shard number, adding the deltas of the others to it
+    duplicates = collection.aggregate([
+        {'$match': {'counter_shard': {'$exists': True}}},
+        {'$group': {'_id': '$counter_shard', 'ids': {'$push': '$_id'}, 'count': {'$sum': 1}}},
+        {'$match': {'count': {'$gt': 1}}}
+    ])
+    for group in duplicates:
+        kept, *extra = group['ids']
+        for duplicate_id in extra:
+            removed = collection.find_one_and_delete({'_id': duplicate_id})
+            if removed is None:
+                continue
+            collection.update_one({'_id': kept}, {'$inc': {
+                'sevy_ai_answers_delta': int(removed.get('sevy_ai_answers_delta') or 0),
+                'sevy_ai_real_answers_delta': int(removed.get('sevy_ai_real_answers_delta') or 0)
+            }})
+
+def fold_counter_shards(collection):
+    """
+    DESCRIPTION:
+        Move the shard deltas (and the inflation delta kept with
+        sevy_ai_last_inflation_date) back into the base documents, e.g.
+        before rolling back to a version that does not read the shards.
+        Each delta is emptied atomically before it is added, so the counters
+        stay correct while answers are being counted.
+
+    INPUT SIGNATURE:
+        collection: the SEVY_numbers collection
+
+    OUTPUT SIGNATURE:
+        (answers, real_answers) moved into the base documents
+    """
+
+    moved = [0, 0]
+    for shard in collection.find({"sevy_ai_answers_delta": {"$exists": True}}, {"_id": True}):
+        previous = collection.find_one_and_update(
+            {"_id": shard["_id"]},
+            {"$set": {"sevy_ai_answers_delta": 0, "sevy_ai_real_answers_delta": 0}},
+            return_document=ReturnDocument.BEFORE
+        )
+        answers = int(previous.get("sevy_ai_answers_delta") or 0)
+        real_answers = int(previous.get("sevy_ai_real_answers_delta") or 0)
+        collection.bulk_write([
+            UpdateOne({"sevy_ai_answers": {"$exists": True}}, {"$inc": {"sevy_ai_answers": answers}}),
+            UpdateOne({"sevy_ai_real_answers": {"$exists": True}}, {"$inc": {"sevy_ai_real_answers": real_answers}})
+        ], ordered=False)
+        moved[0] += answers
+        moved[1] += real_answers
+    return tuple(moved)
+
+class MongoUnavailable(Exception):
+    """
+    MongoDB is unreachable or too slow: the circuit breaker is open, or the
+    call failed with a timeout or connection error. retry_after is the
+    number of seconds after which a new attempt makes sense.
+    """
+
+    def __init__(self, message, retry_after = 1):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+def is_mongo_outage(error):
+    """
+    DESCRIPTION:
+        True for errors that say MongoDB is unreachable or slow (timeouts,
+        connection and server selection failures), as opposed to errors
+        returned by a working server (e.g. a duplicate key).
+    """
+
+    return isinstance(error, (ConnectionFailure, ExecutionTimeout, WTimeoutError)) or \
+        bool(getattr(error, 'timeout', False))
+
+class MongoCircuitBreaker:
+    """
+    DESCRIPTION:
+        Circuit breaker for request-path MongoDB calls.
+
+        closed    - calls run with a deadline of operation_timeout seconds
+                    (pymongo.timeout). failure_threshold outages in a row
+                    open the breaker.
+        open      - calls fail at once with MongoUnavailable for
+                    reset_timeout seconds.
+        half_open - one trial call is let through; it closes the breaker if
+                    it succeeds and opens it again if it fails.
+
+    INPUT SIGNATURE:
+        failure_threshold: outages in a row that open the breaker
+                           (default: MONGO_BREAKER_FAILURES or 5)
+        reset_timeout: seconds the breaker stays open
+                       (default: MONGO_BREAKER_RESET_SECONDS or 15)
+        operation_timeout: deadline of each call in seconds
+                           (default: MONGO_OPERATION_TIMEOUT_MS / 1000 or 2)
+        enabled: default MONGO_BREAKER_ENABLED (true); when false, calls
+                 only get the deadline
+    """
+
+    def __init__(self, failure_threshold = None, reset_timeout = None, operation_timeout = None, enabled = None):
+        self.failure_threshold = max(1, int(failure_threshold if failure_threshold is not None
+                                            else os.getenv('MONGO_BREAKER_FAILURES', 5)))
+        self.reset_timeout = float(reset_timeout if reset_timeout is not None
+                                   else os.getenv('MONGO_BREAKER_RESET_SECONDS', 15))
+        self.operation_timeout = float(operation_timeout if operation_timeout is not None
+                                       else float(os.getenv('MONGO_OPERATION_TIMEOUT_MS', 2000)) / 1000)
+        self.enabled = (os.getenv('MONGO_BREAKER_ENABLED', 'true').lower() in ('1', 'true', 'yes')
+                        if enabled is None else enabled)
+
+        self._lock = threading.Lock()
+        self._state = 'closed'
+        self._consecutive_failures = 0
+        self._opened_at = 0.0
+        self._trial_running = False
+        self._stats = {
+            'opened': 0,
+            'half_opened': 0,
+            'closed': 0,
+            'rejected': 0,
+            'failures': 0
+        }
+
+    @property
+    def state(self):
+        with self._lock:
+            return self._state
+
+    def is_open(self):
+        """
+        DESCRIPTION:
+            True while calls would be rejected without trying MongoDB. Does
+            not start a trial call.
+        """
+
+        with self._lock:
+            return self._state == 'open' and time.monotonic() < self._opened_at + self.reset_timeout
+
+    def retry_after(self):
+        """Whole seconds until the breaker lets a trial call through (at least 1)."""
+        with self._lock:
+            if self._state != 'open':
+                return 1
+            return max(1, math.ceil(self._opened_at + self.reset_timeout - time.monotonic()))
+
+    def stats(self):
+        """
+        DESCRIPTION:
+            Current state, state changes since start (opened, half_opened,
+            closed), calls rejected while open and outages counted.
+        """
+
+        with self._lock:
+            stats = dict(self._stats)
+            stats['state'] = self._state
+        return stats
+
+    def _before_call(self):
+        # Raises MongoUnavailable if the call may not run
+        if not self.enabled:
+            return
+        with self._lock:
+            if self._state == 'open':
+                remaining = self._opened_at + self.reset_timeout - time.monotonic()
+                if remaining > 0:
+                    self._stats['rejected'] += 1
+                    raise MongoUnavailable('MongoDB circuit breaker is open', max(1, math.ceil(remaining)))
+                self._set_state('half_open')
+            elif self._state == 'half_open' and self._trial_running:
+                self._stats['rejected'] += 1
+                raise MongoUnavailable('MongoDB circuit breaker is testing the connection', 1)
+            if self._state == 'half_open':
+                self._trial_running = True
+
+    def _after_call(self, error = None, cancelled = False):
+        if not self.enabled:
+            return
+        with self._lock:
+            trial = self._state == 'half_open' and self._trial_running
+            if trial:
+                self._trial_running = False
+            if cancelled:
+                return
+            if error is not None and is_mongo_outage(error):
+                self._stats['failures'] += 1
+                self._consecutive_failures += 1
+                if trial or (self._state == 'closed' and self._consecutive_failures >= self.failure_threshold):
+                    self._opened_at = time.monotonic()
+                    self._set_state('open')
+                return
+            # The server answered (errors like a duplicate key included)
+            self._consecutive_failures = 0
+            if self._state == 'half_open':
+                self._set_state('closed')
+
+    def _set_state(self, state):
+        # Called with _lock held
+        previous, self._state = self._state, state
+        self._stats[{'open': 'opened', 'half_open': 'half_opened', 'closed': 'closed'}[state]] += 1
+        print(f"MongoDB circuit breaker: {previous} -> {state}", flush=True)
+
+    def _unavailable(self, error):
+        return MongoUnavailable(f'MongoDB unavailable: {type(error).__name__}', self.retry_after())
+
+    # -----------------------
+    # SYNC API (Flask)
+
+    def call(self, function):
+        """
+        DESCRIPTION:
+            Run function() (MongoDB operations) through the breaker, with a
+            deadline of operation_timeout seconds.
+
+        OUTPUT SIGNATURE:
+            function's result
+
+        RAISES:
+            MongoUnavailable when the breaker is open or the call failed
+            with a timeout or connection error; function's other exceptions
+            unchanged
+        """
+
+        self._before_call()
+        try:
+            with pymongo.timeout(self.operation_timeout):
+                result = function()
+        except Exception as e:
+            self._after_call(e)
+            if is_mongo_outage(e):
+                raise self._unavailable(e) from e
+            raise
+        except BaseException:
+            self._after_call(cancelled = True)
+            raise
+        self._after_call()
+        return result
+
+    # -----------------------
+    # ASYNC API (Quart)
+
+    async def call_async(self, function):
+        """
+        DESCRIPTION:
+            Same as call() for an async function (AsyncMongoClient operations).
+            A cancelled call does not count either way.
+        """
+
+        self._before_call()
+        try:
+            with pymongo.timeout(self.operation_timeout):
+                result = await function()
+        except Exception as e:
+            self._after_call(e)
+            if is_mongo_outage(e):
+                raise self._unavailable(e) from e
+            raise
+        except BaseException:
+            self._after_call(cancelled = True)
+            raise
+        self._after_call()
+        return result
+
+class AnswerCounterAggregator:
+    """
+    DESCRIPTION:
+        In-process aggregator for the SEVY AI answer counters.
+        Increments are summed in memory and written by a background thread
+        as one update of a counter shard (see
+        update_sevy_ai_number_of_questions_answered), either every
+        flush_interval seconds or as soon as flush_threshold increments are
+        pending, whichever comes first. Pending increments are also flushed
+        when the process shuts down.
+
+    INPUT SIGNATURE:
+        client: shared MongoClient used for every flush
+        flush_interval: seconds between background flushes
+                        (default: COUNTER_FLUSH_INTERVAL_SECONDS or 5)
+        flush_threshold: pending increments that wake the background flush
+                         (default: COUNTER_FLUSH_THRESHOLD or 20)
+        max_unflushed: most increments kept in memory while flushes fail
+                       (e.g. MongoDB is down). Further increments are
+                       dropped and counted in `dropped` until a flush
+                       succeeds (default: COUNTER_MAX_UNFLUSHED or 10000)
+        breaker: MongoCircuitBreaker for the flushes (optional). While it is
+                 open, flushes return at once and the increments stay pending.
+        max_crash_loss: most increments a crash can lose while MongoDB is
+                        reachable (default: COUNTER_MAX_CRASH_LOSS or 100).
+                        Once that many are pending, increment() waits for
+                        the background flush before returning.
+
+    CAUTION:
+        increment() never writes to MongoDB itself. It only waits when
+        max_crash_loss increments are pending, i.e. when the flusher falls
+        behind a slow but reachable MongoDB, and then for at most two
+        MongoDB operation deadlines. While flushes fail, nothing waits and
+        up to max_unflushed increments are lost if the process crashes.
+    """
+
+    def __init__(self, client, flush_interval = None, flush_threshold = None, max_unflushed = None, breaker = None,
+                 max_crash_loss = None):
+        self.client = client
+        self.breaker = breaker
+        self.flush_interval = float(flush_interval if flush_interval is not None
+                                    else os.getenv('COUNTER_FLUSH_INTERVAL_SECONDS', 5))
+        self.max_unflushed = max(1, int(max_unflushed if max_unflushed is not None
+                                        else os.getenv('COUNTER_MAX_UNFLUSHED', 10000)))
+        self.max_crash_loss = min(self.max_unflushed,
+                                  max(1, int(max_crash_loss if max_crash_loss is not None
+                                             else os.getenv('COUNTER_MAX_CRASH_LOSS', 100))))
+        self.flush_threshold = min(self.max_crash_loss,
+                                   max(1, int(flush_threshold if flush_threshold is not None
+                                              else os.getenv('COUNTER_FLUSH_THRESHOLD', 20))))
+        # The flush in flight plus the one carrying the caller's increments
+        self.flush_wait = 2 * (breaker.operation_timeout if breaker is not None else 2.0)
+
+        self._pending = 0
+        self.dropped = 0
+        self._flushing_ok = True             # the last flush succeeded
+        self._lock = threading.Lock()        # guards _pending, dropped and _flushing_ok
+        self._flushed = threading.Condition(self._lock)
+        self._flush_lock = threading.Lock()  # serializes writes to MongoDB
+        self._wake = threading.Event()
+        self._stopped = threading.Event()
+        self._thread = None
+
+        atexit.register(self.close)
+
+    @property
+    def pending(self):
+        with self._lock:
+            return self._pending
+
+    def increment(self, amount = 1):
+        """
+        DESCRIPTION:
+            Record answered questions. The background thread does the
+            writes, woken early once flush_threshold increments are pending.
+            Returns immediately unless max_crash_loss increments are pending
+            while flushes succeed, in which case it waits for the flush.
+            Increments beyond max_unflushed are dropped.
+        """
+
+        with profile_span('counter_update'):
+            if self._record(amount):
+                self._wait_for_flush()
+
+    async def increment_async(self, amount = 1):
+        """Same as increment(); the wait for the flush runs in a worker thread."""
+        with profile_span('counter_update'):
+            if self._record(amount):
+                await asyncio.to_thread(self._wait_for_flush)
+
+    def flush(self):
+        """
+        DESCRIPTION:
+            Write all pending increments to MongoDB in one shard update.
+
+        OUTPUT SIGNATURE:
+            The number of increments written (int). 0 if nothing was
+            pending or the write failed.
+        """
+
+        with self._flush_lock:
+            with self._lock:
+                amount, self._pending = self._pending, 0
+
+            if amount == 0:
+                return 0
+
+            try:
+                if self.breaker is not None:
+                    self.breaker.call(lambda: update_sevy_ai_number_of_questions_answered(amount, client = self.client))
+                else:
+                    update_sevy_ai_number_of_questions_answered(amount, client = self.client)
+                with self._lock:
+                    self._flushing_ok = True
+                    self._flushed.notify_all()
+                return amount
+            except Exception as e:
+                # Put the increments back so the next flush retries them
+                with self._lock:
+                    self._pending += amount
+                    self._flushing_ok = False
+                    self._flushed.notify_all()
+                if not (isinstance(e, MongoUnavailable) and self.breaker.is_open()):
+                    print(f"Error flushing answer counter ({amount} pending): {e}", flush=True)
+                return 0
+
+    def close(self):
+        """
+        DESCRIPTION:
+            Stop the background flusher and flush whatever is still pending.
+            Safe to call more than once.
+        """
+
+        self._stopped.set()
+        self._wake.set()
+        with self._lock:
+            self._flushed.notify_all()
+        if self._thread is not None and self._thread is not threading.current_thread():
+            self._thread.join(timeout = self.flush_interval + 5)
+        self.flush()
+
+    def _record(self, amount):
+        # Returns whether the caller has to wait for the flush (max_crash_loss reached)
+        with self._lock:
+            kept = max(0, min(amount, self.max_unflushed - self._pending))
+            self._pending += kept
+            pending = self._pending
+            first_drop = kept < amount and self.dropped == 0
+            self.dropped += amount - kept
+            must_wait = pending >= self.max_crash_loss and self._flushing_ok
+
+        if first_drop:
+            print(f"Answer counter buffer full ({self.max_unflushed} pending), dropping increments", flush=True)
+
+        self._ensure_started()
+
+        if pending >= self.flush_threshold:
+            self._wake.set()
+        return must_wait and not self._stopped.is_set()
+
+    def _wait_for_flush(self):
+        with self._lock:
+            self._flushed.wait_for(
+                lambda: self._pending < self.max_crash_loss or not self._flushing_ok or self._stopped.is_set(),
+                timeout=self.flush_wait
+            )
+
+    def _ensure_started(self):
+        if self._thread is not None or self._stopped.is_set():
+            return
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(
+                    target=self._run, name='answer-counter-flusher', daemon=True
+                )
+                self._thread.start()
+
+    def _run(self):
+        while not self._stopped.is_set():
+            self._wake.wait(self.flush_interval)
+            self._wake.clear()
+            if self._stopped.is_set():
+                break
+            self.flush()
@@ -0,0 +1,407 @@
+import asyncio
+import collections
+import contextlib
+import contextvars
+import os
+import random
+import sys
+import threading
+import time
+import uuid
+from datetime import datetime, timezone
+from pymongo import monitoring
+
+# On-demand request profiler, shared by app.py and app_async.py.
+#
+# Off unless PROFILING_ENABLED=true. Then a request is profiled when it is
+# sampled (PROFILE_SAMPLE_RATE, default 0: a fraction between 0 and 1) or
+# carries the header `X-Sevy-Profile: <ADMIN_TOKEN>`. A profile holds:
+#   - wall-clock spans of the steps worth timing (JSON parsing, the history
+#     trim, the OpenAI call, the answer counter update, each Mongo command),
+#     recorded with profile_span() where they happen
+#   - stack samples taken every PROFILE_INTERVAL_MS (default 10) by a
+#     background thread: the request thread's stack on the Flask server,
+#     the request task's stack (its await chain while it waits) on the
+#     asyncio server
+# The last PROFILE_KEEP (default 100) profiles are kept in memory and served
+# by the admin endpoints GET /profiles (spans) and GET /profiles/collapsed
+# (stack samples in collapsed-stack format, for flamegraph.pl or speedscope).
+#
+# PRIVACY: only route templates, span names, Mongo command names and code
+# locations (module and function names) are recorded. Request bodies, headers,
+# arguments and local variables are never read.
+
+PROFILING_ENABLED = os.getenv('PROFILING_ENABLED', 'false').lower() in ('1', 'true', 'yes')
+
+# Header that asks for a profile of the request (value: the admin token)
+PROFILE_HEADER = 'X-Sevy-Profile'
+
+# Bounds of one profile: spans, distinct stacks and frames per stack
+PROFILE_MAX_SPANS = 500
+PROFILE_MAX_STACKS = 2000
+PROFILE_MAX_DEPTH = 64
+
+_current_profile = contextvars.ContextVar('sevy_profile', default=None)
+
+@contextlib.contextmanager
+def profile_span(name):
+    """
+    DESCRIPTION:
+        Time a step of the current request if it is being profiled, and do
+        nothing otherwise.
+
+    INPUT SIGNATURE:
+        name: span name (a fixed string, never request data)
+    """
+
+    profile = _current_profile.get()
+    if profile is None:
+        yield
+        return
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        profile.add_span(name, started, time.perf_counter())
+
+def _frame_label(frame):
+    # "module:qualified function name", e.g. "helper_coalesce:ChatCoalescer.run"
+    code = frame.f_code
+    module = frame.f_globals.get('__name__') or os.path.basename(code.co_filename)
+    return f"{module}:{getattr(code, 'co_qualname', code.co_name)}"
+
+def _thread_stack(frame):
+    # Labels from the outermost to the innermost frame
+    labels = []
+    while frame is not None and len(labels) < PROFILE_MAX_DEPTH:
+        labels.append(_frame_label(frame))
+        frame = frame.f_back
+    labels.reverse()
+    return labels
+
+def _await_stack(coroutine):
+    # Labels along the await chain of a suspended task, outermost first
+    labels = []
+    while coroutine is not None and len(labels) < PROFILE_MAX_DEPTH:
+        frame = getattr(coroutine, 'cr_frame', None) or getattr(coroutine, 'ag_frame', None) \
+            or getattr(coroutine, 'gi_frame', None)
+        if frame is None:
+            break
+        labels.append(_frame_label(frame))
+        coroutine = getattr(coroutine, 'cr_await', None) or getattr(coroutine, 'ag_await', None) \
+            or getattr(coroutine, 'gi_yieldfrom', None)
+    return labels
+
+class RequestProfile:
+    """
+    DESCRIPTION:
+        Spans and stack samples of one profiled request.
+    """
+
+    def __init__(self, route, method, reason):
+        self.id = uuid.uuid4().hex[:12]
+        self.route = route
+        self.method = method
+        self.reason = reason
+        self.status = None
+        self.started_at = datetime.now(timezone.utc)
+        self.started = time.perf_counter()
+        self.duration = None
+        self.spans = []
+        self.samples = collections.Counter()
+        self.dropped_samples = 0
+        # Sampled thread, and on the asyncio server the request task and its loop
+        self.thread_id = threading.get_ident()
+        self.task = None
+        self.loop = None
+
+    @property
+    def finished(self):
+        return self.duration is not None
+
+    def add_span(self, name, started, ended):
+        if self.finished or len(self.spans) >= PROFILE_MAX_SPANS:
+            return
+        self.spans.append((name, started - self.started, ended - started))
+
+    def sample(self):
+        if self.task is not None and asyncio.current_task(self.loop) is not self.task:
+            # Suspended: where the task waits
+            stack = _await_stack(self.task.get_coro())
+        else:
+            stack = _thread_stack(sys._current_frames().get(self.thread_id))
+        if not stack:
+            return
+        stack = tuple(stack)
+        if stack in self.samples or len(self.samples) < PROFILE_MAX_STACKS:
+            self.samples[stack] += 1
+        else:
+            self.dropped_samples += 1
+
+    def summary(self):
+        return {
+            'id': self.id,
+            'route': self.route,
+            'method': self.method,
+            'reason': self.reason,
+            'status': self.status,
+            'startedAt': self.started_at.isoformat(),
+            'durationMs': round(self.duration * 1000, 2) if self.finished else None,
+            'samples': sum(self.samples.values()),
+            'spans': [
+                {'name': name, 'startMs': round(start * 1000, 2), 'durationMs': round(duration * 1000, 2)}
+                for name, start, duration in self.spans
+            ]
+        }
+
+class RequestProfiler:
+    """
+    DESCRIPTION:
+        Decides which requests are profiled, samples their stacks and keeps
+        the most recent profiles.
+
+    INPUT SIGNATURE:
+        enabled: default PROFILING_ENABLED
+        sample_rate: fraction of requests profiled (default: PROFILE_SAMPLE_RATE or 0)
+        interval: seconds between stack samples (default: PROFILE_INTERVAL_MS / 1000 or 0.01)
+        keep: profiles kept (default: PROFILE_KEEP or 100)
+    """
+
+    def __init__(self, enabled = None, sample_rate = None, interval = None, keep = None):
+        self.enabled = PROFILING_ENABLED if enabled is None else enabled
+        self.sample_rate = min(1.0, max(0.0, float(sample_rate if sample_rate is not None
+                                                   else os.getenv('PROFILE_SAMPLE_RATE', 0))))
+        self.interval = max(0.001, float(interval if interval is not None
+                                         else float(os.getenv('PROFILE_INTERVAL_MS', 10)) / 1000))
+        self.keep = max(1, int(keep if keep is not None else os.getenv('PROFILE_KEEP', 100)))
+
+        self._lock = threading.Lock()
+        self._active = set()
+        self._wake = threading.Event()
+        self._thread = None
+        self._profiles = collections.deque(maxlen=self.keep)
+        self._stats = {
+            'sampled': 0,
+            'requested': 0
+        }
+
+    def begin(self, route, method, requested = False):
+        """
+        DESCRIPTION:
+            Start profiling the current request if it is sampled or the
+            profile was requested. The profile becomes the current one for
+            profile_span().
+
+        INPUT SIGNATURE:
+            route: route template (never the URL)
+            method: HTTP method
+            requested: True if the request carries a valid PROFILE_HEADER
+
+        OUTPUT SIGNATURE:
+            RequestProfile, or None if the request is not profiled
+        """
+
+        if not self.enabled:
+            return None
+        if requested:
+            reason = 'requested'
+        elif self.sample_rate and random.random() < self.sample_rate:
+            reason = 'sampled'
+        else:
+            return None
+
+        profile = RequestProfile(route, method, reason)
+        try:
+            self.follow_task(profile)
+        except RuntimeError:
+            pass  # no event loop: the Flask server, the request thread is sampled
+        _current_profile.set(profile)
+        with self._lock:
+            self._stats[reason] += 1
+            self._active.add(profile)
+        self._ensure_started()
+        self._wake.set()
+        return profile
+
+    def follow_task(self, profile):
+        """
+        DESCRIPTION:
+            Sample the current asyncio task for this profile from now on
+            (the request handler, or the task sending a streamed body).
+        """
+
+        profile.loop = asyncio.get_running_loop()
+        profile.task = asyncio.current_task()
+        profile.thread_id = threading.get_ident()
+
+    def end(self, profile, status = None):
+        """
+        DESCRIPTION:
+            Finish a profile and keep it. Safe to call more than once.
+        """
+
+        if profile is None or profile.finished:
+            return
+        if status is not None:
+            profile.status = status
+        profile.duration = time.perf_counter() - profile.started
+        with self._lock:
+            self._active.discard(profile)
+            self._profiles.append(profile)
+        if _current_profile.get() is profile:
+            _current_profile.set(None)
+
+    def profiles(self, route = None):
+        """Kept profiles, newest first, optionally only those of one route template."""
+        with self._lock:
+            profiles = list(self._profiles)
+        profiles.reverse()
+        return [profile for profile in profiles if route is None or profile.route == route]
+
+    def collapsed(self, route = None, profile_id = None):
+        """
+        DESCRIPTION:
+            Stack samples of the kept profiles in collapsed-stack format:
+            one "METHOD route;outer frame;...;inner frame count" line per
+            distinct stack, most sampled first.
+
+        INPUT SIGNATURE:
+            route: only this route template (optional)
+            profile_id: only this profile (optional)
+
+        OUTPUT SIGNATURE:
+            Text (string)
+        """
+
+        totals = collections.Counter()
+        for profile in self.profiles(route):
+            if profile_id is not None and profile.id != profile_id:
+                continue
+            root = f"{profile.method} {profile.route}"
+            with self._lock:
+                samples = list(profile.samples.items())
+            for stack, count in samples:
+                totals[(root,) + stack] += count
+        return ''.join(f"{';'.join(stack)} {count}\n" for stack, count in totals.most_common())
+
+    def stats(self):
+        """
+        DESCRIPTION:
+            Profiles started since start by reason (sampled or requested),
+            profiles in progress and profiles kept.
+        """
+
+        with self._lock:
+            stats = dict(self._stats)
+            stats['active'] = len(self._active)
+            stats['kept'] = len(self._profiles)
+        return stats
+
+    def _ensure_started(self):
+        if self._thread is not None:
+            return
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='request-profiler', daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        while True:
+            with self._lock:
+                if not self._active:
+                    self._wake.clear()
+                for profile in self._active:
+                    try:
+                        profile.sample()
+                    except Exception:
+                        # The sampled stack changed under us; skip this sample
+                        pass
+                idle = not self._active
+            if idle:
+                self._wake.wait()
+            else:
+                time.sleep(self.interval)
+
+# -----------------------
+# SYNC API (Flask)
+
+def profile_body(profiler, profile, body):
+    """
+    DESCRIPTION:
+        Wrap a streamed response body so its profile covers the whole
+        stream: the request is torn down before the body is sent, so the
+        profile ends here instead.
+
+    INPUT SIGNATURE:
+        profiler: RequestProfiler
+        profile: RequestProfile of the request
+        body: the response's iterable (response.response)
+    """
+
+    try:
+        yield from body
+    finally:
+        close = getattr(body, 'close', None)
+        if close is not None:
+            close()
+        profiler.end(profile)
+
+# -----------------------
+# ASYNC API (Quart)
+
+async def profile_body_async(profiler, profile, body):
+    """
+    DESCRIPTION:
+        Same as profile_body() for a Quart ResponseBody. Samples the task
+        that sends the body from then on.
+    """
+
+    profiler.follow_task(profile)
+    try:
+        async with body as chunks:
+            async for chunk in chunks:
+                yield chunk
+    finally:
+        profiler.end(profile)
+
+# -----------------------
+# MONGO COMMANDS
+
+class MongoCommandSpans(monitoring.CommandListener):
+    """
+    DESCRIPTION:
+        pymongo command listener adding a "mongo.<command>" span to the
+        profile of the request that ran the command. Only the command name
+        is used, never the command body.
+    """
+
+    def started(self, event):
+        pass
+
+    def succeeded(self, event):
+        self._record(event)
+
+    def failed(self, event):
+        self._record(event)
+
+    @staticmethod
+    def _record(event):
+        profile = _current_profile.get()
+        if profile is not None:
+            ended = time.perf_counter()
+            profile.add_span(f'mongo.{event.command_name}', ended - event.duration_micros / 1e6, ended)
+
+_mongo_spans_registered = False
+
+def register_mongo_profiling():
+    """
+    DESCRIPTION:
+        Register MongoCommandSpans globally when profiling is enabled. Must
+        run before the MongoClient objects are created. Safe to call more
+        than once.
+    """
+
+    global _mongo_spans_registered
+    if PROFILING_ENABLED and not _mongo_spans_registered:
+        monitoring.register(MongoCommandSpans())
+        _mongo_spans_registered = True
@@ -0,0 +1,343 @@
+import asyncio
+import collections
+import hashlib
+import math
+import os
+import re
+import threading
+import time
+
+# Per-client rate limiting for /chat, /subscribe_email and /submit_application.
+#
+# Each client gets a sliding window per rule. A client is its address (see
+# client_address()). For /chat, it is the address plus the random ID the
+# frontend sends in X-Sevy-Client when there is one (see client_id()), so
+# people behind one NAT (a whole classroom on the school network) are
+# limited separately. Client IDs are chosen by the client, so the chats of
+# every ID sharing an address are also capped together, at
+# RATE_LIMIT_ADDRESS_FACTOR (default 3) times the per-client limit: a script
+# rotating IDs gets at most that. The forms ignore client IDs and are only
+# limited per address. The window is approximated from two fixed windows
+# (the "sliding window counter"): the count of the previous window is
+# weighted by how much of it still overlaps the sliding window. That needs
+# three numbers per client and rule, whatever the traffic, and a check is a
+# few dict operations. A request is counted only if every window it is
+# checked against (its client and, with a client ID, its address) lets it
+# in; rejected requests are not counted, so a client is let in again as
+# soon as its rate drops under the limit.
+#
+# Rules (requests allowed per window, per client):
+#   chat  - RATE_LIMIT_CHAT_PER_MINUTE (default 20) per 60 seconds
+#   forms - RATE_LIMIT_FORMS_PER_HOUR (default 10) per hour, counted
+#           separately for each form endpoint
+# Chats without a client ID keep the per-client limit for their address.
+# RATE_LIMIT_ENABLED=false turns the limiter off.
+#
+# Backends:
+#   memory - per process (default). At most RATE_LIMIT_MAX_KEYS clients are
+#            tracked; the least recently seen ones are evicted first.
+#   redis  - shared by every instance (RATE_LIMIT_BACKEND=redis, REDIS_URL).
+#            Requires the optional `redis` package. If Redis fails, the
+#            in-process limiter is used instead for the next 30 seconds
+#            (fail open, without paying the Redis timeout on every request).
+#
+# PRIVACY: client addresses are only held in memory. The Redis backend
+# stores a hash of them, and neither backend logs or exports them. The same
+# goes for client IDs, which are random and say nothing about the person.
+
+RATE_LIMIT_ENABLED = os.getenv('RATE_LIMIT_ENABLED', 'true').lower() in ('1', 'true', 'yes')
+
+# How long the in-process limiter stands in after a Redis error
+REMOTE_BACKEND_RETRY_SECONDS = 30
+
+# Header carrying the frontend's random client ID
+CLIENT_ID_HEADER = 'X-Sevy-Client'
+_CLIENT_ID = re.compile(r'[A-Za-z0-9_-]{16,64}')
+
+# Rules whose clients are told apart by their client ID; every other rule
+# only looks at the address
+CLIENT_ID_RULES = frozenset({'chat'})
+
+def default_rules():
+    """
+    DESCRIPTION:
+        Rate limit rules from the environment: {rule: (limit, window_seconds)}
+    """
+
+    forms = (int(os.getenv('RATE_LIMIT_FORMS_PER_HOUR', 10)), 3600)
+    return {
+        'chat': (int(os.getenv('RATE_LIMIT_CHAT_PER_MINUTE', 20)), 60),
+        'subscribe_email': forms,
+        'submit_application': forms
+    }
+
+def client_address(remote_addr, forwarded_for = None, trusted_proxies = None):
+    """
+    DESCRIPTION:
+        Address of the client behind trusted_proxies reverse proxies.
+
+        Every proxy appends the address it received the request from to
+        X-Forwarded-For, so the entry trusted_proxies from the right is the
+        client as seen by the outermost trusted proxy; entries to its left
+        are supplied by the client and cannot be trusted. On Cloud Run the
+        container sees the Google front end as remote_addr and the client as
+        the last X-Forwarded-For entry.
+
+    INPUT SIGNATURE:
+        remote_addr: address of the TCP peer (string)
+        forwarded_for: X-Forwarded-For header value (string or None)
+        trusted_proxies: default RATE_LIMIT_TRUSTED_PROXIES, or 1 on Cloud Run
+                         (K_SERVICE set) and 0 elsewhere
+
+    OUTPUT SIGNATURE:
+        Client address (string)
+    """
+
+    if trusted_proxies is None:
+        trusted_proxies = int(os.getenv('RATE_LIMIT_TRUSTED_PROXIES',
+                                        1 if os.getenv('K_SERVICE') else 0))
+    if trusted_proxies <= 0 or not forwarded_for:
+        return remote_addr or 'unknown'
+    hops = [hop.strip() for hop in forwarded_for.split(',') if hop.strip()]
+    if not hops:
+        return remote_addr or 'unknown'
+    return hops[-min(trusted_proxies, len(hops))]
+
+def client_id(header):
+    """
+    DESCRIPTION:
+        The client ID sent in CLIENT_ID_HEADER (16 to 64 letters, digits,
+        '-' or '_'), or None if there is none or it is malformed.
+    """
+
+    if header and _CLIENT_ID.fullmatch(header):
+        return header
+    return None
+
+def _retry_after(limit, window, elapsed, current, previous):
+    # Seconds until current + previous * (1 - t / window) + 1 <= limit again
+    if current + 1 > limit:
+        # Not before the next window, where this window becomes the previous one
+        overlap = (limit - 1) / current if current else 1
+        return (window - elapsed) + window * max(0.0, 1 - overlap)
+    return max(0.0, window * (1 - (limit - 1 - current) / previous) - elapsed)
+
+class InProcessRateLimitBackend:
+    """
+    DESCRIPTION:
+        Sliding window counters held in an LRU dict of at most max_keys
+        (rule, client) pairs.
+
+        hit(counters, now) checks one request against every
+        (rule, client, limit, window) in counters and counts it in all of
+        them only if all let it in. Returns 0.0, or the longest retry-after
+        in seconds.
+    """
+
+    is_remote = False
+
+    def __init__(self, max_keys = None):
+        self.max_keys = max(1, int(max_keys if max_keys is not None
+                                   else os.getenv('RATE_LIMIT_MAX_KEYS', 10000)))
+        self._windows = collections.OrderedDict()
+        self._lock = threading.Lock()
+        self.evictions = 0
+
+    def __len__(self):
+        return len(self._windows)
+
+    def hit(self, counters, now):
+        with self._lock:
+            states = [self._window(rule, client, window, now) for rule, client, limit, window in counters]
+            retry_after = 0.0
+            for state, (rule, client, limit, window) in zip(states, counters):
+                elapsed = now - state[0] * window
+                current, previous = state[1], state[2]
+                if current + previous * (1 - elapsed / window) + 1 > limit:
+                    retry_after = max(retry_after, _retry_after(limit, window, elapsed, current, previous))
+            if retry_after > 0:
+                return retry_after
+            for state in states:
+                state[1] += 1
+            return 0.0
+
+    def _window(self, rule, client, window, now):
+        # Called with _lock held: the counters of (rule, client), moved to the current window
+        index = int(now // window)
+        key = (rule, client)
+        state = self._windows.get(key)
+        if state is None:
+            # [window index, count in that window, count in the window before]
+            state = self._windows[key] = [index, 0, 0]
+            if len(self._windows) > self.max_keys:
+                self._windows.popitem(last=False)
+                self.evictions += 1
+        else:
+            self._windows.move_to_end(key)
+            if state[0] != index:
+                state[2] = state[1] if state[0] == index - 1 else 0
+                state[1] = 0
+                state[0] = index
+        return state
+
+class RedisRateLimitBackend:
+    """
+    DESCRIPTION:
+        Sliding window counters shared by every instance through Redis.
+        One pipelined round trip per check (a second one takes the counts
+        back when the request is rejected); counters expire after two
+        windows. Same hit() as InProcessRateLimitBackend.
+
+    INPUT SIGNATURE:
+        url: Redis connection URL (default: REDIS_URL or redis://localhost:6379/0)
+        prefix: key prefix for every counter
+    """
+
+    is_remote = True
+
+    def __init__(self, url = None, prefix = 'sevy:ratelimit:'):
+        import redis
+
+        self.prefix = prefix
+        self.client = redis.Redis.from_url(
+            url or os.getenv('REDIS_URL', 'redis://localhost:6379/0'),
+            socket_timeout=0.2,
+            socket_connect_timeout=0.2
+        )
+
+    def hit(self, counters, now):
+        pipeline = self.client.pipeline(transaction=False)
+        keys = []
+        for rule, client, limit, window in counters:
+            index = int(now // window)
+            digest = hashlib.sha256(client.encode('utf-8')).hexdigest()[:24]
+            key = f"{self.prefix}{rule}:{digest}:"
+            keys.append(key + str(index))
+            pipeline.incr(key + str(index))
+            pipeline.expire(key + str(index), int(window * 2))
+            pipeline.get(key + str(index - 1))
+        results = pipeline.execute()
+
+        retry_after = 0.0
+        for position, (rule, client, limit, window) in enumerate(counters):
+            current, _, previous = results[3 * position:3 * position + 3]
+            # current already includes this request
+            current, previous = int(current) - 1, int(previous or 0)
+            elapsed = now - int(now // window) * window
+            if current + previous * (1 - elapsed / window) + 1 > limit:
+                retry_after = max(retry_after, _retry_after(limit, window, elapsed, current, previous))
+        if retry_after > 0:
+            # Rejected requests are not counted, in any of the windows
+            pipeline = self.client.pipeline(transaction=False)
+            for key in keys:
+                pipeline.decr(key)
+            pipeline.execute()
+        return retry_after
+
+def create_rate_limit_backend(name = None):
+    """
+    DESCRIPTION:
+        Build the backend selected by RATE_LIMIT_BACKEND ('memory' or 'redis').
+        Falls back to the in-process backend if Redis is unavailable.
+    """
+
+    name = (name or os.getenv('RATE_LIMIT_BACKEND', 'memory')).lower()
+    if name == 'redis':
+        try:
+            return RedisRateLimitBackend()
+        except Exception as e:
+            print(f"Redis rate limit backend unavailable, using in-process limiter: {e}", flush=True)
+    return InProcessRateLimitBackend()
+
+class RateLimiter:
+    """
+    DESCRIPTION:
+        Checks requests against per-client sliding window limits.
+
+    INPUT SIGNATURE:
+        rules: {rule: (limit, window_seconds)} (default: default_rules())
+        backend: storage (default: create_rate_limit_backend())
+        enabled: default RATE_LIMIT_ENABLED
+        address_factor: cap of the chats of all client IDs sharing an
+                        address, in per-client limits
+                        (default: RATE_LIMIT_ADDRESS_FACTOR or 3)
+    """
+
+    def __init__(self, rules = None, backend = None, enabled = None, address_factor = None):
+        self.rules = rules if rules is not None else default_rules()
+        self.address_factor = max(1, int(address_factor if address_factor is not None
+                                          else os.getenv('RATE_LIMIT_ADDRESS_FACTOR', 3)))
+        self.backend = backend if backend is not None else create_rate_limit_backend()
+        self.enabled = RATE_LIMIT_ENABLED if enabled is None else enabled
+        # Used when the remote backend fails
+        self._fallback = InProcessRateLimitBackend() if self.backend.is_remote else self.backend
+        self._remote_retry_at = 0.0
+        self._stats = collections.Counter()
+
+    def check(self, rule, client, client_id = None):
+        """
+        DESCRIPTION:
+            Count one request of client under rule.
+
+        INPUT SIGNATURE:
+            rule: rule name
+            client: client address (see client_address())
+            client_id: client ID (see client_id()), or None. Only used by
+                       the rules in CLIENT_ID_RULES.
+
+        OUTPUT SIGNATURE:
+            0 if the request is allowed, otherwise the number of seconds
+            after which it would be (int, at least 1)
+        """
+
+        if not self.enabled or rule not in self.rules:
+            return 0
+        limit, window = self.rules[rule]
+        if client_id is None or rule not in CLIENT_ID_RULES:
+            counters = [(rule, client, limit, window)]
+        else:
+            counters = [
+                (rule, f"{client}#{client_id}", limit, window),
+                # Every client ID behind this address together
+                (f"{rule}:address", client, limit * self.address_factor, window)
+            ]
+        retry_after = self._hit(counters, time.time())
+
+        if retry_after <= 0:
+            return 0
+        self._stats[rule] += 1
+        return max(1, int(math.ceil(retry_after)))
+
+    async def check_async(self, rule, client, client_id = None):
+        """
+        DESCRIPTION:
+            Same as check() for the asyncio server. The in-process backend
+            runs inline (microseconds), Redis calls run in a worker thread.
+        """
+
+        if self.backend.is_remote and self.enabled and time.time() >= self._remote_retry_at:
+            return await asyncio.to_thread(self.check, rule, client, client_id)
+        return self.check(rule, client, client_id)
+
+    def _hit(self, counters, now):
+        if self.backend is self._fallback or now < self._remote_retry_at:
+            return self._fallback.hit(counters, now)
+        try:
+            return self.backend.hit(counters, now)
+        except Exception as e:
+            print(f"Rate limit backend error, using in-process limiter: {type(e).__name__}", flush=True)
+            self._remote_retry_at = now + REMOTE_BACKEND_RETRY_SECONDS
+            return self._fallback.hit(counters, now)
+
+    def stats(self):
+        """
+        DESCRIPTION:
+            Rejected requests per rule since start, clients tracked by the
+            in-process backend, and LRU evictions.
+        """
+
+        return {
+            'rejected': dict(self._stats),
+            'tracked_clients': len(self._fallback),
+            'evictions': self._fallback.evictions
+        }
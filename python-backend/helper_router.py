@@ -0,0 +1,290 @@
+import os
+import re
+import time
+import unicodedata
+from helper_chat import DEFAULT_MODEL
+
+# Local routing of /chat requests, in front of generate_completion().
+#
+# A CPU-only keyword classifier sorts each conversation into a category:
+#   crisis       - any user message mentions abuse, assault, self-harm or a
+#                  similar crisis: answered by CHAT_CRISIS_MODEL, a stronger
+#                  model, for the whole rest of the conversation
+#   greeting     - the first message is only a greeting ("hi", "xin chào"):
+#                  canned welcome in the same language, no API call
+#   out_of_scope - the last message is clearly unrelated to sex education
+#                  (weather, arithmetic, recipes, ...) and mentions no
+#                  in-scope topic: the decline from the system prompt, in the
+#                  same language, no API call
+#   routine      - everything else: CHAT_ROUTINE_MODEL (the default model)
+# The canned paths only fire when the language of the message is known from
+# the matched words (English, Vietnamese, French, Spanish, German,
+# Italian); anything uncertain goes to the model. CHAT_ROUTER_ENABLED=false
+# sends everything down the routine path.
+#
+# PRIVACY: only the category, target and timings are logged, never the
+# message or the matched words.
+
+CHAT_ROUTER_ENABLED = os.getenv('CHAT_ROUTER_ENABLED', 'true').lower() in ('1', 'true', 'yes')
+CHAT_ROUTINE_MODEL = os.getenv('CHAT_ROUTINE_MODEL', DEFAULT_MODEL)
+CHAT_CRISIS_MODEL = os.getenv('CHAT_CRISIS_MODEL', 'gpt-5-mini-2025-08-07')
+
+# Longest message (in words) that may get a canned out-of-scope reply
+OUT_OF_SCOPE_MAX_WORDS = 25
+
+GREETING_REPLIES = {
+    'en': "Hello! I'm SEVY AI, and I'm here to answer your questions about sexual health, relationships, "
+          "and related topics. What would you like to know?",
+    'vi': "Xin chào! Mình là SEVY AI, mình ở đây để giải đáp các câu hỏi của bạn về sức khỏe tình dục, "
+          "các mối quan hệ và những chủ đề liên quan. Bạn muốn hỏi gì nào?",
+    'fr': "Bonjour ! Je suis SEVY AI, et je suis là pour répondre à tes questions sur la santé sexuelle, "
+          "les relations et les sujets liés. Qu'aimerais-tu savoir ?",
+    'es': "¡Hola! Soy SEVY AI y estoy aquí para responder tus preguntas sobre salud sexual, relaciones "
+          "y temas relacionados. ¿Qué te gustaría saber?",
+    'de': "Hallo! Ich bin SEVY AI und beantworte gerne deine Fragen zu sexueller Gesundheit, Beziehungen "
+          "und verwandten Themen. Was möchtest du wissen?",
+    'it': "Ciao! Sono SEVY AI e sono qui per rispondere alle tue domande sulla salute sessuale, le relazioni "
+          "e gli argomenti correlati. Cosa vorresti sapere?"
+}
+
+# The decline of the system prompt ("Out of Scope"), in each language
+OUT_OF_SCOPE_REPLIES = {
+    'en': "I'm SEVY AI, and I specialize in sex education topics. I'm here to answer any questions related "
+          "to sexual health, relationships, or related topics. Is there anything in this area I can help you with?",
+    'vi': "Mình là SEVY AI, và mình chuyên về các chủ đề giáo dục giới tính. Mình ở đây để trả lời mọi câu hỏi "
+          "về sức khỏe tình dục, các mối quan hệ hoặc những chủ đề liên quan. Bạn có câu hỏi nào trong lĩnh vực "
+          "này mà mình có thể giúp không?",
+    'fr': "Je suis SEVY AI, et je suis spécialisé dans l'éducation sexuelle. Je suis là pour répondre à toutes "
+          "tes questions sur la santé sexuelle, les relations ou les sujets liés. Y a-t-il quelque chose dans ce "
+          "domaine pour lequel je peux t'aider ?",
+    'es': "Soy SEVY AI y me especializo en temas de educación sexual. Estoy aquí para responder cualquier "
+          "pregunta sobre salud sexual, relaciones o temas relacionados. ¿Hay algo en este ámbito en lo que "
+          "pueda ayudarte?",
+    'de': "Ich bin SEVY AI und auf Themen der Sexualaufklärung spezialisiert. Ich beantworte gerne alle Fragen "
+          "zu sexueller Gesundheit, Beziehungen und verwandten Themen. Gibt es etwas in diesem Bereich, bei dem "
+          "ich dir helfen kann?",
+    'it': "Sono SEVY AI e sono specializzato in temi di educazione sessuale. Sono qui per rispondere a qualsiasi "
+          "domanda sulla salute sessuale, le relazioni o gli argomenti correlati. C'è qualcosa in questo ambito "
+          "in cui posso aiutarti?"
+}
+
+# Greeting words (accent-free) and their language
+GREETING_WORDS = {
+    'hi': 'en', 'hello': 'en', 'hey': 'en', 'hiya': 'en', 'howdy': 'en', 'greetings': 'en',
+    'morning': 'en', 'afternoon': 'en', 'evening': 'en',
+    'chao': 'vi', 'alo': 'vi',
+    'bonjour': 'fr', 'salut': 'fr', 'bonsoir': 'fr', 'coucou': 'fr',
+    'hola': 'es', 'buenas': 'es', 'buenos': 'es',
+    'hallo': 'de', 'moin': 'de', 'servus': 'de', 'guten': 'de',
+    'ciao': 'it', 'salve': 'it', 'buongiorno': 'it', 'buonasera': 'it'
+}
+# Words that may accompany a greeting without making it a question
+GREETING_FILLERS = {
+    'there', 'everyone', 'sevy', 'ai', 'bot', 'good', 'dear',
+    'xin', 'ban', 'em', 'anh', 'chi', 'oi', 'a', 'nhe', 'buoi', 'sang', 'toi',
+    'tout', 'le', 'monde', 'que', 'tal', 'dias', 'tardes', 'noches', 'tag', 'morgen', 'abend', 'tutti'
+}
+GREETING_MAX_WORDS = 6
+
+# In-scope topics (accent-free stems). Their presence rules out a canned decline.
+IN_SCOPE_PATTERN = re.compile(
+    r'sex|condom|period|menstru|pregnan|contracep|anticoncep|\bpill|pille|pildora|pillola|'
+    r'consent|relationship|puberty|puberte|puberta|pubertad|'
+    r'pubertat|vagin|penis|breast|kiss|boyfriend|girlfriend|crush|dating|love|gay|lesbian|bisexual|trans|'
+    r'queer|lgbt|gender|\bstds?\b|\bstis?\b|\bhiv\b|\baids\b|herpes|hpv|virgin|masturb|orgasm|erection|'
+    r'ovulat|abortion|'
+    r'tinh duc|tinh yeu|bao cao su|kinh nguyet|mang thai|co thai|dong y|ban trai|ban gai|day thi|am dao|'
+    r'duong vat|gioi tinh|quan he|tranh thai|'
+    r'preservatif|regles|enceinte|consentement|amour|'
+    r'condon|embaraz|consentimiento|novio|novia|amor|'
+    r'kondom|schwanger|verhutung|einvernehm|liebe|freund|'
+    r'preservativo|incinta|consenso|mestruazion|fidanzat|amore'
+)
+
+# Clearly unrelated requests, per language (accent-free, whole words).
+# receta, Rezept and ricetta also mean "prescription", so they only count
+# next to a food word.
+OUT_OF_SCOPE_PATTERNS = {
+    'en': re.compile(r'\b(weather|forecast|recipe|bitcoin|stock price|capital of|math homework|'
+                     r'solve (this|the) equation|write (me )?(a |an )?(poem|essay|program|code))\b'),
+    'vi': re.compile(r'\b(thoi tiet|cong thuc nau|bai tap toan|giai phuong trinh|gia vang|ty gia|thu do cua)\b'),
+    'fr': re.compile(r'\b(meteo|recette|capitale de|devoirs de maths|resous l equation)\b'),
+    'es': re.compile(r'\b(pronostico del tiempo|receta de (cocina|comida|pastel|torta|galletas|pan|pollo|sopa|postre)|'
+                     r'capital de|tarea de matematicas|resuelve la ecuacion)\b'),
+    'de': re.compile(r'\b(wetter|kochrezept|backrezept|rezept fur (kuchen|brot|kekse|pizza|suppe|nudeln)|'
+                     r'hauptstadt von|mathe hausaufgaben|lose die gleichung)\b'),
+    'it': re.compile(r'\b(previsioni del tempo|ricetta (di|del|della|per) (cucina|torta|pasta|pizza|dolce|biscotti|pollo)|'
+                     r'capitale di|compiti di matematica|risolvi l equazione)\b')
+}
+# Bare arithmetic ("2+2", "what is 12 * 7?")
+ARITHMETIC_PATTERN = re.compile(r'^(?=.*\d\s*[+\-*/x^]\s*[\d(])(what is |calculate |compute |solve )?[\d\s.+\-*/x^()=]*\d[\d\s.+\-*/x^()=]*$')
+
+# Someone hurting the person writing: "he hits me", "my dad touches me".
+# The subject is required, so "beats me" (I don't know) or "will it hurt me"
+# do not match.
+CRISIS_AGGRESSORS = (
+    r'he|she|they|someone|somebody|'
+    r'my (step)?(dad|father|mom|mum|mother|parents?|brother|sister)|my (uncle|aunt|cousin|grandpa|grandfather|'
+    r'teacher|coach|boss|boyfriend|girlfriend|bf|gf|husband|wife|partner|ex|family)'
+)
+CRISIS_VIOLENCE = (
+    rf'\b({CRISIS_AGGRESSORS})( (is|was|keeps|kept|has|had|been|always|often|sometimes|still|even))* '
+    r'(beats?|beating|beaten|hits?|hitting|hurts?|hurting|slaps?|slapping|kicks?|kicking|chokes?|choking|'
+    r'punch(es)?|punching|touch(es|ed|ing)?) me\b'
+)
+
+# Crisis mentions (accent-free, whole words where a stem is ambiguous)
+CRISIS_PATTERN = re.compile(
+    r'suicid|kill myself|end my life|want to die|self.?harm|hurt(ing)? myself|cut(ting)? myself|'
+    r'\brap(e|ed|ing)\b|sexual(ly)? assault|assaulted|\babus(e|ed|ing|ive)\b|molest|incest|'
+    r'domestic violence|traffick|forced me|touched me without|'
+    rf'{CRISIS_VIOLENCE}|\bforc(ed|ing) (me |us )?(to|into)\b|\bcoerc(ed|ion|ing)\b|'
+    r'tu sat|hiep dam|cuong hiep|xam hai|lam dung|quay roi|muon chet|'
+    r'\bdanh (dap )?(toi|em|minh|con|tao)\b|\bdanh dap\b|'
+    r'\b(bi|cuong) ep\b|\bep (toi|em|minh|buoc|quan he)\b|'
+    r'me tuer|\bviol(e|ee|ees|ences?)?\b|agression sexuelle|\babus\b|maltrait|inceste|automutil|'
+    r'matarme|quiero morir|violacion|violad[ao]|abuso|abusaron|agresion sexual|autolesion|incesto|maltrato|'
+    r'selbstmord|suizid|umbringen|vergewaltig|missbrauch|sexuelle gewalt|selbstverletz|inzest|misshandl|'
+    r'uccidermi|voglio morire|stupr|violenza sessuale|abusat|autolesion|maltratt'
+)
+# Crisis words that lose their meaning without diacritics ("tự tử" vs "từ từ",
+# "bạo hành" (abuse) vs "bảo hành" (warranty), "bạo lực" (violence) vs "bao lúc")
+CRISIS_PATTERN_EXACT = re.compile(r'tự tử|tự làm hại|tự hại|bạo hành|bạo lực')
+
+def normalize_for_routing(text):
+    """
+    DESCRIPTION:
+        Lowercase, strip diacritics (đ -> d) and replace punctuation with
+        spaces, so keywords match with or without accents.
+    """
+
+    text = unicodedata.normalize('NFD', text.lower().replace('đ', 'd'))
+    text = ''.join(char for char in text if not unicodedata.combining(char))
+    return ' '.join(re.sub(r"[^\w\s.+\-*/^()=]|_", ' ', text).split())
+
+class ChatRoute:
+    """
+    DESCRIPTION:
+        Routing decision for one /chat request.
+        reply is set for canned categories (no API call), model otherwise.
+    """
+
+    def __init__(self, category, model = None, reply = None, classify_seconds = 0.0):
+        self.category = category
+        self.model = model
+        self.reply = reply
+        self.classify_seconds = classify_seconds
+        self.started = time.perf_counter()
+
+    @property
+    def target(self):
+        return 'canned' if self.reply is not None else self.model
+
+    @property
+    def cacheable(self):
+        # Crisis conversations are personal: never served from or put into the answer cache
+        return self.category == 'routine'
+
+    def finish(self, outcome = 'success'):
+        """
+        DESCRIPTION:
+            Log the latency of the request on this route (metadata only).
+
+        OUTPUT SIGNATURE:
+            Seconds since the routing decision (float)
+        """
+
+        elapsed = time.perf_counter() - self.started
+        print(f"Route {self.category} ({self.target}): {outcome} in {elapsed * 1000:.1f} ms", flush=True)
+        return elapsed
+
+def greeting_language(normalized):
+    words = normalized.replace('.', ' ').split()
+    if not words or len(words) > GREETING_MAX_WORDS:
+        return None
+    language = None
+    for word in words:
+        if word in GREETING_WORDS:
+            language = language or GREETING_WORDS[word]
+        elif word not in GREETING_FILLERS:
+            return None
+    return language
+
+def out_of_scope_language(normalized):
+    if len(normalized.split()) > OUT_OF_SCOPE_MAX_WORDS or IN_SCOPE_PATTERN.search(normalized):
+        return None
+    if ARITHMETIC_PATTERN.match(normalized):
+        return 'en'
+    for language, pattern in OUT_OF_SCOPE_PATTERNS.items():
+        if pattern.search(normalized):
+            return language
+    return None
+
+def mentions_crisis(text):
+    exact = unicodedata.normalize('NFC', text.lower())
+    return bool(CRISIS_PATTERN_EXACT.search(exact) or CRISIS_PATTERN.search(normalize_for_routing(text)))
+
+def classify_conversation(messages_history):
+    """
+    DESCRIPTION:
+        Classify a conversation for routing.
+
+    INPUT SIGNATURE:
+        messages_history: list of {'role', 'content'} messages, oldest first
+
+    OUTPUT SIGNATURE:
+        (category, language): category is 'crisis', 'greeting',
+        'out_of_scope' or 'routine'; language is set for the canned
+        categories only
+    """
+
+    user_messages = [message.get('content') for message in messages_history
+                     if isinstance(message, dict) and message.get('role') == 'user'
+                     and isinstance(message.get('content'), str)]
+    if not user_messages:
+        return 'routine', None
+
+    # Once a crisis came up, the protocol (asking for the location, giving
+    # local resources) runs over the following turns too
+    if any(mentions_crisis(text) for text in user_messages):
+        return 'crisis', None
+
+    last = normalize_for_routing(user_messages[-1])
+    if len(user_messages) == 1:
+        language = greeting_language(last)
+        if language:
+            return 'greeting', language
+
+    language = out_of_scope_language(last)
+    if language:
+        return 'out_of_scope', language
+    return 'routine', None
+
+def route_chat(messages_history):
+    """
+    DESCRIPTION:
+        Decide how to answer a conversation and log the decision.
+
+    OUTPUT SIGNATURE:
+        ChatRoute
+    """
+
+    if not CHAT_ROUTER_ENABLED:
+        return ChatRoute('routine', CHAT_ROUTINE_MODEL)
+
+    started = time.perf_counter()
+    category, language = classify_conversation(messages_history)
+    if category == 'greeting':
+        route = ChatRoute(category, reply=GREETING_REPLIES[language])
+    elif category == 'out_of_scope':
+        route = ChatRoute(category, reply=OUT_OF_SCOPE_REPLIES[language])
+    elif category == 'crisis':
+        route = ChatRoute(category, CHAT_CRISIS_MODEL)
+    else:
+        route = ChatRoute(category, CHAT_ROUTINE_MODEL)
+    route.classify_seconds = time.perf_counter() - started
+
+    # PRIVACY: category and target only, never the message
+    print(f"Route: {route.category} -> {route.target} "
+          f"(classified in {route.classify_seconds * 1000:.2f} ms)", flush=True)
+    return route
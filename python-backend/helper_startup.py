@@ -0,0 +1,179 @@
+import asyncio
+import os
+import threading
+import time
+from dotenv import load_dotenv
+
+# Cold-start helpers shared by app.py and app_async.py.
+#
+# Import this module before anything heavy: its import time is the zero
+# point of the startup timings (STARTUP_STARTED).
+#
+# - load_env_file(): reads .env once per process
+# - LazyClient: creates a client on first use instead of at import time
+# - StartupTimings: import, warm-up and first-request timings, reported on
+#   /ready and /metrics
+# - WarmUp: runs the slow startup steps (client creation, MongoDB ping,
+#   index checks) in the background while the server already accepts
+#   requests, and tracks readiness
+
+STARTUP_STARTED = time.perf_counter()
+
+_env_lock = threading.Lock()
+_env_loaded = None
+
+def load_env_file():
+    """
+    DESCRIPTION:
+        Load the .env file into the environment, once per process.
+
+    OUTPUT SIGNATURE:
+        True if a .env file was found, False otherwise
+    """
+
+    global _env_loaded
+    with _env_lock:
+        if _env_loaded is None:
+            _env_loaded = os.path.isfile('.env')
+            if _env_loaded:
+                load_dotenv(override=True)
+            else:
+                print("\n\nError: No .env file found in the repository.\n\n")
+        return _env_loaded
+
+class StartupTimings:
+    """
+    DESCRIPTION:
+        Seconds from STARTUP_STARTED to each startup phase. Only the first
+        mark of a phase is kept.
+    """
+
+    def __init__(self):
+        self._phases = {}
+        self._lock = threading.Lock()
+
+    def mark(self, phase):
+        if phase in self._phases:
+            return
+        elapsed = round(time.perf_counter() - STARTUP_STARTED, 4)
+        with self._lock:
+            if phase in self._phases:
+                return
+            self._phases[phase] = elapsed
+        print(f"Startup: {phase} after {elapsed:.3f}s", flush=True)
+
+    def as_dict(self):
+        with self._lock:
+            return dict(self._phases)
+
+startup_timings = StartupTimings()
+
+class LazyClient:
+    """
+    DESCRIPTION:
+        Stand-in for a client object (OpenAI, MongoClient, ...) that is only
+        created by factory() on first use. Attribute and item access are
+        forwarded to the real client, so call sites do not change.
+
+    INPUT SIGNATURE:
+        factory: function returning the client
+        name: label for the startup timings ('<name>_client_created')
+    """
+
+    def __init__(self, factory, name):
+        self._factory = factory
+        self._name = name
+        self._client = None
+        self._lock = threading.Lock()
+
+    @property
+    def is_created(self):
+        return self._client is not None
+
+    def resolve(self):
+        client = self._client
+        if client is None:
+            with self._lock:
+                if self._client is None:
+                    self._client = self._factory()
+                    startup_timings.mark(f'{self._name}_client_created')
+                client = self._client
+        return client
+
+    def __getattr__(self, name):
+        return getattr(self.resolve(), name)
+
+    def __getitem__(self, key):
+        return self.resolve()[key]
+
+class WarmUp:
+    """
+    DESCRIPTION:
+        Runs startup steps in order, in the background, and records which
+        of them succeeded. The process is ready once every step has run.
+        Like the previous import-time startup, a failed step (e.g. MongoDB
+        unreachable) does not keep the server from serving; it is reported
+        as degraded.
+
+    INPUT SIGNATURE:
+        steps: list of (name, function) tuples
+    """
+
+    def __init__(self, steps):
+        self.steps = steps
+        self.checks = {name: 'pending' for name, _ in steps}
+        self.finished = threading.Event()
+        self._thread = None
+
+    @property
+    def ready(self):
+        return self.finished.is_set()
+
+    def start(self):
+        self._thread = threading.Thread(target=self.run, name='startup-warm-up', daemon=True)
+        self._thread.start()
+        return self
+
+    def run(self):
+        for name, step in self.steps:
+            try:
+                step()
+                self.checks[name] = 'ok'
+            except Exception as e:
+                self.checks[name] = 'failed'
+                print(f"Warm-up step {name} failed (non-fatal): {e}", flush=True)
+        startup_timings.mark('warm_up_finished')
+        self.finished.set()
+
+    async def run_async(self):
+        """
+        DESCRIPTION:
+            Same as run() for the asyncio server, as an event loop task.
+            Coroutine functions are awaited, other steps run in a thread.
+        """
+
+        for name, step in self.steps:
+            try:
+                if asyncio.iscoroutinefunction(step):
+                    await step()
+                else:
+                    await asyncio.to_thread(step)
+                self.checks[name] = 'ok'
+            except Exception as e:
+                self.checks[name] = 'failed'
+                print(f"Warm-up step {name} failed (non-fatal): {e}", flush=True)
+        startup_timings.mark('warm_up_finished')
+        self.finished.set()
+
+    def status(self):
+        """
+        DESCRIPTION:
+            Readiness report for the /ready endpoint.
+        """
+
+        return {
+            'ready': self.ready,
+            'degraded': 'failed' in self.checks.values(),
+            'checks': dict(self.checks),
+            'startup_seconds': startup_timings.as_dict()
+        }
@@ -0,0 +1,120 @@
+import io
+import os
+import tracemalloc
+from werkzeug.exceptions import RequestEntityTooLarge
+
+# Streamed, size-bounded handling of uploaded files.
+#
+# The backend never stores uploads (the /submit_application resume is
+# "received but not stored"). Instead of letting the multipart parser
+# buffer each file in memory or a temporary file, both apps plug
+# discarding_stream_factory() into their request class: file data is
+# counted and dropped chunk by chunk, so an upload never holds more than
+# one parser chunk in memory. (Quart additionally holds body chunks that
+# arrive before the parser reads them, so its peak is somewhat higher.)
+#
+# Limits:
+#   APPLICATION_MAX_CONTENT_LENGTH - whole /submit_application request; larger
+#                                    requests are refused from the
+#                                    Content-Length header, before any reading
+#   UPLOAD_MAX_FILE_BYTES          - one file; reading stops as soon as it is
+#                                    exceeded (also covers chunked uploads)
+# Both limits answer 413.
+#
+# UPLOAD_TRACE_MEMORY=true traces Python allocations so the peak memory of
+# each upload can be reported. Tracing slows the whole process down; only
+# enable it to measure.
+
+# Frontend limit is 5 MB per resume, plus room for the text fields
+APPLICATION_MAX_CONTENT_LENGTH = int(os.getenv('APPLICATION_MAX_CONTENT_LENGTH', 6 * 1024 * 1024))
+UPLOAD_MAX_FILE_BYTES = int(os.getenv('UPLOAD_MAX_FILE_BYTES', 5 * 1024 * 1024))
+UPLOAD_TRACE_MEMORY = os.getenv('UPLOAD_TRACE_MEMORY', 'false').lower() in ('1', 'true', 'yes')
+
+if UPLOAD_TRACE_MEMORY and not tracemalloc.is_tracing():
+    tracemalloc.start()
+
+class DiscardedUpload(io.RawIOBase):
+    """
+    DESCRIPTION:
+        File object that counts and drops what is written to it; reading
+        it back yields nothing. Raises RequestEntityTooLarge once more than max_bytes are written.
+    """
+
+    def __init__(self, max_bytes = None):
+        super().__init__()
+        self.max_bytes = UPLOAD_MAX_FILE_BYTES if max_bytes is None else max_bytes
+        self.bytes_received = 0
+
+    def writable(self):
+        return True
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def write(self, data):
+        size = len(data)
+        self.bytes_received += size
+        if self.max_bytes is not None and self.bytes_received > self.max_bytes:
+            raise RequestEntityTooLarge()
+        return size
+
+    def readinto(self, buffer):
+        return 0
+
+    def seek(self, offset, whence = io.SEEK_SET):
+        return 0
+
+    def tell(self):
+        return 0
+
+def discarding_stream_factory(total_content_length = None, content_type = None, filename = None,
+                              content_length = None):
+    """
+    DESCRIPTION:
+        Multipart stream factory (Werkzeug / Quart signature) that discards
+        file data instead of buffering it.
+    """
+
+    if content_length and content_length > UPLOAD_MAX_FILE_BYTES:
+        raise RequestEntityTooLarge()
+    return DiscardedUpload()
+
+def uploaded_bytes(file_storage):
+    """
+    DESCRIPTION:
+        Number of bytes received for an uploaded file, or None if it was
+        not handled by discarding_stream_factory().
+    """
+
+    return getattr(file_storage.stream, 'bytes_received', None)
+
+def content_length_exceeds(content_length, limit = None):
+    limit = APPLICATION_MAX_CONTENT_LENGTH if limit is None else limit
+    return content_length is not None and content_length > limit
+
+class UploadMemoryProbe:
+    """
+    DESCRIPTION:
+        Context manager measuring the peak Python memory allocated while an
+        upload is parsed (peak_bytes), when UPLOAD_TRACE_MEMORY is enabled.
+        The peak is process wide, so concurrent requests are included.
+        peak_bytes stays None when tracing is off.
+    """
+
+    def __init__(self):
+        self.peak_bytes = None
+        self._baseline = 0
+
+    def __enter__(self):
+        if tracemalloc.is_tracing():
+            self._baseline = tracemalloc.get_traced_memory()[0]
+            tracemalloc.reset_peak()
+        return self
+
+    def __exit__(self, exc_type, exc, traceback):
+        if tracemalloc.is_tracing():
+            self.peak_bytes = max(0, tracemalloc.get_traced_memory()[1] - self._baseline)
+        return False
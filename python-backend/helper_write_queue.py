@@ -0,0 +1,251 @@
+import atexit
+import os
+import sqlite3
+import threading
+import time
+from bson import ObjectId, json_util
+from pymongo import InsertOne, UpdateOne
+from pymongo.errors import BulkWriteError
+
+# Optional write-behind queue for form submissions (WRITE_QUEUE_ENABLED).
+#
+# /submit_application and /subscribe_email normally write to MongoDB inside
+# the request. With the queue enabled, the document is persisted to a local
+# SQLite file instead and the client is acknowledged right away; a
+# background thread drains the file to MongoDB in batches.
+#
+# - Every document gets its _id when it is queued, so a batch that is
+#   retried after a partial success never creates duplicates (the
+#   duplicate-key errors of already written documents count as success).
+# - Subscriptions are drained as upserts on emailNormalized, the same
+#   operation subscribe_email() uses (see helper_mongodb.py). In queued
+#   mode an already subscribed email is therefore merged at drain time and
+#   the request gets {'success': True} instead of the 409 isDuplicate reply.
+# - Failed batches are retried with exponential backoff; documents are
+#   never dropped.
+# - Backpressure: once WRITE_QUEUE_MAX_DEPTH documents are waiting,
+#   enqueue() raises WriteQueueFull and the caller writes directly.
+#
+# CAUTION: the queue only survives what its file survives. On Cloud Run the
+# local filesystem is in memory, so queued documents outlive a crashed
+# process but not a stopped instance; the queue is drained on shutdown
+# (SIGTERM) within the grace period. Point WRITE_QUEUE_PATH at a mounted
+# volume for stronger guarantees.
+
+WRITE_QUEUE_ENABLED = os.getenv('WRITE_QUEUE_ENABLED', 'false').lower() in ('1', 'true', 'yes')
+
+# MongoDB error code for duplicate keys
+DUPLICATE_KEY_ERROR = 11000
+
+class WriteQueueFull(Exception):
+    pass
+
+class WriteBehindQueue:
+    """
+    DESCRIPTION:
+        Durable local queue of MongoDB writes, drained in batches.
+
+    INPUT SIGNATURE:
+        database: the SEVY_database Database of a synchronous MongoClient
+        path: SQLite file (default: WRITE_QUEUE_PATH or /tmp/sevy_write_queue.sqlite3)
+        batch_size: documents per drained batch (default: WRITE_QUEUE_BATCH_SIZE or 100)
+        drain_interval: seconds between drains (default: WRITE_QUEUE_DRAIN_INTERVAL_SECONDS or 1)
+        max_depth: queued documents before enqueue() refuses new ones
+                   (default: WRITE_QUEUE_MAX_DEPTH or 10000)
+        max_backoff: longest wait between retries of a failing batch, in seconds
+    """
+
+    def __init__(self, database, path = None, batch_size = None, drain_interval = None,
+                 max_depth = None, max_backoff = 300):
+        self.database = database
+        self.path = path or os.getenv('WRITE_QUEUE_PATH', '/tmp/sevy_write_queue.sqlite3')
+        self.batch_size = max(1, int(batch_size if batch_size is not None
+                                     else os.getenv('WRITE_QUEUE_BATCH_SIZE', 100)))
+        self.drain_interval = float(drain_interval if drain_interval is not None
+                                    else os.getenv('WRITE_QUEUE_DRAIN_INTERVAL_SECONDS', 1))
+        self.max_depth = int(max_depth if max_depth is not None
+                             else os.getenv('WRITE_QUEUE_MAX_DEPTH', 10000))
+        self.max_backoff = max_backoff
+
+        self._db = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+        self._db.execute('PRAGMA journal_mode=WAL')
+        self._db.execute('PRAGMA synchronous=NORMAL')
+        self._db.execute('PRAGMA busy_timeout=5000')
+        self._db.execute(
+            'CREATE TABLE IF NOT EXISTS pending ('
+            ' id INTEGER PRIMARY KEY AUTOINCREMENT,'
+            ' collection TEXT NOT NULL,'
+            ' key_field TEXT,'
+            ' document TEXT NOT NULL,'
+            ' enqueued_at REAL NOT NULL,'
+            ' attempts INTEGER NOT NULL DEFAULT 0,'
+            ' next_attempt_at REAL NOT NULL DEFAULT 0)'
+        )
+        self._lock = threading.Lock()        # guards the SQLite connection
+        self._drain_lock = threading.Lock()  # one drain at a time
+        self._wake = threading.Event()
+        self._stopped = threading.Event()
+        self._stats = {
+            'enqueued': 0,
+            'drained': 0,
+            'failed_batches': 0,
+            'rejected': 0,
+            'last_drain_lag_seconds': 0.0
+        }
+
+        self._thread = threading.Thread(target=self._run, name='write-behind-drainer', daemon=True)
+        self._thread.start()
+        atexit.register(self.close)
+
+    def enqueue(self, collection_name, document, key_field = None):
+        """
+        DESCRIPTION:
+            Persist a document locally for a later write to collection_name.
+
+        INPUT SIGNATURE:
+            collection_name: target collection in SEVY_database
+            document: document to write (an _id is added if missing)
+            key_field: if set, the document is drained as an upsert
+                       ($setOnInsert) on this field instead of an insert
+
+        OUTPUT SIGNATURE:
+            The document _id
+
+        RAISES:
+            WriteQueueFull when max_depth documents are already waiting
+        """
+
+        document = dict(document)
+        document.setdefault('_id', ObjectId())
+        payload = json_util.dumps(document, json_options=json_util.CANONICAL_JSON_OPTIONS)
+
+        with self._lock:
+            depth = self._db.execute('SELECT COUNT(*) FROM pending').fetchone()[0]
+            if depth >= self.max_depth:
+                self._stats['rejected'] += 1
+                raise WriteQueueFull(f"{depth} writes already queued")
+            self._db.execute(
+                'INSERT INTO pending (collection, key_field, document, enqueued_at) VALUES (?, ?, ?, ?)',
+                (collection_name, key_field, payload, time.time())
+            )
+            self._stats['enqueued'] += 1
+
+        if depth + 1 >= self.batch_size:
+            self._wake.set()
+        return document['_id']
+
+    def drain(self):
+        """
+        DESCRIPTION:
+            Write one batch of due documents to MongoDB, one bulk write per
+            collection. Written rows are deleted; failed rows are kept and
+            retried later with exponential backoff.
+
+        OUTPUT SIGNATURE:
+            Number of documents written (int)
+        """
+
+        with self._drain_lock:
+            now = time.time()
+            with self._lock:
+                rows = self._db.execute(
+                    'SELECT id, collection, key_field, document, enqueued_at, attempts FROM pending '
+                    'WHERE next_attempt_at <= ? ORDER BY id LIMIT ?',
+                    (now, self.batch_size)
+                ).fetchall()
+            if not rows:
+                return 0
+
+            batches = {}
+            for row in rows:
+                batches.setdefault(row[1], []).append(row)
+
+            written = 0
+            for collection_name, batch in batches.items():
+                if self._write_batch(collection_name, batch):
+                    written += len(batch)
+                    self._forget([row[0] for row in batch])
+                    self._stats['drained'] += len(batch)
+                    self._stats['last_drain_lag_seconds'] = round(time.time() - min(row[4] for row in batch), 3)
+                else:
+                    self._postpone(batch)
+            return written
+
+    def stats(self):
+        """
+        DESCRIPTION:
+            Queue depth, age of the oldest queued document (drain lag) and
+            counters since the process started.
+        """
+
+        with self._lock:
+            depth, oldest = self._db.execute('SELECT COUNT(*), MIN(enqueued_at) FROM pending').fetchone()
+            stats = dict(self._stats)
+        stats['depth'] = depth
+        stats['oldest_age_seconds'] = round(time.time() - oldest, 3) if oldest else 0.0
+        return stats
+
+    def close(self):
+        """
+        DESCRIPTION:
+            Stop the drainer and try to drain whatever is due.
+            Safe to call more than once.
+        """
+
+        if self._stopped.is_set():
+            return
+        self._stopped.set()
+        self._wake.set()
+        if self._thread is not threading.current_thread():
+            self._thread.join(timeout = self.drain_interval + 5)
+        while self.drain():
+            pass
+
+    def _write_batch(self, collection_name, batch):
+        operations = []
+        for _, _, key_field, payload, _, _ in batch:
+            document = json_util.loads(payload)
+            if key_field:
+                operations.append(UpdateOne({key_field: document[key_field]}, {'$setOnInsert': document}, upsert=True))
+            else:
+                operations.append(InsertOne(document))
+        try:
+            self.database[collection_name].bulk_write(operations, ordered=False)
+            return True
+        except BulkWriteError as e:
+            # Documents already written by an earlier, partially failed attempt
+            if all(error.get('code') == DUPLICATE_KEY_ERROR for error in e.details.get('writeErrors', [])) \
+                    and not e.details.get('writeConcernErrors'):
+                return True
+            print(f"Write queue batch error for {collection_name} (will retry): {type(e).__name__}", flush=True)
+            self._stats['failed_batches'] += 1
+            return False
+        except Exception as e:
+            print(f"Write queue batch error for {collection_name} (will retry): {e}", flush=True)
+            self._stats['failed_batches'] += 1
+            return False
+
+    def _forget(self, ids):
+        with self._lock:
+            self._db.executemany('DELETE FROM pending WHERE id = ?', [(row_id,) for row_id in ids])
+
+    def _postpone(self, batch):
+        now = time.time()
+        with self._lock:
+            self._db.executemany(
+                'UPDATE pending SET attempts = attempts + 1, next_attempt_at = ? WHERE id = ?',
+                [(now + min(self.max_backoff, self.drain_interval * 2 ** row[5]), row[0]) for row in batch]
+            )
+
+    def _run(self):
+        while not self._stopped.is_set():
+            self._wake.wait(self.drain_interval)
+            self._wake.clear()
+            if self._stopped.is_set():
+                break
+            try:
+                # Keep draining while full batches come back
+                while self.drain() >= self.batch_size:
+                    pass
+            except Exception as e:
+                print(f"Write queue drain error (non-fatal): {e}", flush=True)
@@ -0,0 +1,46 @@
+import os
+
+# Production entry point for the SEVY backend.
+#
+# SERVER_MODE selects the serving stack:
+#   async (default) - app_async.py (Quart) served by uvicorn
+#   flask           - app.py on the Flask server (compatibility mode)
+#
+# Concurrency settings (async mode):
+#   WEB_CONCURRENCY         - number of uvicorn worker processes (default 1)
+#   ASGI_LIMIT_CONCURRENCY  - max concurrent connections per worker before
+#                             uvicorn answers 503 (default: unlimited)
+#   CHAT_MAX_CONCURRENCY    - max OpenAI calls in flight per worker (see helper_admission.py)
+#   GRACEFUL_SHUTDOWN_SECONDS - time allowed for in-flight requests on SIGTERM
+
+SERVER_MODE = os.getenv('SERVER_MODE', 'async').lower()
+
+def run_async(port):
+    import uvicorn
+
+    limit_concurrency = os.getenv('ASGI_LIMIT_CONCURRENCY')
+    uvicorn.run(
+        'app_async:app',
+        host='0.0.0.0',
+        port=port,
+        workers=int(os.getenv('WEB_CONCURRENCY', 1)),
+        limit_concurrency=int(limit_concurrency) if limit_concurrency else None,
+        timeout_graceful_shutdown=int(os.getenv('GRACEFUL_SHUTDOWN_SECONDS', 8)),
+        # PRIVACY: no access logs in production (K_SERVICE is set on Cloud Run)
+        access_log=os.getenv('K_SERVICE') is None
+    )
+
+def run_flask(port):
+    import signal
+    from app import app, handle_sigterm
+
+    signal.signal(signal.SIGTERM, handle_sigterm)
+    app.run(host='0.0.0.0', port=port, threaded=True)
+
+if __name__ == "__main__":
+    port = int(os.getenv('PORT', 5000))
+    print(f"Starting SEVY backend in {SERVER_MODE} mode on port {port}", flush=True)
+    if SERVER_MODE == 'flask':
+        run_flask(port)
+    else:
+        run_async(port)
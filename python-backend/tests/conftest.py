@@ -0,0 +1,36 @@
+import os
+import sys
+from datetime import datetime, timezone
+
+import mongomock
+import pytest
+
+# Tests run against mongomock (requirements-dev.txt), never a real MongoDB
+# or OpenAI. Run them from python-backend/: python -m pytest -q
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# Importing the benchmark stand-ins lets mongomock accept the `sort`
+# argument newer pymongo passes to bulk updates
+import benchmarks.stand_ins  # noqa: E402,F401
+
+def seed_sevy_numbers(client, answers = 1000, educators = 7, students = 500):
+    """SEVY_numbers in the layout of production: one document per number."""
+    today_str = datetime.now(timezone.utc).strftime('%Y-%m-%d')
+    client['SEVY_database']['SEVY_numbers'].insert_many([
+        {'sevy_ai_answers': answers},
+        {'sevy_ai_real_answers': 10},
+        {'sevy_educators_number': educators},
+        {'students_taught': students},
+        # Today's daily inflation is already claimed, so the numbers stay put
+        {'sevy_ai_last_inflation_date': today_str}
+    ])
+
+@pytest.fixture
+def mongo_client():
+    client = mongomock.MongoClient()
+    seed_sevy_numbers(client)
+    return client
+
+@pytest.fixture
+def numbers_collection(mongo_client):
+    return mongo_client['SEVY_database']['SEVY_numbers']
@@ -0,0 +1,161 @@
+import asyncio
+import threading
+import time
+
+import pytest
+
+from helper_admission import AdmissionController, OpenAIBusy
+from helper_hedging import Deadline
+
+class UpstreamError(Exception):
+    """Stand-in for an OpenAI API error: a status code and optional Retry-After."""
+
+    def __init__(self, status_code, retry_after = None):
+        super().__init__(f'status {status_code}')
+        self.status_code = status_code
+        self.response = type('Response', (), {'headers': {'retry-after': retry_after} if retry_after else {}})()
+
+class Failing:
+    def __init__(self, error):
+        self.error = error
+        self.calls = 0
+
+    def __call__(self):
+        self.calls += 1
+        raise self.error
+
+def controller(**settings):
+    defaults = {'max_concurrency': 1, 'requests_per_minute': 0, 'tokens_per_minute': 0, 'max_queue': 8,
+                'queue_timeout': 5, 'max_retries': 2, 'retry_base': 0.001, 'retry_max': 0.01}
+    defaults.update(settings)
+    return AdmissionController(**defaults)
+
+def wait_until(condition, timeout = 2):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, 'timed out'
+        time.sleep(0.001)
+
+def test_waiters_are_admitted_in_arrival_order():
+    admission = controller()
+    first = admission.acquire(10)
+    order = []
+
+    def chat(number):
+        ticket = admission.acquire(10)
+        order.append(number)
+        admission.release(ticket)
+
+    threads = []
+    for number in range(5):
+        thread = threading.Thread(target=chat, args=(number,))
+        thread.start()
+        threads.append(thread)
+        # Queue them one at a time so the arrival order is known
+        wait_until(lambda: admission.stats()['queued'] == number + 1)
+
+    admission.release(first)
+    for thread in threads:
+        thread.join(2)
+    assert order == [0, 1, 2, 3, 4]
+    assert admission.stats()['in_flight'] == 0
+
+def test_full_queue_rejects_at_once():
+    admission = controller(max_queue=1)
+    held = admission.acquire(10)
+    waiter = threading.Thread(target=lambda: admission.release(admission.acquire(10)))
+    waiter.start()
+    wait_until(lambda: admission.stats()['queued'] == 1)
+
+    with pytest.raises(OpenAIBusy) as busy:
+        admission.acquire(10)
+    assert busy.value.reason == 'queue_full'
+    assert admission.stats()['rejected_queue_full'] == 1
+
+    admission.release(held)
+    waiter.join(2)
+
+def test_caller_that_cannot_make_the_deadline_is_shed_without_waiting():
+    # 600 tokens per minute: after the first call, the next 600 tokens take a minute
+    admission = controller(max_concurrency=4, tokens_per_minute=600, queue_timeout=1)
+    admission.acquire(600)
+
+    started = time.monotonic()
+    with pytest.raises(OpenAIBusy) as busy:
+        admission.acquire(600)
+    assert time.monotonic() - started < 0.5
+    assert busy.value.reason == 'deadline'
+    assert busy.value.retry_after > 1
+    assert admission.stats()['queued'] == 0
+
+def test_queued_caller_times_out():
+    admission = controller(queue_timeout=0.1)
+    admission.acquire(10)
+
+    with pytest.raises(OpenAIBusy) as busy:
+        admission.acquire(10)
+    assert busy.value.reason == 'timeout'
+    assert busy.value.waited >= 0.1
+    assert admission.stats()['queued'] == 0
+
+def test_server_errors_are_retried_up_to_max_retries():
+    admission = controller(max_retries=2)
+    failing = Failing(UpstreamError(503))
+
+    with pytest.raises(UpstreamError):
+        admission.call(failing)
+    assert failing.calls == 3
+    assert admission.stats()['retries'] == 2
+
+def test_rate_limited_after_retries_raises_busy():
+    admission = controller(max_retries=1)
+    failing = Failing(UpstreamError(429))
+
+    with pytest.raises(OpenAIBusy) as busy:
+        admission.call(failing)
+    assert failing.calls == 2
+    assert busy.value.reason == 'upstream_rate_limited'
+
+def test_retry_after_beyond_retry_max_is_not_waited_for():
+    admission = controller(max_retries=3, retry_max=1)
+    failing = Failing(UpstreamError(429, retry_after='30'))
+
+    with pytest.raises(OpenAIBusy) as busy:
+        admission.call(failing)
+    assert failing.calls == 1
+    assert busy.value.retry_after == 30
+
+def test_client_errors_and_exhausted_deadlines_are_not_retried():
+    admission = controller(max_retries=3)
+    failing = Failing(UpstreamError(400))
+    with pytest.raises(UpstreamError):
+        admission.call(failing)
+    assert failing.calls == 1
+
+    failing = Failing(UpstreamError(503))
+    with pytest.raises(UpstreamError):
+        admission.call(failing, Deadline(total=0))
+    assert failing.calls == 1
+
+def test_rate_limited_past_the_deadline_raises_busy():
+    admission = controller(max_retries=3, retry_max=10)
+    failing = Failing(UpstreamError(429, retry_after='5'))
+
+    with pytest.raises(OpenAIBusy) as busy:
+        admission.call(failing, Deadline(total=1))
+    assert failing.calls == 1
+    assert busy.value.reason == 'upstream_rate_limited'
+    assert busy.value.retry_after == 5
+    assert admission.stats()['retries'] == 0
+
+def test_rate_limited_past_the_deadline_raises_busy_async():
+    admission = controller(max_retries=3, retry_max=10)
+    failing = Failing(UpstreamError(429, retry_after='5'))
+
+    async def call():
+        failing()
+
+    with pytest.raises(OpenAIBusy) as busy:
+        asyncio.run(admission.call_async(call, Deadline(total=1)))
+    assert failing.calls == 1
+    assert busy.value.reason == 'upstream_rate_limited'
@@ -0,0 +1,76 @@
+import time
+from types import SimpleNamespace
+
+import pytest
+
+from helper_answer_cache import AnswerCache
+from helper_core import SevyCore
+from helper_router import route_chat
+
+def cache(**settings):
+    return AnswerCache(**{'enabled': True, 'use_embeddings': False, 'ttl': 60, 'max_entries': 8, **settings})
+
+def user(text):
+    return [{'role': 'user', 'content': text}]
+
+@pytest.mark.parametrize('messages', [
+    user('What is consent?') + [{'role': 'assistant', 'content': 'Consent is...'}] + user('Tell me more'),
+    user('My email is jane.doe@example.org, what is consent?'),
+    user('Call me at 555 123 4567 about consent'),
+    user('Is https://example.org/quiz about consent?'),
+    user('What is consent? ' * 20),
+    [{'role': 'assistant', 'content': 'What is consent?'}],
+    user('?!'),
+])
+def test_conversations_that_bypass_the_cache(messages):
+    answer_cache = cache()
+    assert answer_cache.question_for(messages) is None
+    assert answer_cache.stats()['bypassed'] == 1
+
+def test_disabled_cache_is_never_used():
+    assert cache(enabled=False).question_for(user('What is consent?')) is None
+
+def test_trivial_variations_share_one_answer():
+    answer_cache = cache()
+    answer_cache.put(answer_cache.question_for(user('What is consent?')), 'Consent is...', 2.0)
+    question = answer_cache.question_for(user('  what IS consent '))
+    assert answer_cache.lookup(question) == ('Consent is...', None)
+    assert answer_cache.stats()['saved_seconds'] == 2.0
+
+def test_question_text_is_never_stored():
+    answer_cache = cache()
+    question = answer_cache.question_for(user('What is consent?'))
+    answer_cache.put(question, 'Consent is...', 1.0)
+    entry, = answer_cache._entries.values()
+    assert question not in repr(entry)
+    assert entry['key'] == answer_cache._key(question) != question
+
+def test_expired_and_least_recently_used_entries_are_dropped(monkeypatch):
+    answer_cache = cache(max_entries=2)
+    for question in ('a', 'b', 'c'):
+        answer_cache.put(question, question.upper(), 1.0)
+    assert answer_cache.lookup('a') == (None, None)
+
+    later = time.time() + 61
+    monkeypatch.setattr(time, 'time', lambda: later)
+    assert answer_cache.lookup('c') == (None, None)
+    assert answer_cache.stats()['entries'] == 0
+
+def test_similar_answers_stay_within_one_script():
+    answer_cache = cache(use_embeddings=True, similarity_threshold=0.9)
+    answer_cache.put('what is consent', 'Consent is...', 1.0, vector=[1.0, 0.0])
+    embed = lambda question: [1.0, 0.01]
+    assert answer_cache.lookup('what does consent mean', embed)[0] == 'Consent is...'
+    assert answer_cache.lookup('đồng ý là gì', embed)[0] is None
+
+def test_crisis_conversations_are_not_cacheable():
+    assert not route_chat(user('I want to kill myself')).cacheable
+
+def test_lookup_errors_are_logged_without_the_question(capsys):
+    def embed(question):
+        raise RuntimeError(f'embedding failed for {question}')
+
+    core = SimpleNamespace(answer_cache=cache(use_embeddings=True), embed_question=embed)
+    question, vector, answer = SevyCore.lookup_cached_answer(core, user('What is consent?'))
+    assert (question, vector, answer) == ('what is consent', None, None)
+    assert 'consent' not in capsys.readouterr().out
@@ -0,0 +1,79 @@
+import time
+
+from helper_mongodb import AnswerCounterAggregator, parse_sevy_numbers, sevy_numbers_pipeline
+
+def answers(client):
+    collection = client['SEVY_database']['SEVY_numbers']
+    return parse_sevy_numbers(collection.aggregate(sevy_numbers_pipeline()))['sevy_ai_answers']
+
+def wait_until(condition, timeout = 2):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            return False
+        time.sleep(0.005)
+    return True
+
+def test_increment_never_writes_on_the_caller_thread(mongo_client):
+    counter = AnswerCounterAggregator(mongo_client, flush_interval=60, flush_threshold=1000)
+    for _ in range(5):
+        counter.increment()
+    assert counter.pending == 5
+    assert answers(mongo_client) == 1000
+    counter.close()
+
+def test_flush_at_threshold(mongo_client):
+    counter = AnswerCounterAggregator(mongo_client, flush_interval=60, flush_threshold=3)
+    counter.increment()
+    counter.increment()
+    time.sleep(0.05)
+    assert answers(mongo_client) == 1000
+
+    counter.increment()
+    assert wait_until(lambda: answers(mongo_client) == 1003)
+    assert counter.pending == 0
+    counter.close()
+
+def test_flush_on_interval(mongo_client):
+    counter = AnswerCounterAggregator(mongo_client, flush_interval=0.05, flush_threshold=1000)
+    counter.increment(2)
+    assert wait_until(lambda: answers(mongo_client) == 1002)
+    counter.close()
+
+def test_flush_at_exit(mongo_client):
+    counter = AnswerCounterAggregator(mongo_client, flush_interval=60, flush_threshold=1000)
+    counter.increment(4)
+    # close() is what the atexit hook runs
+    counter.close()
+    assert answers(mongo_client) == 1004
+    assert counter.pending == 0
+
+def test_increments_beyond_max_unflushed_are_dropped(mongo_client):
+    counter = AnswerCounterAggregator(mongo_client, flush_interval=60, flush_threshold=1000, max_unflushed=10)
+    counter.increment(8)
+    counter.increment(5)
+    assert counter.dropped == 3
+    counter.close()
+    assert answers(mongo_client) == 1010
+
+def test_increment_waits_for_the_flush_at_max_crash_loss(mongo_client):
+    counter = AnswerCounterAggregator(mongo_client, flush_interval=60, flush_threshold=1000, max_crash_loss=5)
+    for _ in range(5):
+        counter.increment()
+    # The fifth increment returned only once the flush had written it
+    assert answers(mongo_client) == 1005
+    assert counter.pending == 0
+    counter.close()
+
+def test_no_wait_at_max_crash_loss_while_flushes_fail(mongo_client):
+    class FailingClient:
+        def __getitem__(self, name):
+            raise ConnectionError('MongoDB is down')
+
+    counter = AnswerCounterAggregator(FailingClient(), flush_interval=60, flush_threshold=1000, max_crash_loss=2)
+    counter.increment(2)
+    started = time.monotonic()
+    counter.increment(3)
+    assert time.monotonic() - started < 1
+    assert counter.pending == 5
+    counter.close()
@@ -0,0 +1,91 @@
+import time
+
+import pytest
+from pymongo.errors import DuplicateKeyError, ServerSelectionTimeoutError
+
+from helper_core import SevyCore
+from helper_mongodb import MongoCircuitBreaker, MongoUnavailable
+
+def outage():
+    raise ServerSelectionTimeoutError('no servers available')
+
+def trip(breaker):
+    for _ in range(breaker.failure_threshold):
+        with pytest.raises(MongoUnavailable):
+            breaker.call(outage)
+
+class Calls:
+    def __init__(self, result = 'ok'):
+        self.count = 0
+        self.result = result
+
+    def __call__(self):
+        self.count += 1
+        return self.result
+
+def test_opens_after_failure_threshold_and_fails_fast():
+    breaker = MongoCircuitBreaker(failure_threshold=2, reset_timeout=60, enabled=True)
+    trip(breaker)
+    assert breaker.state == 'open'
+    assert breaker.is_open()
+
+    calls = Calls()
+    with pytest.raises(MongoUnavailable) as rejected:
+        breaker.call(calls)
+    assert calls.count == 0
+    assert 1 <= rejected.value.retry_after <= 60
+    assert breaker.stats()['rejected'] == 1
+
+def test_half_open_trial_success_closes():
+    breaker = MongoCircuitBreaker(failure_threshold=1, reset_timeout=0.05, enabled=True)
+    trip(breaker)
+    time.sleep(0.06)
+    assert not breaker.is_open()
+
+    assert breaker.call(Calls('back')) == 'back'
+    assert breaker.state == 'closed'
+    stats = breaker.stats()
+    assert (stats['opened'], stats['half_opened'], stats['closed']) == (1, 1, 1)
+
+def test_half_open_trial_failure_reopens():
+    breaker = MongoCircuitBreaker(failure_threshold=1, reset_timeout=0.05, enabled=True)
+    trip(breaker)
+    time.sleep(0.06)
+
+    with pytest.raises(MongoUnavailable):
+        breaker.call(outage)
+    assert breaker.state == 'open'
+    assert breaker.stats()['opened'] == 2
+
+def test_server_errors_do_not_count_as_outages():
+    breaker = MongoCircuitBreaker(failure_threshold=1, reset_timeout=60, enabled=True)
+
+    def duplicate():
+        raise DuplicateKeyError('E11000 duplicate key')
+
+    with pytest.raises(DuplicateKeyError):
+        breaker.call(duplicate)
+    assert breaker.state == 'closed'
+
+def test_degraded_responses_while_open(mongo_client):
+    core = SevyCore(None, mongo_client)
+    assert core.all_numbers() == {'sevy_educators_number': 7, 'sevy_ai_answers': 1000, 'students_taught': 500}
+
+    trip(core.mongo_breaker)
+    core.stats_cache.invalidate('sevy_numbers')
+
+    # Stats: the last known numbers
+    assert core.all_numbers() == {'sevy_educators_number': 7, 'sevy_ai_answers': 1000, 'students_taught': 500}
+
+    # Forms: 503 database_unavailable with Retry-After, nothing written
+    payload, status, headers = core.subscribe_email({'email': 'student@example.org'}, '203.0.113.5')
+    assert status == 503
+    assert payload['error'] == 'database_unavailable'
+    assert headers['Retry-After'] == str(payload['retryAfter'])
+    assert mongo_client['SEVY_database']['SEVY_email_list'].count_documents({}) == 0
+
+    # Answer counts stay buffered until MongoDB is back
+    core.answer_counter.increment()
+    assert core.answer_counter.flush() == 0
+    assert core.answer_counter.pending == 1
+    core.answer_counter.close()
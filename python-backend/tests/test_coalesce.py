@@ -0,0 +1,156 @@
+import asyncio
+import threading
+import time
+
+import pytest
+
+from helper_coalesce import ChatCoalescer, coalesce_key
+
+KEY = coalesce_key([{'role': 'user', 'content': 'What is puberty?'}], 'model')
+
+class SlowCall:
+    """Returns `reply` once release is set, counting the calls."""
+
+    def __init__(self, reply = 'shared reply', error = None):
+        self.reply = reply
+        self.error = error
+        self.calls = 0
+        self.started = threading.Event()
+        self.release = threading.Event()
+
+    def __call__(self):
+        self.calls += 1
+        self.started.set()
+        self.release.wait(2)
+        if self.error is not None:
+            raise self.error
+        return self.reply
+
+def run_concurrently(coalescer, call, chats):
+    results = [None] * chats
+    errors = [None] * chats
+
+    def chat(number):
+        try:
+            results[number] = coalescer.run(KEY, call)
+        except Exception as e:
+            errors[number] = e
+
+    first = threading.Thread(target=chat, args=(0,))
+    first.start()
+    call.started.wait(2)
+    others = [threading.Thread(target=chat, args=(number,)) for number in range(1, chats)]
+    for thread in others:
+        thread.start()
+    # Every follower has joined the flight before the call returns
+    deadline = time.monotonic() + 2
+    while coalescer._flights[('blocking', KEY)].subscribers < chats and time.monotonic() < deadline:
+        time.sleep(0.001)
+    call.release.set()
+    for thread in [first] + others:
+        thread.join(2)
+    return results, errors
+
+def test_identical_concurrent_chats_share_one_call():
+    coalescer = ChatCoalescer(window=1, enabled=True)
+    call = SlowCall()
+
+    results, errors = run_concurrently(coalescer, call, 4)
+    assert call.calls == 1
+    assert errors == [None] * 4
+    assert results[0] == ('shared reply', False)
+    assert results[1:] == [('shared reply', True)] * 3
+    assert coalescer.stats()['saved_blocking'] == 3
+
+def test_different_conversations_are_not_shared():
+    coalescer = ChatCoalescer(window=1, enabled=True)
+    other = coalesce_key([{'role': 'user', 'content': 'What is consent?'}], 'model')
+
+    assert coalescer.run(KEY, lambda: 'a') == ('a', False)
+    assert coalescer.run(other, lambda: 'b') == ('b', False)
+    assert coalescer.stats()['upstream_calls'] == 2
+
+def test_finished_reply_is_joined_within_the_window_and_dropped_after():
+    coalescer = ChatCoalescer(window=0.1, enabled=True)
+    assert coalescer.run(KEY, lambda: 'first') == ('first', False)
+    assert coalescer.run(KEY, lambda: 'second') == ('first', True)
+
+    # Dropped on time by the expiry thread, without another chat arriving
+    time.sleep(0.25)
+    assert coalescer.stats()['entries'] == 0
+    assert coalescer.run(KEY, lambda: 'third') == ('third', False)
+
+def test_finished_reply_expires_behind_a_stuck_call():
+    coalescer = ChatCoalescer(window=0.1, enabled=True)
+    stuck = SlowCall()
+    other = coalesce_key([{'role': 'user', 'content': 'What is consent?'}], 'model')
+
+    thread = threading.Thread(target=coalescer.run, args=(KEY, stuck))
+    thread.start()
+    stuck.started.wait(2)
+    assert coalescer.run(other, lambda: 'done') == ('done', False)
+
+    time.sleep(0.25)
+    assert coalescer.stats()['entries'] == 1
+    assert coalescer.run(other, lambda: 'again') == ('again', False)
+
+    stuck.release.set()
+    thread.join(2)
+
+def test_error_reaches_every_waiting_chat_and_is_not_reused():
+    coalescer = ChatCoalescer(window=5, enabled=True)
+    call = SlowCall(error=ValueError('upstream failed'))
+
+    results, errors = run_concurrently(coalescer, call, 3)
+    assert call.calls == 1
+    assert all(isinstance(error, ValueError) for error in errors)
+    assert coalescer.stats()['entries'] == 0
+
+    # A failed call is never served from the window
+    assert coalescer.run(KEY, lambda: 'retry') == ('retry', False)
+
+def test_shared_stream_replays_missed_deltas_and_propagates_errors():
+    coalescer = ChatCoalescer(window=1, enabled=True)
+    gate = threading.Event()
+
+    def deltas():
+        yield 'Hel'
+        gate.wait(2)
+        yield 'lo'
+        raise ValueError('stream broke')
+
+    first, shared = coalescer.stream(KEY, deltas)
+    assert not shared
+    assert next(first) == 'Hel'
+    late, shared = coalescer.stream(KEY, deltas)
+    assert shared
+    gate.set()
+
+    def rest(stream):
+        received = []
+        with pytest.raises(ValueError):
+            for delta in stream:
+                received.append(delta)
+        return received
+
+    assert rest(first) == ['lo']
+    # The late chat first gets the delta it missed
+    assert rest(late) == ['Hel', 'lo']
+    assert coalescer.stats()['upstream_calls'] == 1
+
+def test_async_chats_share_one_call():
+    coalescer = ChatCoalescer(window=1, enabled=True)
+    calls = []
+
+    async def generate():
+        calls.append(1)
+        await asyncio.sleep(0.05)
+        return 'async reply'
+
+    async def main():
+        return await asyncio.gather(*(coalescer.run_async(KEY, generate) for _ in range(3)))
+
+    results = asyncio.run(main())
+    assert len(calls) == 1
+    assert sorted(shared for _, shared in results) == [False, True, True]
+    assert {reply for reply, _ in results} == {'async reply'}
@@ -0,0 +1,83 @@
+import pytest
+from pymongo.errors import DuplicateKeyError
+
+from helper_mongodb import (
+    COUNTER_SHARD_INDEX_NAME, apply_daily_inflation, ensure_counter_shards, fold_counter_shards,
+    parse_sevy_numbers, sevy_numbers_pipeline, update_sevy_ai_number_of_questions_answered
+)
+
+def read_numbers(collection):
+    return parse_sevy_numbers(collection.aggregate(sevy_numbers_pipeline()))
+
+def shard_total(collection, field):
+    return sum(doc.get(field, 0) for doc in collection.find({'counter_shard': {'$exists': True}}))
+
+def test_shards_are_created_once(numbers_collection):
+    assert ensure_counter_shards(numbers_collection, shards=4) == 4
+    assert ensure_counter_shards(numbers_collection, shards=4) == 0
+    assert numbers_collection.count_documents({'counter_shard': {'$exists': True}}) == 4
+    # Creating the shards does not change the numbers
+    assert read_numbers(numbers_collection)['sevy_ai_answers'] == 1000
+
+def test_answers_are_base_plus_shards(mongo_client, numbers_collection):
+    ensure_counter_shards(numbers_collection, shards=4)
+    for amount in (1, 2, 3, 4, 5):
+        update_sevy_ai_number_of_questions_answered(amount, client=mongo_client, shards=4)
+
+    assert shard_total(numbers_collection, 'sevy_ai_answers_delta') == 15
+    assert read_numbers(numbers_collection) == {
+        'sevy_educators_number': 7, 'sevy_ai_answers': 1015, 'students_taught': 500
+    }
+
+def test_fold_moves_the_shards_into_the_base(mongo_client, numbers_collection):
+    ensure_counter_shards(numbers_collection, shards=4)
+    for _ in range(12):
+        update_sevy_ai_number_of_questions_answered(1, client=mongo_client, shards=4)
+
+    assert fold_counter_shards(numbers_collection) == (12, 12)
+    assert shard_total(numbers_collection, 'sevy_ai_answers_delta') == 0
+    assert numbers_collection.find_one({'sevy_ai_answers': {'$exists': True}})['sevy_ai_answers'] == 1012
+    assert numbers_collection.find_one({'sevy_ai_real_answers': {'$exists': True}})['sevy_ai_real_answers'] == 22
+    # The sum read by the endpoints is the same before and after the fold
+    assert read_numbers(numbers_collection)['sevy_ai_answers'] == 1012
+
+    # Answers counted after the fold add up again
+    update_sevy_ai_number_of_questions_answered(3, client=mongo_client, shards=4)
+    assert read_numbers(numbers_collection)['sevy_ai_answers'] == 1015
+    assert fold_counter_shards(numbers_collection) == (3, 3)
+    assert read_numbers(numbers_collection)['sevy_ai_answers'] == 1015
+
+def test_shard_numbers_are_unique(numbers_collection):
+    ensure_counter_shards(numbers_collection, shards=4)
+    assert COUNTER_SHARD_INDEX_NAME in numbers_collection.index_information()
+    with pytest.raises(DuplicateKeyError):
+        numbers_collection.insert_one({'counter_shard': 0, 'sevy_ai_answers_delta': 0})
+
+def test_duplicate_shards_are_merged_before_indexing(numbers_collection):
+    numbers_collection.insert_many([
+        {'counter_shard': 0, 'sevy_ai_answers_delta': 2, 'sevy_ai_real_answers_delta': 2},
+        {'counter_shard': 0, 'sevy_ai_answers_delta': 3, 'sevy_ai_real_answers_delta': 3}
+    ])
+    ensure_counter_shards(numbers_collection, shards=2)
+    assert numbers_collection.count_documents({'counter_shard': 0}) == 1
+    assert read_numbers(numbers_collection)['sevy_ai_answers'] == 1005
+
+def test_daily_inflation_claims_and_applies_in_one_update(numbers_collection):
+    ensure_counter_shards(numbers_collection, shards=4)
+    numbers_collection.update_one({'counter_shard': 1}, {'$inc': {'sevy_ai_answers_delta': 100}})
+    numbers_collection.update_one({'sevy_ai_last_inflation_date': {'$exists': True}},
+                                  {'$set': {'sevy_ai_last_inflation_date': '2000-01-01'}})
+
+    previous, rate = apply_daily_inflation(numbers_collection, '2000-01-02')
+    assert previous == 1100
+    claim = numbers_collection.find_one({'sevy_ai_last_inflation_date': {'$exists': True}})
+    assert claim['sevy_ai_last_inflation_date'] == '2000-01-02'
+    assert read_numbers(numbers_collection)['sevy_ai_answers'] == int(1100 * (1 + rate))
+
+    # Claimed for the day: a second call changes nothing
+    assert apply_daily_inflation(numbers_collection, '2000-01-02') is None
+    assert read_numbers(numbers_collection)['sevy_ai_answers'] == int(1100 * (1 + rate))
+
+    # Folding moves the inflation into the base document too
+    fold_counter_shards(numbers_collection)
+    assert numbers_collection.find_one({'sevy_ai_answers': {'$exists': True}})['sevy_ai_answers'] == int(1100 * (1 + rate))
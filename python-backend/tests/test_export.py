@@ -0,0 +1,89 @@
+import csv
+import io
+import json
+from datetime import datetime
+
+import mongomock
+import pytest
+from bson import ObjectId
+
+from helper_export import (
+    ExportFormatter, decode_checkpoint, encode_checkpoint, export_cursor, parse_export_time, stream_export
+)
+
+def applications(count = 7):
+    database = mongomock.MongoClient()['SEVY_database']
+    documents = [{'fullName': f'Applicant {number}', 'email': f'a{number}@example.org', 'phoneNumber': '1',
+                  'education': 'x', 'division': 'y', 'ipAddress': '203.0.113.7',
+                  'submittedAt': datetime(2024, 1, 1 + number % 3, 12, 0)}
+                 for number in range(count)]
+    # Older documents: the time as a string, or no time at all
+    documents[1]['submittedAt'] = '2023-05-01 10:00'
+    del documents[2]['submittedAt']
+    database['SEVY_applications'].insert_many(documents)
+    return database
+
+def export(database, export_format = 'csv', **query):
+    formatter = ExportFormatter('applications', export_format)
+    text = ''.join(stream_export(export_cursor(database, 'applications', **query), formatter, batch_size=2))
+    return text, formatter.last_checkpoint
+
+def csv_rows(text):
+    return list(csv.DictReader(io.StringIO(text)))
+
+@pytest.mark.parametrize('timestamp', [datetime(2024, 1, 2, 3, 4, 5, 600000), '2023-05-01 10:00', 'a_b', None])
+def test_checkpoint_round_trip(timestamp):
+    document_id = ObjectId()
+    assert decode_checkpoint(encode_checkpoint(timestamp, document_id)) == (timestamp, document_id)
+
+def test_malformed_checkpoint_is_rejected():
+    with pytest.raises(ValueError):
+        decode_checkpoint('no-separator')
+
+def test_rows_come_in_bson_order_without_ip_addresses():
+    rows = csv_rows(export(applications())[0])
+    assert len(rows) == 7
+    assert 'ipAddress' not in rows[0]
+    # missing, then string, then dates
+    assert rows[0]['submittedAt'] == ''
+    assert rows[1]['submittedAt'] == '2023-05-01 10:00'
+    assert all(row['submittedAt'].endswith('Z') for row in rows[2:])
+
+def test_resuming_from_every_checkpoint_neither_skips_nor_repeats():
+    database = applications()
+    full = [row['_id'] for row in csv_rows(export(database)[0])]
+
+    resumed, after = [], None
+    while True:
+        text, checkpoint = export(database, after=after, limit=1)
+        rows = csv_rows(text)
+        if not rows:
+            break
+        resumed += [row['_id'] for row in rows]
+        assert checkpoint == rows[-1]['checkpoint']
+        after = checkpoint
+    assert resumed == full
+
+def test_since_and_until_select_dated_rows():
+    rows = csv_rows(export(applications(), since=parse_export_time('2024-01-02'),
+                           until=parse_export_time('2024-01-03T00:00:00Z'))[0])
+    assert {row['submittedAt'] for row in rows} == {'2024-01-02T12:00:00Z'}
+
+def test_csv_cells_that_look_like_formulas_are_quoted():
+    database = mongomock.MongoClient()['SEVY_database']
+    names = ['=HYPERLINK("http://evil.example")', '+1 555', '-2', '@SUM(A1)', '\tTab', 'Nguyễn Văn A']
+    database['SEVY_applications'].insert_many([{'fullName': name, 'submittedAt': datetime(2024, 1, 1)}
+                                               for name in names])
+    rows = csv_rows(export(database)[0])
+    assert sorted(row['fullName'] for row in rows) == sorted(
+        ["'" + name for name in names[:5]] + ['Nguyễn Văn A'])
+
+    # NDJSON keeps the values as stored
+    text, _ = export(database, 'ndjson')
+    assert sorted(json.loads(line)['fullName'] for line in text.splitlines()) == sorted(names)
+
+def test_unknown_export_or_format_is_rejected():
+    with pytest.raises(ValueError):
+        ExportFormatter('applications', 'xlsx')
+    with pytest.raises(ValueError):
+        ExportFormatter('passwords', 'csv')
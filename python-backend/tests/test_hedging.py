@@ -0,0 +1,105 @@
+import asyncio
+import threading
+import time
+
+import pytest
+
+from helper_admission import AdmissionController
+from helper_hedging import HEDGE_MIN_SAMPLES, Deadline, Hedger
+
+def hedger(admission = None):
+    admission = admission or AdmissionController(max_concurrency=4, requests_per_minute=0, tokens_per_minute=0)
+    hedging = Hedger(admission, enabled=True, percentile=50, budget_percent=100, min_delay=0.01)
+    for _ in range(HEDGE_MIN_SAMPLES):
+        hedging._observe('blocking', 0.01)
+    return hedging
+
+def wait_until(condition, timeout = 2):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, 'timed out'
+        time.sleep(0.001)
+
+class SlowFirstAttempt:
+    """The first call waits for `release`, every later one answers at once."""
+
+    def __init__(self):
+        self.calls = 0
+        self.release = threading.Event()
+
+    def __call__(self):
+        self.calls += 1
+        if self.calls == 1:
+            self.release.wait(2)
+            return 'primary'
+        return 'hedge'
+
+def test_no_hedge_before_enough_calls_were_timed():
+    hedging = Hedger(AdmissionController(max_concurrency=4), enabled=True)
+    assert hedging.hedge_delay('blocking') is None
+    assert hedging.run('blocking', lambda: 'answer') == ('answer', False)
+    assert hedging.stats()['hedged'] == 0
+
+def test_slow_call_is_hedged_and_the_hedge_wins():
+    hedging = hedger()
+    attempt = SlowFirstAttempt()
+
+    assert hedging.run('blocking', attempt) == ('hedge', True)
+    assert attempt.calls == 2
+    assert hedging.stats()['hedge_wins'] == 1
+    attempt.release.set()
+
+def test_hedge_slot_is_held_until_the_losing_request_returns():
+    admission = AdmissionController(max_concurrency=4, requests_per_minute=0, tokens_per_minute=0)
+    hedging = hedger(admission)
+    attempt = SlowFirstAttempt()
+    discarded = []
+
+    assert hedging.run('blocking', attempt, discard=discarded.append) == ('hedge', True)
+    # The primary request is still running on its thread
+    assert admission.stats()['in_flight'] == 1
+    assert hedging.stats()['hedges_in_flight'] == 0
+
+    attempt.release.set()
+    wait_until(lambda: admission.stats()['in_flight'] == 0)
+    wait_until(lambda: discarded == ['primary'])
+
+def test_error_is_raised_when_both_attempts_fail():
+    hedging = hedger()
+    release = threading.Event()
+
+    def failing():
+        release.wait(0.05)
+        raise ValueError('upstream failed')
+
+    with pytest.raises(ValueError):
+        hedging.run('blocking', failing)
+    assert hedging.stats()['hedges_in_flight'] == 0
+
+def test_async_hedge_cancels_the_losing_request():
+    admission = AdmissionController(max_concurrency=4, requests_per_minute=0, tokens_per_minute=0)
+    hedging = hedger(admission)
+    cancelled = []
+    calls = []
+
+    async def attempt():
+        calls.append(len(calls))
+        if len(calls) == 1:
+            try:
+                await asyncio.sleep(2)
+            except asyncio.CancelledError:
+                cancelled.append(True)
+                raise
+            return 'primary'
+        return 'hedge'
+
+    assert asyncio.run(hedging.run_async('blocking', attempt)) == ('hedge', True)
+    assert cancelled == [True]
+    assert admission.stats()['in_flight'] == 0
+    assert hedging.stats()['hedges_in_flight'] == 0
+
+def test_deadline_caps_the_attempt_timeout():
+    assert Deadline(total=60, attempt=30).attempt_timeout() == 30
+    assert Deadline(total=5, attempt=30).attempt_timeout() <= 5
+    with pytest.raises(TimeoutError):
+        Deadline(total=0).attempt_timeout()
@@ -0,0 +1,65 @@
+from helper_rate_limit import InProcessRateLimitBackend, RateLimiter, client_address, client_id
+
+ADDRESS = '203.0.113.7'
+
+def limiter(chat = 3, forms = 2, address_factor = 2):
+    rules = {'chat': (chat, 60), 'subscribe_email': (forms, 3600), 'submit_application': (forms, 3600)}
+    return RateLimiter(rules=rules, backend=InProcessRateLimitBackend(), enabled=True,
+                       address_factor=address_factor)
+
+def ids(count):
+    return [f'tab-{number:016d}' for number in range(count)]
+
+def test_client_over_the_limit_gets_a_retry_after():
+    rate_limiter = limiter()
+    assert [rate_limiter.check('chat', ADDRESS) for _ in range(3)] == [0, 0, 0]
+    assert rate_limiter.check('chat', ADDRESS) >= 1
+    assert rate_limiter.check('chat', '198.51.100.1') == 0
+    assert rate_limiter.stats()['rejected'] == {'chat': 1}
+
+def test_chat_client_ids_behind_one_address_are_limited_separately_up_to_the_cap():
+    rate_limiter = limiter(chat=3, address_factor=2)
+    first, second, third = ids(3)
+    for tab in (first, second):
+        assert [rate_limiter.check('chat', ADDRESS, tab) for _ in range(3)] == [0, 0, 0]
+    # A new ID does not lift the cap of the address (2 x 3 chats)
+    assert rate_limiter.check('chat', ADDRESS, third) >= 1
+
+def test_rotating_client_ids_cannot_bypass_the_address_cap():
+    rate_limiter = limiter(chat=3, address_factor=2)
+    allowed = sum(rate_limiter.check('chat', ADDRESS, tab) == 0 for tab in ids(50))
+    assert allowed == 6
+
+def test_requests_rejected_by_the_address_cap_are_not_counted_for_the_client():
+    rate_limiter = limiter(chat=3, address_factor=1)
+    first, second = ids(2)
+    assert [rate_limiter.check('chat', ADDRESS, first) for _ in range(2)] == [0, 0]
+    # Rejected by the address cap only
+    assert rate_limiter.check('chat', ADDRESS, second) == 0
+    assert rate_limiter.check('chat', ADDRESS, second) >= 1
+    assert rate_limiter.check('chat', ADDRESS, second) >= 1
+    backend = rate_limiter.backend
+    assert backend._windows[('chat', f'{ADDRESS}#{second}')][1] == 1
+    assert backend._windows[('chat:address', ADDRESS)][1] == 3
+
+def test_forms_ignore_client_ids():
+    rate_limiter = limiter(forms=2)
+    for rule in ('subscribe_email', 'submit_application'):
+        assert rate_limiter.check(rule, ADDRESS, ids(1)[0]) == 0
+        assert rate_limiter.check(rule, ADDRESS, ids(2)[1]) == 0
+        assert rate_limiter.check(rule, ADDRESS, ids(3)[2]) >= 1
+
+def test_disabled_limiter_lets_everything_in():
+    rate_limiter = RateLimiter(rules={'chat': (1, 60)}, backend=InProcessRateLimitBackend(), enabled=False)
+    assert [rate_limiter.check('chat', ADDRESS) for _ in range(5)] == [0] * 5
+
+def test_client_address_trusts_only_the_configured_proxies():
+    assert client_address('10.0.0.1', '1.1.1.1, 203.0.113.7', trusted_proxies=1) == ADDRESS
+    assert client_address('10.0.0.1', '1.1.1.1, 203.0.113.7', trusted_proxies=0) == '10.0.0.1'
+    assert client_address('10.0.0.1', None, trusted_proxies=1) == '10.0.0.1'
+
+def test_malformed_client_ids_are_ignored():
+    assert client_id('short') is None
+    assert client_id('x' * 65) is None
+    assert client_id('bad id with spaces!!') is None
+    assert client_id('0b7c2f3e-6a4d-4f7e-9d21-5a1c9e0f2b38') == '0b7c2f3e-6a4d-4f7e-9d21-5a1c9e0f2b38'
@@ -0,0 +1,73 @@
+import pytest
+
+from helper_router import (
+    CHAT_CRISIS_MODEL, CHAT_ROUTINE_MODEL, GREETING_REPLIES, OUT_OF_SCOPE_REPLIES, classify_conversation,
+    mentions_crisis, route_chat
+)
+
+def user(*texts):
+    return [{'role': 'user', 'content': text} for text in texts]
+
+@pytest.mark.parametrize('text', [
+    'my boyfriend beats me',
+    'he hurts me',
+    'my dad touches me',
+    'I was forced to have sex',
+    'bạn trai đánh tôi',
+    'she keeps hitting me',
+    'I think I want to die',
+    'I was raped last year',
+    'tôi muốn tự tử',
+    'chồng tôi bạo hành tôi',
+    'em bị ép quan hệ',
+    'Mi padrastro abusó de mí',
+    'ich wurde vergewaltigt'
+])
+def test_crisis_mentions(text):
+    assert mentions_crisis(text)
+
+@pytest.mark.parametrize('text', [
+    'bảo hành điện thoại bao lâu?',
+    'từ từ thôi',
+    'beats me why the condom broke',
+    'will sex hurt me the first time?',
+    'my period hurts me every month',
+    'I hit my head',
+    'a forced smile',
+    'nước ép cam có tốt không',
+    'đánh giá sản phẩm',
+    'grape juice',
+    'How do I talk to my parents about therapists?'
+])
+def test_not_crisis(text):
+    assert not mentions_crisis(text)
+
+@pytest.mark.parametrize('messages, expected', [
+    (user('hi'), ('greeting', 'en')),
+    (user('xin chào'), ('greeting', 'vi')),
+    (user('What is the weather tomorrow?'), ('out_of_scope', 'en')),
+    (user('2 + 2'), ('out_of_scope', 'en')),
+    (user('What is puberty?'), ('routine', None)),
+    # receta / Rezept / ricetta also mean "prescription"
+    (user('¿Necesito receta para la píldora?'), ('routine', None)),
+    (user('Brauche ich ein Rezept für die Pille?'), ('routine', None)),
+    (user('Serve la ricetta per la pillola?'), ('routine', None)),
+    (user('receta de pastel de chocolate'), ('out_of_scope', 'es')),
+    # Not a greeting after the first message; a crisis stays a crisis
+    (user('hi', 'hello'), ('routine', None)),
+    (user('my boyfriend beats me', 'what is the weather?'), ('crisis', None)),
+    ([], ('routine', None))
+])
+def test_classify_conversation(messages, expected):
+    assert classify_conversation(messages) == expected
+
+def test_routes():
+    greeting = route_chat(user('hola'))
+    assert (greeting.reply, greeting.target, greeting.cacheable) == (GREETING_REPLIES['es'], 'canned', False)
+    assert route_chat(user('What is the capital of France?')).reply == OUT_OF_SCOPE_REPLIES['en']
+
+    crisis = route_chat(user('he hurts me'))
+    assert (crisis.model, crisis.reply, crisis.cacheable) == (CHAT_CRISIS_MODEL, None, False)
+
+    routine = route_chat(user('What is consent?'))
+    assert (routine.model, routine.cacheable) == (CHAT_ROUTINE_MODEL, True)
@@ -0,0 +1,104 @@
+import asyncio
+import threading
+import time
+
+import pytest
+
+from helper_cache import InProcessCacheBackend, StatsCache
+
+class Loader:
+    """Returns 1, 2, 3... counting the calls; optionally slow or failing."""
+
+    def __init__(self, delay = 0.0, error = None):
+        self.delay = delay
+        self.error = error
+        self.calls = 0
+
+    def __call__(self):
+        self.calls += 1
+        time.sleep(self.delay)
+        if self.error is not None:
+            raise self.error
+        return self.calls
+
+def cache(ttl = 30, stale_ttl = 300):
+    return StatsCache(ttl=ttl, stale_ttl=stale_ttl, backend=InProcessCacheBackend())
+
+def make_stale(stats_cache, key):
+    entry = stats_cache.backend.get(key)
+    entry['stored_at'] -= stats_cache.ttl + 1
+
+def wait_until(condition, timeout = 2):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, 'timed out'
+        time.sleep(0.005)
+
+def test_fresh_value_is_served_without_loading():
+    stats_cache = cache()
+    loader = Loader()
+    assert stats_cache.get('numbers', loader) == 1
+    assert stats_cache.get('numbers', loader) == 1
+    assert loader.calls == 1
+    assert stats_cache.stats()['hits'] == 1
+
+def test_stale_value_is_served_while_one_refresh_runs():
+    stats_cache = cache()
+    loader = Loader()
+    stats_cache.get('numbers', loader)
+    make_stale(stats_cache, 'numbers')
+
+    slow = Loader(delay=0.05)
+    assert [stats_cache.get('numbers', slow) for _ in range(3)] == [1, 1, 1]
+    wait_until(lambda: stats_cache.stats()['refreshes'] == 2)
+    assert slow.calls == 1
+    assert stats_cache.get('numbers', slow) == 1  # the refreshed value
+    assert stats_cache.stats()['stale_hits'] == 3
+
+def test_concurrent_misses_share_one_load():
+    stats_cache = cache()
+    loader = Loader(delay=0.05)
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(stats_cache.get('numbers', loader)))
+               for _ in range(5)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(2)
+    assert results == [1] * 5
+    assert loader.calls == 1
+    assert stats_cache.stats()['coalesced'] == 4
+
+def test_failed_load_serves_the_last_known_value():
+    stats_cache = cache(ttl=0, stale_ttl=0)
+    stats_cache.get('numbers', Loader())
+    assert stats_cache.get('numbers', Loader(error=RuntimeError('MongoDB is down'))) == 1
+    assert stats_cache.last_known('numbers') == 1
+    assert stats_cache.stats()['refresh_errors'] == 1
+
+def test_failed_load_without_a_previous_value_raises():
+    with pytest.raises(RuntimeError):
+        cache().get('numbers', Loader(error=RuntimeError('MongoDB is down')))
+
+def test_async_stale_refresh_runs_once_in_the_background():
+    stats_cache = cache()
+    calls = []
+
+    async def loader():
+        calls.append(len(calls))
+        await asyncio.sleep(0.01)
+        return len(calls)
+
+    async def scenario():
+        assert await stats_cache.get_async('numbers', loader) == 1
+        make_stale(stats_cache, 'numbers')
+        assert [await stats_cache.get_async('numbers', loader) for _ in range(3)] == [1, 1, 1]
+        # The refresh task is referenced until it is done
+        assert len(stats_cache._refresh_tasks) == 1
+        await asyncio.gather(*stats_cache._refresh_tasks)
+        await asyncio.sleep(0)
+        assert not stats_cache._refresh_tasks
+        assert await stats_cache.get_async('numbers', loader) == 2
+
+    asyncio.run(scenario())
+    assert len(calls) == 2
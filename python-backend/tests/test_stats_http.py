@@ -0,0 +1,33 @@
+from werkzeug.http import parse_etags, quote_etag
+
+from helper_cache import stats_cache_control, stats_etag
+from helper_core import stats_reply
+
+NUMBERS = {'sevy_educators_number': 7, 'sevy_ai_answers': 1000, 'students_taught': 500}
+
+def test_get_carries_an_etag_and_cache_control():
+    body, status, headers = stats_reply(NUMBERS, 'GET', parse_etags(None))
+    assert (body, status) == (NUMBERS, 200)
+    assert headers['ETag'] == quote_etag(stats_etag(NUMBERS))
+    assert headers['Cache-Control'].startswith('public, max-age=')
+
+def test_matching_if_none_match_gets_a_bodiless_304():
+    etag = quote_etag(stats_etag(NUMBERS))
+    for header in (etag, f'W/{etag}', f'"other", {etag}', '*'):
+        body, status, headers = stats_reply(NUMBERS, 'GET', parse_etags(header))
+        assert (body, status) == ('', 304)
+        assert headers['ETag'] == etag
+
+def test_changed_numbers_get_a_new_etag():
+    etag = quote_etag(stats_etag(NUMBERS))
+    changed = dict(NUMBERS, sevy_ai_answers=1001)
+    body, status, _ = stats_reply(changed, 'GET', parse_etags(etag))
+    assert (body, status) == (changed, 200)
+    # Key order does not matter
+    assert stats_etag(dict(reversed(list(NUMBERS.items())))) == stats_etag(NUMBERS)
+
+def test_missing_numbers_are_never_cached():
+    assert stats_cache_control(dict(NUMBERS, students_taught='N/A')) == 'no-store'
+
+def test_post_keeps_the_plain_reply():
+    assert stats_reply(NUMBERS, 'POST', parse_etags(None)) == NUMBERS
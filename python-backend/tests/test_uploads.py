@@ -0,0 +1,101 @@
+import asyncio
+import io
+
+import pytest
+from werkzeug.exceptions import RequestEntityTooLarge
+from werkzeug.formparser import parse_form_data
+from werkzeug.test import EnvironBuilder
+
+import app_async
+import helper_uploads
+from helper_uploads import DiscardedUpload, content_length_exceeds, discarding_stream_factory, uploaded_bytes
+
+REQUEST_LIMIT = 4096
+FILE_LIMIT = 2048
+
+@pytest.fixture(autouse=True)
+def small_limits(monkeypatch):
+    monkeypatch.setattr(helper_uploads, 'APPLICATION_MAX_CONTENT_LENGTH', REQUEST_LIMIT)
+    monkeypatch.setattr(helper_uploads, 'UPLOAD_MAX_FILE_BYTES', FILE_LIMIT)
+    monkeypatch.setattr(app_async, 'APPLICATION_MAX_CONTENT_LENGTH', REQUEST_LIMIT)
+
+def multipart(resume_size):
+    builder = EnvironBuilder(method='POST', data={
+        'fullName': 'Applicant', 'resume': (io.BytesIO(b'x' * resume_size), 'resume.pdf')
+    })
+    return builder.get_environ()
+
+def test_discarded_upload_counts_and_drops_the_data():
+    upload = DiscardedUpload(max_bytes=10)
+    upload.write(b'12345')
+    upload.write(b'67890')
+    assert upload.bytes_received == 10
+    assert upload.read() == b''
+    with pytest.raises(RequestEntityTooLarge):
+        upload.write(b'1')
+
+def test_declared_oversized_file_is_refused_before_reading():
+    with pytest.raises(RequestEntityTooLarge):
+        discarding_stream_factory(content_length=FILE_LIMIT + 1)
+    assert content_length_exceeds(REQUEST_LIMIT + 1)
+    assert not content_length_exceeds(REQUEST_LIMIT)
+    assert not content_length_exceeds(None)
+
+def test_parsed_resume_is_counted_but_not_kept():
+    _, form, files = parse_form_data(multipart(1500), stream_factory=discarding_stream_factory)
+    assert form['fullName'] == 'Applicant'
+    assert uploaded_bytes(files['resume']) == 1500
+    assert files['resume'].read() == b''
+
+def test_resume_over_the_file_limit_stops_the_parser():
+    with pytest.raises(RequestEntityTooLarge):
+        parse_form_data(multipart(FILE_LIMIT + 1), stream_factory=discarding_stream_factory, silent=False)
+
+def submit(body, headers):
+    async def scenario():
+        client = app_async.app.test_client()
+        response = await client.post('/submit_application', data=body, headers=headers)
+        return response.status_code, await response.get_json()
+    return asyncio.run(scenario())
+
+def multipart_body(resume_size):
+    environ = multipart(resume_size)
+    return environ['wsgi.input'].read(), {'Content-Type': environ['CONTENT_TYPE']}
+
+def test_oversized_request_gets_413_from_its_content_length():
+    body, headers = multipart_body(REQUEST_LIMIT)
+    assert submit(body, headers) == (413, {'success': False, 'error': 'file_too_large'})
+
+def test_oversized_resume_gets_413_while_it_is_parsed():
+    body, headers = multipart_body(FILE_LIMIT + 100)
+    assert len(body) < REQUEST_LIMIT
+    assert submit(body, headers) == (413, {'success': False, 'error': 'file_too_large'})
+
+def test_chunked_upload_is_capped_while_it_is_received(monkeypatch):
+    # Only the request limit applies: no Content-Length, no file limit
+    monkeypatch.setattr(helper_uploads, 'UPLOAD_MAX_FILE_BYTES', 10 * REQUEST_LIMIT)
+    body, headers = multipart_body(2 * REQUEST_LIMIT)
+    assert 'Content-Length' not in headers
+
+    async def scenario():
+        client = app_async.app.test_client()
+        async with client.request('/submit_application', method='POST', headers=headers) as connection:
+            for start in range(0, len(body), 1024):
+                await connection.send(body[start:start + 1024])
+            await connection.send_complete()
+        response = await connection.as_response()
+        return response.status_code, await response.get_json()
+
+    assert asyncio.run(scenario()) == (413, {'success': False, 'error': 'file_too_large'})
+
+def test_small_resume_is_accepted_without_storing_it(monkeypatch):
+    saved = []
+
+    async def submit_application_async(form, address):
+        saved.append(dict(form))
+        return {'success': True}, 200
+
+    monkeypatch.setattr(app_async.core, 'submit_application_async', submit_application_async)
+    body, headers = multipart_body(1500)
+    assert submit(body, headers) == (200, {'success': True})
+    assert saved == [{'fullName': 'Applicant'}]
@@ -0,0 +1,100 @@
+import mongomock
+import pytest
+from bson import ObjectId
+
+from helper_write_queue import WriteBehindQueue, WriteQueueFull
+
+class FlakyDatabase:
+    """SEVY_database whose bulk writes fail while `down` is set."""
+
+    def __init__(self, database):
+        self.database = database
+        self.down = True
+
+    def __getitem__(self, name):
+        if self.down:
+            raise ConnectionError('MongoDB is down')
+        return self.database[name]
+
+@pytest.fixture
+def database():
+    return mongomock.MongoClient()['SEVY_database']
+
+def write_queue(database, tmp_path, **settings):
+    # A long drain interval keeps the background drainer out of the way
+    settings = {'drain_interval': 60, 'batch_size': 100, **settings}
+    return WriteBehindQueue(database, path=str(tmp_path / 'queue.sqlite3'), **settings)
+
+def make_due(queue):
+    with queue._lock:
+        queue._db.execute('UPDATE pending SET next_attempt_at = 0')
+
+def test_queued_documents_are_written_on_drain(database, tmp_path):
+    queue = write_queue(database, tmp_path)
+    ids = [queue.enqueue('SEVY_applications', {'fullName': f'A{number}'}) for number in range(3)]
+    assert database['SEVY_applications'].count_documents({}) == 0
+
+    assert queue.drain() == 3
+    assert sorted(doc['_id'] for doc in database['SEVY_applications'].find()) == sorted(ids)
+    assert queue.stats()['depth'] == 0
+    queue.close()
+
+def test_failed_batch_is_kept_and_retried_with_backoff(database, tmp_path):
+    flaky = FlakyDatabase(database)
+    queue = write_queue(flaky, tmp_path)
+    queue.enqueue('SEVY_applications', {'fullName': 'A'})
+
+    assert queue.drain() == 0
+    with queue._lock:
+        attempts, next_attempt_at = queue._db.execute('SELECT attempts, next_attempt_at FROM pending').fetchone()
+    assert attempts == 1
+    # Not retried before its backoff has passed
+    flaky.down = False
+    assert queue.drain() == 0
+
+    make_due(queue)
+    assert queue.drain() == 1
+    assert database['SEVY_applications'].count_documents({}) == 1
+    assert queue.stats()['failed_batches'] == 1
+    queue.close()
+
+def test_retry_after_a_partial_write_creates_no_duplicates(database, tmp_path):
+    queue = write_queue(database, tmp_path)
+    written = queue.enqueue('SEVY_applications', {'fullName': 'A'})
+    queue.enqueue('SEVY_applications', {'fullName': 'B'})
+    # An earlier attempt wrote the first document, then failed
+    database['SEVY_applications'].insert_one({'_id': written, 'fullName': 'A'})
+
+    assert queue.drain() == 2
+    assert database['SEVY_applications'].count_documents({}) == 2
+    assert queue.stats()['depth'] == 0
+    queue.close()
+
+def test_subscriptions_are_merged_on_the_normalized_email(database, tmp_path):
+    queue = write_queue(database, tmp_path)
+    for _ in range(2):
+        queue.enqueue('SEVY_email_list', {'email': 'A@Example.org', 'emailNormalized': 'a@example.org'},
+                      key_field='emailNormalized')
+    assert queue.drain() == 2
+    assert database['SEVY_email_list'].count_documents({'emailNormalized': 'a@example.org'}) == 1
+    queue.close()
+
+def test_full_queue_refuses_new_documents(database, tmp_path):
+    queue = write_queue(database, tmp_path, max_depth=2)
+    queue.enqueue('SEVY_applications', {'fullName': 'A'})
+    queue.enqueue('SEVY_applications', {'fullName': 'B'})
+    with pytest.raises(WriteQueueFull):
+        queue.enqueue('SEVY_applications', {'fullName': 'C'})
+    assert queue.stats()['rejected'] == 1
+    queue.close()
+
+def test_documents_outlive_the_process_that_queued_them(database, tmp_path):
+    queue = write_queue(FlakyDatabase(database), tmp_path)
+    document_id = queue.enqueue('SEVY_applications', {'_id': ObjectId(), 'fullName': 'A'})
+    queue.close()
+
+    restarted = write_queue(database, tmp_path)
+    make_due(restarted)
+    assert restarted.drain() == 1
+    assert database['SEVY_applications'].find_one({'_id': document_id})['fullName'] == 'A'
+    restarted.close()